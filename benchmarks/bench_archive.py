@@ -0,0 +1,51 @@
+'''
+Measures the time to build the archive of a function from a directory, e.g.
+a site-packages, the way it was built before (copying the files to a temporary
+directory, zipping them to a temporary file with `shutil.make_archive` and
+reading it back) and with `ArchiveBuilder`.
+
+    $ python benchmarks/bench_archive.py /path/to/site-packages --workers 8
+'''
+import time
+import shutil
+import pathlib
+import argparse
+import tempfile
+
+from lambdapool.build import ArchiveBuilder
+
+def copy_and_make_archive(directory, workers):
+    with tempfile.TemporaryDirectory() as tempdir:
+        shutil.copytree(directory, pathlib.Path(tempdir) / 'build' / directory.name)
+        with tempfile.NamedTemporaryFile() as temparchive:
+            archive = shutil.make_archive(temparchive.name, 'zip', pathlib.Path(tempdir) / 'build')
+            data = pathlib.Path(archive).read_bytes()
+            pathlib.Path(archive).unlink()
+            return data
+
+def archive_builder(directory, workers):
+    builder = ArchiveBuilder(workers=workers)
+    builder.add_path(directory)
+    return builder.build()
+
+def measure(benchmark, directory, workers):
+    start = time.perf_counter()
+    archive = benchmark(directory, workers)
+    return time.perf_counter() - start, len(archive)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('directory', type=pathlib.Path)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    before, before_size = measure(copy_and_make_archive, args.directory, args.workers)
+    after, after_size = measure(archive_builder, args.directory, args.workers)
+
+    print(f'directory={args.directory} workers={args.workers or "cpu_count"}')
+    print(f'copy and make_archive: {before:.2f} s, {before_size / 2**20:.1f} MB')
+    print(f'ArchiveBuilder:        {after:.2f} s, {after_size / 2**20:.1f} MB')
+    print(f'speedup:               {before/after:.1f}x')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+'''
+Measures the latency of small maps against a local stand-in of the Invoke API,
+when every thread of every map creates its own boto3 client, as before, and
+when the pool shares one client.
+
+    $ python benchmarks/bench_client.py --maps 200 --workers 4
+'''
+import json
+import time
+import argparse
+import threading
+import statistics
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import boto3
+from botocore.client import Config
+
+from lambdapool import LambdaPool
+from lambdapool.pool import Context
+from lambdapool.agent import lambda_handler
+
+class InvokeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        event = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        body = json.dumps(lambda_handler(event, None)).encode('ascii')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class InvokeServer(ThreadingHTTPServer):
+    request_queue_size = 1024
+    daemon_threads = True
+
+def new_client(endpoint_url):
+    return boto3.client(
+        'lambda',
+        endpoint_url=endpoint_url,
+        aws_access_key_id='benchmark',
+        aws_secret_access_key='benchmark',
+        region_name='us-east-1',
+        config=Config(retries={'max_attempts': 0})
+    )
+
+class PerThreadClientContext(Context):
+    '''The clients as they were before being shared: one per thread and per map
+    '''
+    @property
+    def lambda_client(self):
+        if not hasattr(self.local, 'client'):
+            self.local.client = new_client(self.endpoint_url)
+        return self.local.client
+
+def run_maps(pool, maps, workers, client_per_map):
+    latencies = []
+    if client_per_map:
+        pool.context.__class__ = PerThreadClientContext
+    for _ in range(maps):
+        pool.context.local = threading.local()
+        start = time.perf_counter()
+        pool.map(abs, range(-workers, 0))
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--maps', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    server = InvokeServer(('127.0.0.1', 0), InvokeHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoint_url = f'http://127.0.0.1:{server.server_address[1]}'
+
+    for label, client_per_map in [('client per thread and map', True), ('shared client', False)]:
+        pool = LambdaPool(
+            args.workers, 'benchmark',
+            aws_access_key_id='benchmark', aws_secret_access_key='benchmark',
+            aws_region_name='us-east-1', endpoint_url=endpoint_url
+        )
+        latencies = run_maps(pool, args.maps, args.workers, client_per_map)
+        print(f'{label:26} median {statistics.median(latencies)*1e3:.2f} ms per map of {args.workers} calls')
+
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
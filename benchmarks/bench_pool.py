@@ -0,0 +1,175 @@
+'''
+Measures the throughput of `LambdaPool.map`, `LambdaExecutor.map` and of
+`agent.lambda_handler` itself. For each case it reports the latency of the
+invocations, and the CPU time and peak memory of the client. The cases cover
+every combination of payload sizes, worker counts and chunk sizes.
+
+The invocations are served by the local stand-in of the Lambda API,
+`lambdapool.mock`, in a separate process, with the given cold start, latency
+and concurrency limit. Every case also runs in a process of its own, so that
+the CPU and memory of the client are measured on their own.
+
+    $ python benchmarks/bench_pool.py --items 2000 --payload-sizes 100 100000 --workers 4 32 --chunksizes 1 10
+    $ python benchmarks/bench_pool.py --latency 0.01 --cold-start 0.2 --json results.json
+'''
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import resource
+import itertools
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from tabulate import tabulate
+
+from lambdapool import LambdaPool, LambdaExecutor, agent
+from lambdapool.pool import Context, encode_payload, decode_response
+
+CLIENTS = ('pool', 'executor', 'handler')
+
+def echo(data):
+    return data
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))] if values else 0.0
+
+def record_latencies(client, latencies):
+    '''Appends the duration of every Invoke call of a boto3 client to `latencies`
+    '''
+    local = threading.local()
+
+    def before(**kwargs):
+        local.start = time.perf_counter()
+
+    def after(**kwargs):
+        latencies.append(time.perf_counter() - local.start)
+
+    client.meta.events.register('before-call.lambda.Invoke', before)
+    client.meta.events.register('after-call.lambda.Invoke', after)
+
+def run_pool(options, items, workers, chunksize, latencies):
+    with LambdaPool(workers, 'benchmark', **options) as pool:
+        record_latencies(pool.context.lambda_client, latencies)
+        return pool.map(echo, items, chunksize=chunksize)
+
+def run_executor(options, items, workers, chunksize, latencies):
+    with LambdaExecutor('benchmark', max_workers=workers, **options) as executor:
+        record_latencies(executor.context.lambda_client, latencies)
+        return list(executor.map(echo, items, chunksize=chunksize))
+
+def run_handler(options, items, workers, chunksize, latencies):
+    '''Encodes the events, runs the agent and decodes the results in this process
+    '''
+    context = Context('benchmark')
+
+    def call(item):
+        start = time.perf_counter()
+        event = encode_payload({'function': echo, 'args': [item], 'kwargs': {}}, context)
+        body = json.dumps(agent.lambda_handler(json.loads(json.dumps(event)), None)).encode('ascii')
+        result = decode_response(body, context)
+        latencies.append(time.perf_counter() - start)
+        return result
+
+    with ThreadPoolExecutor(workers) as executor:
+        return list(executor.map(call, items))
+
+RUNNERS = {'pool': run_pool, 'executor': run_executor, 'handler': run_handler}
+
+def run_case(case):
+    '''Runs one case in this process and returns its measurements
+    '''
+    options = dict(
+        aws_access_key_id='benchmark', aws_secret_access_key='benchmark',
+        aws_region_name='us-east-1', endpoint_url=case['endpoint_url']
+    )
+    payload = os.urandom(case['payload_size'])
+    items = [payload] * case['items']
+    latencies = []
+
+    cpu, start = time.process_time(), time.perf_counter()
+    results = RUNNERS[case['client']](options, items, case['workers'], case['chunksize'], latencies)
+    elapsed, cpu = time.perf_counter() - start, time.process_time() - cpu
+    assert len(results) == len(items) and results[0] == payload
+
+    return dict(
+        case,
+        throughput=len(items) / elapsed,
+        p50=percentile(latencies, 50) * 1000,
+        p99=percentile(latencies, 99) * 1000,
+        cpu=cpu,
+        cpu_per_item=cpu / len(items) * 1e6,
+        max_rss=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    )
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_mock_server(args):
+    port = free_port()
+    command = [
+        sys.executable, '-m', 'lambdapool.mock', '--port', str(port),
+        '--cold-start', str(args.cold_start), '--latency', str(args.latency),
+        '--concurrency', str(args.concurrency),
+    ]
+    server = subprocess.Popen(command, stdout=subprocess.PIPE)
+    server.stdout.readline()
+    return server, f'http://127.0.0.1:{port}'
+
+def cases(args, endpoint_url):
+    for client, payload_size, workers, chunksize in itertools.product(args.clients, args.payload_sizes, args.workers, args.chunksizes):
+        if client == 'handler' and chunksize != args.chunksizes[0]:
+            continue
+        yield dict(
+            client=client, payload_size=payload_size, workers=workers,
+            chunksize=1 if client == 'handler' else chunksize,
+            items=args.items, endpoint_url=endpoint_url,
+        )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=1000)
+    parser.add_argument('--clients', nargs='+', choices=CLIENTS, default=list(CLIENTS))
+    parser.add_argument('--payload-sizes', nargs='+', type=int, default=[100, 10000, 1000000])
+    parser.add_argument('--workers', nargs='+', type=int, default=[4, 16, 64])
+    parser.add_argument('--chunksizes', nargs='+', type=int, default=[1, 10])
+    parser.add_argument('--cold-start', type=float, default=0.0)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--concurrency', type=int, default=1000)
+    parser.add_argument('--json', help='Writes the measurements to this file')
+    parser.add_argument('--case', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        print(json.dumps(run_case(json.loads(args.case))))
+        return
+
+    server, endpoint_url = start_mock_server(args)
+    try:
+        results = []
+        for case in cases(args, endpoint_url):
+            output = subprocess.run([sys.executable, __file__, '--case', json.dumps(case)], stdout=subprocess.PIPE, check=True).stdout
+            results.append(json.loads(output))
+    finally:
+        server.terminate()
+        server.wait()
+
+    rows = [
+        [r['client'], r['payload_size'], r['workers'], r['chunksize'], f"{r['throughput']:.0f}",
+         f"{r['p50']:.2f}", f"{r['p99']:.2f}", f"{r['cpu_per_item']:.0f}", f"{r['max_rss']:.1f}"]
+        for r in results
+    ]
+    print(tabulate(rows, headers=['CLIENT', 'PAYLOAD', 'WORKERS', 'CHUNK', 'ITEMS/S', 'P50 MS', 'P99 MS', 'CPU US/ITEM', 'MAX RSS MB']))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+'''
+Measures the client CPU time spent encoding the payload of an invocation,
+when the function is pickled for every invocation and when it is pickled
+once per map.
+
+    $ python benchmarks/bench_serialization.py --items 5000 --closure-size 100000
+'''
+import time
+import argparse
+
+from lambdapool import agent
+from lambdapool.pool import Context, LambdaFunction, encode_payload
+
+def make_function(size):
+    lookup = {n: str(n) for n in range(size)}
+
+    def function(n):
+        return lookup.get(n)
+    return function
+
+def per_item_pickle(function, items, context):
+    for item in items:
+        # Payload as built before the function pickle was cached
+        agent.pack({'function': function, 'args': (item,), 'kwargs': {}}, context.codec, context.compress_threshold)
+
+def once_per_map_pickle(function, items, context):
+    f = LambdaFunction(context, function)
+    for item in items:
+        encode_payload(f.payload((item,), {}), context)
+
+def measure(benchmark, function, items, context):
+    start = time.process_time()
+    benchmark(function, items, context)
+    return (time.process_time() - start) / len(items)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=2000)
+    parser.add_argument('--closure-size', type=int, default=100000, help='Number of entries in the dictionary captured by the function')
+    parser.add_argument('--codec', default='none')
+    args = parser.parse_args()
+
+    context = Context('benchmark', codec=args.codec)
+    function = make_function(args.closure_size)
+    items = list(range(args.items))
+
+    before = measure(per_item_pickle, function, items, context)
+    after = measure(once_per_map_pickle, function, items, context)
+
+    print(f'items={args.items} closure_size={args.closure_size} codec={args.codec}')
+    print(f'pickle per item: {before*1e3:.3f} ms CPU per invocation')
+    print(f'pickle per map:  {after*1e3:.3f} ms CPU per invocation')
+    print(f'speedup:         {before/after:.1f}x')
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,7 @@
 from .pool import LambdaPool
 from .executor import LambdaExecutor
-from .agent import lambda_handler
+from .aio import AsyncLambdaPool
+from .hedging import HedgePolicy
+from .cache import MemoryCache, DiskCache
+from .agent import lambda_handler, S3BlobStore, LocalBlobStore, MemoryBlobStore
 from .version import __version__
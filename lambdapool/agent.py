@@ -5,24 +5,345 @@ This module is the agent which is copied over to the lambda function and
 acts as an entrypoint to the function package.
 
 '''
+import os
+import sys
+import uuid
 import importlib
 import base64
+import time
+import zlib
+import functools
+import collections
+import lzma
 import cloudpickle
 
+# Pickles with out-of-band buffers need protocol 5, built in from python 3.8
+if sys.version_info >= (3, 8):
+    import pickle as pickle5
+else:
+    try:
+        import pickle5
+    except ImportError:
+        pickle5 = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 VERSION = '0.9.7'
 
+# Number of unpickled functions kept by a warm container
+FUNCTION_CACHE_SIZE = 32
+
+CODECS = {
+    'none': (lambda data: data, lambda data: data),
+    'zlib': (zlib.compress, zlib.decompress),
+    'lzma': (lzma.compress, lzma.decompress),
+}
+
+if lz4 is not None:
+    CODECS['lz4'] = (lz4.frame.compress, lz4.frame.decompress)
+
+if zstandard is not None:
+    CODECS['zstd'] = (
+        lambda data: zstandard.ZstdCompressor().compress(data),
+        lambda data: zstandard.ZstdDecompressor().decompress(data)
+    )
+
+def pack(obj, codec: str='none', threshold: int=0):
+    '''Pickles and compresses `obj`.
+
+    The data is only compressed when the pickle is at least `threshold` bytes.
+    Returns a tuple of the compressed bytes, the codec actually used and the
+    size of the pickle.
+    '''
+    data = cloudpickle.dumps(obj)
+    size = len(data)
+    if codec != 'none' and size < threshold:
+        codec = 'none'
+
+    compress, _ = CODECS[codec]
+    return compress(data), codec, size
+
+def unpack(data: bytes, codec: str='none'):
+    '''Inverse of `pack`
+    '''
+    if codec not in CODECS:
+        raise ValueError(f'Unsupported codec {codec}')
+
+    _, decompress = CODECS[codec]
+    return cloudpickle.loads(decompress(data))
+
+def dumps(obj, codec: str='none', threshold: int=0):
+    '''Same as `pack`, but returns the data as a base64 string
+    '''
+    data, codec, size = pack(obj, codec, threshold)
+    return base64.b64encode(data).decode('ascii'), codec, size
+
+def loads(data: str, codec: str='none'):
+    '''Inverse of `dumps`
+    '''
+    return unpack(base64.b64decode(data), codec)
+
+def dumps_buffers(obj):
+    '''Pickles `obj` with protocol 5, leaving the contiguous buffers of arrays out of band.
+
+    Returns the pickle and the list of buffers, as memoryviews on the memory
+    of `obj`, so that they are not copied.
+    '''
+    if pickle5 is None:
+        raise ValueError('Out-of-band buffers need python 3.8 or the pickle5 package')
+    buffers = []
+    data = pickle5.dumps(obj, protocol=5, buffer_callback=buffers.append)
+    return data, [buffer.raw() for buffer in buffers]
+
+def loads_buffers(data: bytes, buffers: list):
+    '''Inverse of `dumps_buffers`. The arrays are built on the memory of `buffers`.
+    '''
+    if pickle5 is None:
+        raise ValueError('Out-of-band buffers need python 3.8 or the pickle5 package')
+    return pickle5.loads(data, buffers=buffers)
+
+def encode_buffers(obj, store=None, offload_threshold: int=0) -> dict:
+    '''Encodes `obj` as a pickle with out-of-band buffers for an event or a response.
+
+    The buffers are put in `store` as they are, if there is one and they are
+    larger than `offload_threshold` in total, and are base64 encoded otherwise.
+    The pickle itself, which holds the buffers that are not contiguous, is put
+    in `store` when its base64 encoding is larger than `offload_threshold`.
+    '''
+    data, buffers = dumps_buffers(obj)
+    encoded = {}
+    if store is not None and b64size(len(data)) > offload_threshold:
+        encoded['pickle_ref'] = store.put(data)
+    else:
+        encoded['pickle'] = base64.b64encode(data).decode('ascii')
+    if store is not None and sum(buffer.nbytes for buffer in buffers) > offload_threshold:
+        encoded['buffer_refs'] = [store.put(buffer) for buffer in buffers]
+    else:
+        encoded['buffers'] = [base64.b64encode(buffer).decode('ascii') for buffer in buffers]
+    return encoded
+
+def decode_buffers(encoded: dict, store=None, writable: bool=False):
+    '''Inverse of `encode_buffers`. The blobs in the store are not deleted.
+
+    The arrays are read-only, unless `writable` is set.
+    '''
+    if ('pickle_ref' in encoded or 'buffer_refs' in encoded) and store is None:
+        raise ValueError('The buffers are in a blob store but there is none')
+    if 'buffer_refs' in encoded:
+        buffers = [store.get(key) for key in encoded['buffer_refs']]
+    else:
+        buffers = [base64.b64decode(buffer) for buffer in encoded['buffers']]
+    if writable:
+        buffers = [bytearray(buffer) for buffer in buffers]
+    data = store.get(encoded['pickle_ref']) if 'pickle_ref' in encoded else base64.b64decode(encoded['pickle'])
+    return loads_buffers(data, buffers)
+
+def stored_keys(encoded: dict) -> list:
+    '''Returns the keys of the blobs `encode_buffers` put in the store
+    '''
+    return ([encoded['pickle_ref']] if 'pickle_ref' in encoded else []) + encoded.get('buffer_refs', [])
+
+def b64size(size: int) -> int:
+    '''Returns the length of the base64 encoding of `size` bytes
+    '''
+    return (size + 2) // 3 * 4
+
+class MemoryBlobStore:
+    '''Keeps the blobs in a dictionary of the current process.
+
+    Only useful when the agent runs in the same process as the client, as in tests.
+    '''
+    def __init__(self):
+        self.name = uuid.uuid4().hex
+        self.blobs = {}
+        _MEMORY_BLOB_STORES[self.name] = self
+
+    def spec(self):
+        return {'type': 'memory', 'name': self.name}
+
+    def put(self, data: bytes) -> str:
+        key = uuid.uuid4().hex
+        self.blobs[key] = bytes(data)
+        return key
+
+    def get(self, key: str) -> bytes:
+        return self.blobs[key]
+
+    def delete(self, key: str):
+        self.blobs.pop(key, None)
+
+class LocalBlobStore:
+    '''Keeps the blobs as files in a local directory
+    '''
+    def __init__(self, path: str):
+        self.path = os.path.abspath(path)
+        os.makedirs(self.path, exist_ok=True)
+
+    def spec(self):
+        return {'type': 'local', 'path': self.path}
+
+    def put(self, data: bytes) -> str:
+        key = uuid.uuid4().hex
+        with open(os.path.join(self.path, key), 'wb') as f:
+            f.write(data)
+        return key
+
+    def get(self, key: str) -> bytes:
+        with open(os.path.join(self.path, key), 'rb') as f:
+            return f.read()
+
+    def delete(self, key: str):
+        try:
+            os.remove(os.path.join(self.path, key))
+        except FileNotFoundError:
+            pass
+
+class S3BlobStore:
+    '''Keeps the blobs as objects in an S3 bucket.
+
+    The role of the lambda function needs read and write access to the bucket.
+    '''
+    def __init__(self, bucket: str, prefix: str='lambdapool/', **client_kwargs):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client_kwargs = client_kwargs
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import boto3
+            self._client = boto3.client('s3', **self.client_kwargs)
+        return self._client
+
+    def spec(self):
+        return {'type': 's3', 'bucket': self.bucket, 'prefix': self.prefix}
+
+    def put(self, data: bytes) -> str:
+        key = uuid.uuid4().hex
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        self.client.put_object(Bucket=self.bucket, Key=self.prefix+key, Body=data)
+        return key
+
+    def get(self, key: str) -> bytes:
+        return self.client.get_object(Bucket=self.bucket, Key=self.prefix+key)['Body'].read()
+
+    def delete(self, key: str):
+        self.client.delete_object(Bucket=self.bucket, Key=self.prefix+key)
+
+_MEMORY_BLOB_STORES = {}
+_BLOB_STORES = {}
+
+def open_blob_store(spec: dict):
+    '''Returns the blob store described by `spec`, as returned by `store.spec()`
+    '''
+    if spec['type'] == 'memory':
+        return _MEMORY_BLOB_STORES[spec['name']]
+
+    key = tuple(sorted(spec.items()))
+    if key not in _BLOB_STORES:
+        if spec['type'] == 'local':
+            _BLOB_STORES[key] = LocalBlobStore(spec['path'])
+        elif spec['type'] == 's3':
+            _BLOB_STORES[key] = S3BlobStore(spec['bucket'], spec['prefix'])
+        else:
+            raise ValueError(f'Unsupported blob store {spec["type"]}')
+    return _BLOB_STORES[key]
+
+_FUNCTION_CACHE = collections.OrderedDict()
+
+def resolve_function(payload: dict):
+    '''Returns the function to run for `payload`, or None when the payload
+    only has the digest of a function which is not in the cache.
+    '''
+    if 'function_ref' in payload:
+        return load_reference(payload['function_ref'])
+
+    digest = payload.get('function_digest')
+    if digest is None:
+        if 'function_pickle' in payload:
+            return cloudpickle.loads(payload['function_pickle'])
+        return payload['function']
+
+    if digest in _FUNCTION_CACHE:
+        _FUNCTION_CACHE.move_to_end(digest)
+        return _FUNCTION_CACHE[digest]
+
+    if 'function_pickle' not in payload:
+        return None
+
+    func = cloudpickle.loads(payload['function_pickle'])
+    _FUNCTION_CACHE[digest] = func
+    while len(_FUNCTION_CACHE) > FUNCTION_CACHE_SIZE:
+        _FUNCTION_CACHE.popitem(last=False)
+    return func
+
+_REFERENCE_CACHE = {}
+
+# Identifies the container, to count the distinct containers reached by warming
+CONTAINER_ID = uuid.uuid4().hex
+_COLD = True
+
+def load_reference(reference: str):
+    '''Loads a function from a reference of the format "module:function".
+
+    The function may also be an attribute path like "module:Class.method".
+    The older format "module.function" is also accepted.
+    '''
+    if reference not in _REFERENCE_CACHE:
+        if ':' in reference:
+            module_name, function_name = reference.split(':', 1)
+        else:
+            module_name, function_name = reference.rsplit('.', 1)
+
+        func = importlib.import_module(module_name)
+        for name in function_name.split('.'):
+            func = getattr(func, name)
+        _REFERENCE_CACHE[reference] = func
+
+    return _REFERENCE_CACHE[reference]
+
 def load_function(module_name: str, function_name: str):
     '''Loads a function from a module
     '''
-    module = importlib.import_module(module_name)
-    return getattr(module, function_name)
+    return load_reference(f'{module_name}:{function_name}')
 
 def lambda_handler(event: dict, context: dict):
     '''Entrypoint to handle the function invokation
 
     The `event` would be of the format:
 
-    <encoded cloudpickle>
+    {
+        "payload": <encoded cloudpickle>,
+        "codec": "zlib",            # Codec the payload is compressed with
+        "response_codec": "zlib",   # Codec to compress the result with
+        "threshold": 1024,          # Results smaller than this are not compressed
+        "store": {"type": "s3", "bucket": "...", "prefix": "..."},
+        "offload_threshold": 5242880
+    }
+
+    When a blob store is given, a payload too large for the lambda API is put
+    in the store and "payload" is replaced by "payload_ref", the key of the blob.
+    Likewise, a result larger than "offload_threshold" is put in the store and
+    returned as "result_ref".
+
+    An event which is just the encoded cloudpickle is treated as an
+    uncompressed payload.
+
+    The event {"warm": true, "hold": 0.5} is a no-op, used to start containers
+    before a burst of invocations. The handler sleeps "hold" seconds, so that
+    concurrent warming invocations land on distinct containers, and returns
+    {"warm": true, "cold": <whether this was the first invocation of the
+    container>, "container": <id of the container>}.
 
     Decoding the payload would result in a dictionary of the format:
     {
@@ -34,30 +355,129 @@ def lambda_handler(event: dict, context: dict):
     The handler then loads the module specified and runs the function
     with the given args and kwargs.
 
+    The client usually pickles the function once and sends that pickle as
+    "function_pickle" instead of "function", to avoid pickling it again for
+    every invocation. It also sends "function_digest", the sha256 of the
+    pickle, which is used to keep the unpickled function in the container.
+    Once a function has been sent, the client only sends its digest. If the
+    container does not have that function, the response is
+    {"need_function": true} and the client retries with the pickle.
+
+    Functions deployed with the package can be referenced instead with
+    "function_ref": "module:function". They are imported once per container.
+
+    A batch of calls to the same function can be sent in one invocation
+    by replacing "args" and "kwargs" with a list of (args, kwargs) pairs:
+    {
+        "function": <function increment>,
+        "batch": [[[1], {}], [[2], {"step": 5}]]
+    }
+
+    The result of a batch is the list of results of every call, in order.
+
+    The invocations of `map_array` send their arrays with out-of-band buffers,
+    which are not copied into the pickle. The event then has "oob": {"pickle":
+    <base64 protocol 5 pickle of a tuple>, "buffers": [<base64 buffer>, ...]},
+    or "buffer_refs" with the keys of the buffers in the blob store instead of
+    "buffers", and "pickle_ref" instead of "pickle" for a large pickle. The tuple is prepended to the "args" of the payload. With
+    "oob_result": true in the payload, the result is sent back the same way,
+    as "result_oob".
+
+    The invocations of `map_reduce` fold their results with a reduce function.
+    With "reduce_function", the pickle of that function, the results of the
+    calls are folded into one result. Reductions higher up the tree send the
+    reduce function as "function", and send its operands as "reduce_values",
+    or as "reduce_refs", a list of [key, codec] of the results kept in the
+    blob store, which are deleted once folded. With "keep": true the result
+    is put in the blob store whatever its size, and the response has
+    "kept": true.
+
     Response Format
     ---
     dict
 
     {
         'result': <encoded cloudpickle>  # Only if no error occured.
+        'result_ref': 'key'              # Instead of result, if the result was put in the blob store
+        'kept': True                     # If the result was put in the blob store because of "keep"
+        'result_oob': {...}              # Instead of result, with "oob_result"
+        'codec': 'zlib'                  # Codec the result is compressed with
+        'size': 2048                     # Size of the result pickle before compression
         'error': 'error message string'  # If an error was caught during execution
+        'timings': {                     # Seconds spent decoding the payload and encoding the result
+            'decode': 0.001,
+            'encode': 0.002
+        }
     }
 
     All other exceptions which were caught by the AWS infrastructure, go in the
     format of AWS. These are handled by the client appropriately.
     '''
-    payload = cloudpickle.loads(base64.b64decode(event))
+    global _COLD
+    cold, _COLD = _COLD, False
 
-    func = payload['function']
-    args = payload['args']
-    kwargs = payload['kwargs']
+    if isinstance(event, str):
+        event = {'payload': event}
 
-    response = {}
+    if event.get('warm'):
+        time.sleep(event.get('hold', 0))
+        return {'warm': True, 'cold': cold, 'container': CONTAINER_ID}
+
+    store = open_blob_store(event['store']) if event.get('store') else None
+
+    start = time.perf_counter()
+    if 'payload_ref' in event:
+        data = store.get(event['payload_ref'])
+    else:
+        data = base64.b64decode(event['payload'])
+    payload = unpack(data, event.get('codec', 'none'))
     try:
-        result = func(*args, **kwargs)
+        func = resolve_function(payload)
+    except Exception as e:
+        return {'error': f'Unable to load the function: {e}'}
+    if func is None:
+        return {'need_function': True}
+    timings = {'decode': time.perf_counter() - start}
+
+    response = {'timings': timings}
+    try:
+        if 'oob' in event:
+            payload['args'] = tuple(decode_buffers(event['oob'], store, writable=True)) + tuple(payload['args'])
+
+        if 'reduce_refs' in payload:
+            if store is None:
+                raise ValueError('The results to reduce are in a blob store but the event has none')
+            result = functools.reduce(func, [unpack(store.get(key), codec) for key, codec in payload['reduce_refs']])
+            for key, _ in payload['reduce_refs']:
+                store.delete(key)
+        elif 'reduce_values' in payload:
+            result = functools.reduce(func, payload['reduce_values'])
+        elif 'batch' in payload:
+            result = [func(*args, **kwargs) for args, kwargs in payload['batch']]
+        else:
+            result = func(*payload['args'], **payload['kwargs'])
+
+        if 'reduce_function' in payload:
+            reduce_function = cloudpickle.loads(payload['reduce_function'])
+            result = functools.reduce(reduce_function, result if 'batch' in payload else [result])
         # serialize and pickle result
-        result = base64.b64encode(cloudpickle.dumps(result)).decode('ascii')
-        response['result'] = result
+        start = time.perf_counter()
+        if payload.get('oob_result'):
+            response['result_oob'] = encode_buffers(result, store, event.get('offload_threshold', 0))
+            timings['encode'] = time.perf_counter() - start
+            return response
+
+        codec = event.get('response_codec', 'none')
+        if codec not in CODECS:
+            codec = 'zlib'
+        data, response['codec'], response['size'] = pack(result, codec, event.get('threshold', 0))
+        if store is not None and (payload.get('keep') or b64size(len(data)) > event['offload_threshold']):
+            response['result_ref'] = store.put(data)
+            if payload.get('keep'):
+                response['kept'] = True
+        else:
+            response['result'] = base64.b64encode(data).decode('ascii')
+        timings['encode'] = time.perf_counter() - start
     except Exception as e:
         # return {'error': str(e)}
         response['error'] = str(e)
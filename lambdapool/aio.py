@@ -0,0 +1,210 @@
+'''
+lambdapool.aio
+
+An asyncio flavour of LambdaPool. The invocations are made over a non-blocking
+HTTP client, so a single thread can keep thousands of invocations in flight.
+The payloads are the same as those of `LambdaPool`, so deployed agents need no change.
+
+Requires `aiohttp`, which can be installed with `pip install lambdapool[async]`.
+'''
+import json
+import time
+import asyncio
+import collections
+import itertools
+from typing import Iterable, List, Optional
+from urllib.parse import quote
+
+import botocore.session
+from botocore.auth import SigV4Auth
+from botocore.awsrequest import AWSRequest
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from lambdapool.pool import Context, LambdaFunction, encode_payload, decode_response, release_payload
+from lambdapool.exceptions import LambdaPoolError, FunctionNotCachedError
+from lambdapool.stats import parse_report
+from lambdapool import utils
+
+class AsyncLambdaPool:
+    def __init__(
+        self,
+        workers: int,
+        lambda_function: str,
+        aws_access_key_id: str=None,
+        aws_secret_access_key: str=None,
+        aws_region_name: str=None,
+        endpoint_url: str=None,
+        **kwargs
+    ):
+        if aiohttp is None:
+            raise LambdaPoolError('AsyncLambdaPool requires aiohttp. Install it with `pip install aiohttp`')
+
+        self.workers = workers
+        self.context = Context(lambda_function, aws_access_key_id, aws_secret_access_key, aws_region_name, **kwargs)
+        if self.context.backend != 'lambda':
+            raise LambdaPoolError('AsyncLambdaPool only supports the lambda backend')
+
+        session = botocore.session.Session()
+        if aws_access_key_id or aws_secret_access_key:
+            session.set_credentials(aws_access_key_id, aws_secret_access_key)
+        self.credentials = session.get_credentials()
+        self.region_name = aws_region_name or session.get_config_variable('region')
+        if self.credentials is None or self.region_name is None:
+            raise LambdaPoolError('Unable to find AWS credentials and region. Please run `aws configure`')
+
+        self.endpoint_url = (endpoint_url or f'https://lambda.{self.region_name}.amazonaws.com').rstrip('/')
+        self._session = None
+        self._semaphore = None
+
+    def _get_session(self):
+        # The session and the semaphore have to be created inside the running event loop
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.workers),
+                timeout=aiohttp.ClientTimeout(total=None, sock_read=self.context.read_timeout)
+            )
+            self._semaphore = asyncio.Semaphore(self.workers)
+        return self._session
+
+    def _sign(self, url: str, body: bytes) -> dict:
+        request = AWSRequest(
+            method='POST',
+            url=url,
+            data=body,
+            headers={'Content-Type': 'application/json', 'X-Amz-Log-Type': 'Tail'}
+        )
+        SigV4Auth(self.credentials.get_frozen_credentials(), 'lambda', self.region_name).add_auth(request)
+        return dict(request.headers.items())
+
+    async def _invoke_function(self, payload: dict):
+        function_name = quote(self.context.lambda_function, safe='')
+        url = f'{self.endpoint_url}/2015-03-31/functions/{function_name}/invocations'
+
+        session = self._get_session()
+        async with self._semaphore:
+            event = encode_payload(payload, self.context)
+            try:
+                body = json.dumps(event).encode('ascii')
+                start = time.perf_counter()
+                async with session.post(url, data=body, headers=self._sign(url, body)) as response:
+                    data = await response.read()
+                    if response.status >= 300:
+                        raise LambdaPoolError(self._error_message(response, data))
+
+                log_result = response.headers.get('X-Amz-Log-Result')
+                self.context.stats.record(parse_report(log_result) if log_result else None, time.perf_counter() - start)
+
+                return decode_response(data, self.context)
+            finally:
+                release_payload(event, self.context)
+
+    @staticmethod
+    def _error_message(response, data: bytes) -> str:
+        error_type = response.headers.get('x-amzn-ErrorType', str(response.status)).split(':')[0]
+        try:
+            error = json.loads(data)
+            message = error.get('message') or error.get('Message') or ''
+        except ValueError:
+            message = data.decode('utf-8', 'replace')
+        return f'{error_type}: {message}'
+
+    @property
+    def stats(self):
+        return self.context.stats
+
+    @property
+    def codec_stats(self):
+        return self.context.codec_stats
+
+    async def _call(self, f: LambdaFunction, payload: dict):
+        # Same as LambdaFunction.call
+        try:
+            result = await self._invoke_function(payload)
+        except FunctionNotCachedError:
+            result = await self._invoke_function(f.with_function(payload))
+
+        f.function_sent()
+        return result
+
+    async def apply(self, function, args: List = [], kwds: dict = {}):
+        f = LambdaFunction(self.context, function)
+        return await self._call(f, f.payload(tuple(args), dict(kwds)))
+
+    def submit(self, function, *args, **kwargs) -> asyncio.Task:
+        '''Schedules an invocation and returns an `asyncio.Task` for its result.
+
+        Must be called from a running event loop.
+        '''
+        return asyncio.ensure_future(self.apply(function, args, kwargs))
+
+    async def map(self, function, iterable: Iterable, chunksize: Optional[int]=None) -> list:
+        return [result async for result in self.imap(function, iterable, chunksize, window=self.workers)]
+
+    def imap(self, function, iterable: Iterable, chunksize: Optional[int]=None, window: Optional[int]=None):
+        '''Returns an async iterator over the results of `function` applied to
+        the items of `iterable`, in order. At most `window` invocations
+        (defaults to `workers`) are in flight at any time.
+        '''
+        return self._imap(function, iterable, chunksize, window, ordered=True)
+
+    def imap_unordered(self, function, iterable: Iterable, chunksize: Optional[int]=None, window: Optional[int]=None):
+        '''Same as `imap`, but yields the results as soon as the invocations complete.
+        '''
+        return self._imap(function, iterable, chunksize, window, ordered=False)
+
+    async def _imap(self, function, iterable, chunksize, window, ordered):
+        f = LambdaFunction(self.context, function)
+        window = window or self.workers
+
+        if chunksize is None or chunksize == 1:
+            payloads = (f.payload((item,), {}) for item in iterable)
+            async for result in self._windowed(f, payloads, window, ordered):
+                yield result
+            return
+
+        payloads = (
+            f.batch_payload([((item,), {}) for item in chunk])
+            for chunk in utils.chunked(iterable, chunksize)
+        )
+        async for results in self._windowed(f, payloads, window, ordered):
+            for result in results:
+                yield result
+
+    async def _windowed(self, f, payloads, window, ordered):
+        payloads = iter(payloads)
+        pending = collections.deque(
+            asyncio.ensure_future(self._call(f, payload))
+            for payload in itertools.islice(payloads, window)
+        )
+        try:
+            while pending:
+                if ordered:
+                    done = [pending.popleft()]
+                else:
+                    done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        pending.remove(task)
+
+                for task in done:
+                    result = await task
+                    for payload in itertools.islice(payloads, 1):
+                        pending.append(asyncio.ensure_future(self._call(f, payload)))
+                    yield result
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, type, value, traceback):
+        await self.close()
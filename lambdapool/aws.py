@@ -5,6 +5,7 @@ import sys
 import boto3
 
 from lambdapool.version import __version__
+from lambdapool.build import RUNTIME
 from lambdapool.exceptions import AWSError
 
 try:
@@ -80,12 +81,45 @@ class Role:
     def __repr__(self):
         return f'Role {self.role_name}'
 
+# Number of layers a function can use
+MAX_LAYERS = 5
+
+class Layer:
+    def __init__(self, layer_name):
+        self.layer_name = layer_name
+
+    def get_latest_version(self):
+        '''Returns the ARN of the latest version of the layer, or None if it was never published
+        '''
+        try:
+            response = lambda_client.list_layer_versions(LayerName=self.layer_name, CompatibleRuntime=RUNTIME)
+        except lambda_client.exceptions.ResourceNotFoundException:
+            return None
+
+        versions = response.get('LayerVersions', [])
+        return versions[0]['LayerVersionArn'] if versions else None
+
+    def publish(self, archive):
+        response = lambda_client.publish_layer_version(
+            LayerName=self.layer_name,
+            Description=f'Dependencies of lambdapool functions, built by lambdapool {__version__}',
+            Content={
+                'ZipFile': archive
+            },
+            CompatibleRuntimes=[RUNTIME]
+        )
+        return response['LayerVersionArn']
+
+    def __repr__(self):
+        return f'Layer {self.layer_name}'
+
 class LambdaFunction:
-    def __init__(self, function_name, memory=None, timeout=None, layers=None):
+    def __init__(self, function_name, memory=None, timeout=None, layers=None, content_hash=None):
         self.function_name = function_name
         self.memory = memory
         self.timeout = timeout
         self.layers = layers
+        self.content_hash = content_hash
 
     def exists(self):
         try:
@@ -95,6 +129,21 @@ class LambdaFunction:
 
         return True
 
+    def get_configuration(self):
+        return lambda_client.get_function_configuration(FunctionName=self.function_name)
+
+    def get_environment(self):
+        variables = {
+            'CREATOR': 'lambdapool',
+            'FUNCTION_NAME': self.function_name,
+            'LAMBDAPOOL_VERSION': __version__
+        }
+
+        if self.content_hash:
+            variables['LAMBDAPOOL_CONTENT_HASH'] = self.content_hash
+
+        return variables
+
     def create(self, archive):
         if self.exists():
             raise ValueError(f'Function {self.function_name} already exists')
@@ -134,7 +183,7 @@ class LambdaFunction:
         config_kwargs = self.get_config_kwargs()
         lambda_client.create_function(
             FunctionName=self.function_name,
-            Runtime='python3.6',
+            Runtime=RUNTIME,
             Role=role.get_arn(),
             Handler='lambdapool_agent.lambda_handler',
             Code={
@@ -145,26 +194,32 @@ class LambdaFunction:
                 'function_name': self.function_name
             },
             Environment={
-                'Variables': {
-                    'CREATOR': 'lambdapool',
-                    'FUNCTION_NAME': self.function_name,
-                    'LAMBDAPOOL_VERSION': __version__
-                }
+                'Variables': self.get_environment()
             },
             **config_kwargs
         )
 
-    def update(self, archive):
+    def update(self, archive=None):
+        '''Updates the code and the configuration of the function.
+
+        The code is left as is when `archive` is None.
+        '''
         if not self.exists():
             raise ValueError(f'Function {self.function_name} does not exist')
 
-        lambda_client.update_function_code(
-            FunctionName=self.function_name,
-            ZipFile=archive
-            )
+        if archive is not None:
+            lambda_client.update_function_code(
+                FunctionName=self.function_name,
+                ZipFile=archive
+                )
+            # The configuration can not be updated while the code update is in progress
+            lambda_client.get_waiter('function_updated').wait(FunctionName=self.function_name)
 
         config_kwargs = self.get_config_kwargs()
 
+        if self.content_hash:
+            config_kwargs['Environment'] = {'Variables': self.get_environment()}
+
         if config_kwargs:
             lambda_client.update_function_configuration(
                 FunctionName=self.function_name,
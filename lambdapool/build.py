@@ -0,0 +1,442 @@
+'''
+lambdapool.build
+
+Helpers to build the deployment archive of a lambdapool function.
+
+The archives are deterministic: the same files always give the same zip,
+so that a build can be compared with the `CodeSha256` of the deployed function.
+'''
+import io
+import os
+import sys
+import json
+import zlib
+import shutil
+import struct
+import base64
+import fnmatch
+import hashlib
+import pathlib
+import itertools
+import zipfile
+import tempfile
+import subprocess
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Optional
+
+from lambdapool import agent, utils
+
+# Runtime of the lambda functions, which the bytecode is compiled for
+RUNTIME = 'python3.6'
+
+# Directories the code of a function and its layers are extracted to
+TASK_ROOT = '/var/task'
+LAYER_ROOT = '/opt'
+
+# Packages the agent needs on top of the standard library. Before python 3.8,
+# pickle5 backports the out-of-band buffers used by `LambdaPool.map_array`.
+AGENT_REQUIREMENTS = ['cloudpickle']
+if tuple(int(n) for n in RUNTIME[len('python'):].split('.')) < (3, 8):
+    AGENT_REQUIREMENTS.append('pickle5')
+
+# Platforms of the wheels installed for the runtime, most recent first
+PLATFORMS = ('manylinux2014_x86_64', 'manylinux2010_x86_64', 'manylinux1_x86_64')
+
+# Directory of the wheel cache, unless LAMBDAPOOL_CACHE_DIR is set
+CACHE_DIR = pathlib.Path.home() / '.cache' / 'lambdapool'
+
+# Timestamp of every member of the archives, 1980-01-01, the earliest one zip supports
+ZIP_DOS_TIME = 0
+ZIP_DOS_DATE = (1 << 5) | 1
+ZIP_EPOCH = 315532800
+
+# Files which are never hashed nor archived
+IGNORED_DIRECTORIES = {'__pycache__', '.git'}
+IGNORED_SUFFIXES = {'.pyc'}
+
+# Files left out of slim archives: tests, documentation, sources of extensions,
+# type stubs, console scripts and the metadata which is only used by pip
+SLIM_EXCLUDES = (
+    '*/tests/*',
+    '*/test/*',
+    'docs/*',
+    'doc/*',
+    '*/docs/*',
+    '*/doc/*',
+    '*/*.rst',
+    '*/*.md',
+    'bin/*',
+    '*.pyi',
+    '*.pyx',
+    '*.pxd',
+    '*.c',
+    '*.h',
+    '*.dist-info/RECORD',
+    '*.dist-info/INSTALLER',
+    '*.dist-info/REQUESTED',
+    '*.dist-info/LICENSE*',
+    '*.dist-info/licenses/*',
+    '*.dist-info/direct_url.json',
+)
+
+def is_ignored(path: pathlib.Path) -> bool:
+    return path.suffix in IGNORED_SUFFIXES or any(part in IGNORED_DIRECTORIES for part in path.parts)
+
+def is_excluded(path: pathlib.Path, excludes: Iterable[str]) -> bool:
+    name = path.as_posix()
+    return any(fnmatch.fnmatchcase(name, pattern) for pattern in excludes)
+
+def bytecode_tag(runtime: str=RUNTIME) -> str:
+    '''Returns the tag of the bytecode files of a runtime, e.g. "cpython-36" for "python3.6"
+    '''
+    return 'cpython-' + runtime[len('python'):].replace('.', '')
+
+def walk(root: pathlib.Path):
+    '''Yields the files under `root`, or `root` itself if it is a file, in a stable order.
+
+    Every file is yielded with its path relative to the parent of `root`.
+    '''
+    root = pathlib.Path(root)
+    if root.is_file():
+        yield root, pathlib.Path(root.name)
+        return
+
+    for path in sorted(root.rglob('*')):
+        relative = path.relative_to(root.parent)
+        if path.is_file() and not is_ignored(relative):
+            yield path, relative
+
+def content_hash(paths: Iterable[pathlib.Path], requirements: Optional[pathlib.Path]=None, options: Optional[dict]=None) -> str:
+    '''Returns the sha256 of everything that goes into the archive of a function.
+
+    That is the source files under `paths`, the requirements file, the agent
+    and the build `options`. Bytecode and other ignored files are left out.
+    '''
+    digest = hashlib.sha256()
+
+    def update(name, data):
+        digest.update(name.encode('utf-8') + b'\0')
+        digest.update(hashlib.sha256(data).digest())
+
+    update('agent', f'{agent.VERSION}\0'.encode('utf-8') + pathlib.Path(agent.__file__).read_bytes())
+    if options:
+        update('options', json.dumps(options, sort_keys=True).encode('utf-8'))
+    if requirements:
+        update('requirements', pathlib.Path(requirements).read_bytes())
+    for root in sorted(paths or [], key=lambda path: pathlib.Path(path).name):
+        for path, relative in walk(root):
+            update(f'source/{relative.as_posix()}', path.read_bytes())
+
+    return digest.hexdigest()
+
+def layer_name(requirements: Optional[pathlib.Path]=None, options: Optional[dict]=None) -> str:
+    '''Returns the name of the dependency layer for a requirements file.
+
+    The name is derived from the requirements, the dependencies of the agent,
+    the runtime and the build `options`, so that functions with the same
+    requirements share the layer.
+    '''
+    digest = hashlib.sha256()
+    digest.update(json.dumps([RUNTIME, PLATFORMS, AGENT_REQUIREMENTS, options or {}], sort_keys=True).encode('utf-8'))
+    if requirements:
+        digest.update(pathlib.Path(requirements).read_bytes())
+    return f'lambdapool-deps-{digest.hexdigest()[:32]}'
+
+def is_dependency_layer(layer_arn: str) -> bool:
+    return ':layer:lambdapool-deps-' in layer_arn
+
+def archive_directory(directory: pathlib.Path, excludes: Iterable[str]=(), prefix: str='') -> bytes:
+    '''Zips the content of `directory` and returns the archive.
+
+    See `ArchiveBuilder` for the files which are left out. The names of the
+    members start with `prefix`.
+    '''
+    builder = ArchiveBuilder(excludes)
+    builder.add_directory(directory, prefix)
+    return builder.build()
+
+def code_sha256(archive: bytes) -> str:
+    '''Returns the hash of an archive in the format of the `CodeSha256` of lambda functions
+    '''
+    return base64.b64encode(hashlib.sha256(archive).digest()).decode('ascii')
+
+def archive_breakdown(archive: bytes) -> List[tuple]:
+    '''Returns the number of files, the size and the compressed size of every
+    top level package of an archive, largest first.
+    '''
+    sizes = collections.defaultdict(lambda: [0, 0, 0])
+    with zipfile.ZipFile(io.BytesIO(archive)) as z:
+        for info in z.infolist():
+            entry = sizes[info.filename.split('/')[0]]
+            entry[0] += 1
+            entry[1] += info.file_size
+            entry[2] += info.compress_size
+
+    rows = [(name, files, size, compressed) for name, (files, size, compressed) in sizes.items()]
+    return sorted(rows, key=lambda row: (-row[3], row[0]))
+
+def runtime_python(runtime: str=RUNTIME) -> Optional[str]:
+    '''Returns the path of a local python interpreter of the same version as `runtime`, if any
+    '''
+    if runtime == f'python{sys.version_info[0]}.{sys.version_info[1]}':
+        return sys.executable
+    return shutil.which(runtime)
+
+def strip_debug_symbols(directory: pathlib.Path) -> Optional[int]:
+    '''Strips the debug symbols of the shared libraries under `directory`.
+
+    Returns the number of stripped libraries, or None if `strip` is not available.
+    '''
+    strip = shutil.which('strip')
+    if strip is None:
+        return None
+
+    libraries = [path for path in sorted(pathlib.Path(directory).rglob('*.so*')) if path.is_file()]
+    for path in libraries:
+        subprocess.run([strip, '--strip-debug', str(path)], check=False)
+    return len(libraries)
+
+class WheelCache:
+    '''Local cache of the wheels of the dependencies of the functions, for the lambda platform.
+
+    The wheels are kept in a directory per runtime and platform, under
+    `LAMBDAPOOL_CACHE_DIR` or `~/.cache/lambdapool`, and are named after their
+    package, version and platform tags, so that every function built on the
+    machine shares them.
+
+    Wheels are downloaded into a temporary directory and moved into the cache
+    one by one, so that several builds can share the cache concurrently.
+    '''
+    def __init__(self, root: Optional[pathlib.Path]=None, runtime: str=RUNTIME, platforms: Iterable[str]=PLATFORMS):
+        self.root = pathlib.Path(root or os.environ.get('LAMBDAPOOL_CACHE_DIR') or CACHE_DIR)
+        self.runtime = runtime
+        self.platforms = list(platforms)
+        self.directory = self.root / 'wheels' / f'{runtime}-{self.platforms[0]}'
+
+    def platform_options(self) -> List[str]:
+        '''Returns the options of pip to select the wheels of the runtime and platforms
+        '''
+        version = self.runtime[len('python'):]
+        nodot = version.replace('.', '')
+        runtime_version = tuple(int(n) for n in version.split('.'))
+        abi = f'cp{nodot}m' if runtime_version < (3, 8) else f'cp{nodot}'
+
+        options = ['--implementation', 'cp', '--python-version', version, '--abi', abi, '--only-binary=:all:']
+        for platform in self.platforms:
+            options += ['--platform', platform]
+        return options
+
+    def download(self, packages: List[str]):
+        '''Downloads the wheels of `packages` and their dependencies which are missing from the cache
+        '''
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=self.root) as tempdir:
+            command = [
+                sys.executable, '-m', 'pip', 'download', '--dest', tempdir,
+                '--find-links', str(self.directory),
+            ] + self.platform_options() + packages
+            subprocess.run(command, check=True)
+            for wheel in pathlib.Path(tempdir).glob('*.whl'):
+                os.replace(str(wheel), str(self.directory / wheel.name))
+
+    def install(self, target: pathlib.Path, packages: List[str], refresh: bool=False) -> bool:
+        '''Installs `packages` and their dependencies into `target` from the cache.
+
+        `packages` are pip arguments, e.g. `['-r', 'requirements.txt', 'cloudpickle']`,
+        and are resolved together. The cache is tried first without reaching
+        the package index, unless `refresh` is set. Missing wheels are then
+        downloaded. When some package has no wheel for the platform, the
+        packages are installed for the local platform instead, and False is
+        returned.
+        '''
+        install = [
+            sys.executable, '-m', 'pip', 'install', '--no-compile', '--target', str(target),
+            '--no-index', '--find-links', str(self.directory),
+        ] + self.platform_options() + packages
+
+        if not refresh and self.directory.exists():
+            if subprocess.run(install, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0:
+                return True
+
+        try:
+            self.download(packages)
+        except subprocess.CalledProcessError:
+            command = [sys.executable, '-m', 'pip', 'install', '--no-compile', '--target', str(target)] + packages
+            subprocess.run(command, check=True)
+            return False
+
+        subprocess.run(install, check=True)
+        return True
+
+# Compiles the files given on stdin as [[source, bytecode, name in tracebacks], ...]
+# It runs on the interpreter of the runtime, so it must work with any python 3.
+_COMPILE_SCRIPT = """
+import sys, json, py_compile
+kwargs = {}
+if sys.version_info >= (3, 7):
+    kwargs['invalidation_mode'] = py_compile.PycInvalidationMode.UNCHECKED_HASH
+for source, cfile, dfile in json.load(sys.stdin):
+    try:
+        py_compile.compile(source, cfile=cfile, dfile=dfile, doraise=True, **kwargs)
+    except py_compile.PyCompileError:
+        pass
+"""
+
+def compile_sources(sources: List[tuple], python: str, runtime: str=RUNTIME, workers: Optional[int]=None) -> List[Optional[bytes]]:
+    '''Compiles python files with the interpreter `python` and returns their bytecode.
+
+    `sources` is a list of (path of the source, name in tracebacks) pairs. The
+    sources are split among `workers` processes. The bytecode of files which
+    do not compile, e.g. python 2 examples shipped by some packages, is None.
+
+    From python 3.7, the bytecode is checked against the source by hash. Before
+    that, it is checked by timestamp, so the bytecode is given the timestamp of
+    the archive members.
+    '''
+    workers = workers or os.cpu_count() or 1
+    version = tuple(int(n) for n in runtime[len('python'):].split('.'))
+
+    with tempfile.TemporaryDirectory() as output:
+        jobs = [[str(source), os.path.join(output, f'{i}.pyc'), dfile] for i, (source, dfile) in enumerate(sources)]
+
+        def run(chunk):
+            subprocess.run([python, '-c', _COMPILE_SCRIPT], input=json.dumps(chunk).encode('utf-8'), check=True)
+
+        if jobs:
+            with ThreadPoolExecutor(workers) as executor:
+                list(executor.map(run, utils.chunked(jobs, -(-len(jobs) // workers))))
+
+        bytecode = []
+        for _, cfile, _ in jobs:
+            if not os.path.exists(cfile):
+                bytecode.append(None)
+                continue
+            with open(cfile, 'rb') as f:
+                data = f.read()
+            if version < (3, 7):
+                data = data[:4] + struct.pack('<L', ZIP_EPOCH) + data[8:]
+            bytecode.append(data)
+        return bytecode
+
+class ArchiveBuilder:
+    '''Builds a zip archive in memory from files on disk.
+
+    The files are read where they are, compressed in parallel by `workers`
+    threads and written straight into the archive. The members are sorted and
+    have a fixed timestamp and permissions, so that the same files always give
+    the same archive.
+
+    Bytecode and version control files are left out, as well as the files
+    matching a pattern of `excludes`. The patterns are matched against the
+    path of the file relative to the directory it is added from.
+    '''
+    def __init__(self, excludes: Iterable[str]=(), workers: Optional[int]=None, level: int=6):
+        self.excludes = list(excludes)
+        self.workers = workers or os.cpu_count() or 1
+        self.level = level
+        # Name in the archive -> (path of the file or None, content or None, mode)
+        self.members = {}
+
+    def add_file(self, path: pathlib.Path, name: str):
+        path = pathlib.Path(path)
+        mode = 0o755 if os.access(path, os.X_OK) else 0o644
+        self.members[name] = (path, None, mode)
+
+    def add_bytes(self, name: str, data: bytes, mode: int=0o644):
+        self.members[name] = (None, data, mode)
+
+    def add_directory(self, directory: pathlib.Path, prefix: str=''):
+        '''Adds the files under `directory`, named by their path relative to it
+        '''
+        directory = pathlib.Path(directory)
+        for path in sorted(directory.rglob('*')):
+            relative = path.relative_to(directory)
+            if path.is_file() and not is_ignored(relative) and not is_excluded(relative, self.excludes):
+                self.add_file(path, prefix + relative.as_posix())
+
+    def add_path(self, root: pathlib.Path, prefix: str=''):
+        '''Adds a file or a directory under its own name, like copying it into the archive
+        '''
+        for path, relative in walk(root):
+            if not is_excluded(relative, self.excludes):
+                self.add_file(path, prefix + relative.as_posix())
+
+    def add_bytecode(self, python: str, ddir: str, runtime: str=RUNTIME):
+        '''Compiles the python files of the archive for `runtime` and adds their bytecode.
+
+        The files are compiled as if the archive was extracted to `ddir`.
+        '''
+        sources = [
+            (path, name) for name, (path, _, _) in self.members.items()
+            if path is not None and name.endswith('.py')
+        ]
+        bytecode = compile_sources([(path, f'{ddir}/{name}') for path, name in sources], python, runtime, self.workers)
+
+        tag = bytecode_tag(runtime)
+        for (_, name), data in zip(sources, bytecode):
+            if data is not None:
+                directory, _, filename = name.rpartition('/')
+                cached = f'__pycache__/{filename[:-3]}.{tag}.pyc'
+                self.add_bytes(f'{directory}/{cached}' if directory else cached, data)
+
+    def _compress(self, name):
+        path, data, _ = self.members[name]
+        if data is None:
+            data = path.read_bytes()
+
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+        compressed = compressor.compress(data) + compressor.flush()
+        if len(compressed) < len(data):
+            return zipfile.ZIP_DEFLATED, zlib.crc32(data), len(data), compressed
+        return zipfile.ZIP_STORED, zlib.crc32(data), len(data), data
+
+    def build(self) -> bytes:
+        '''Returns the archive
+        '''
+        names = sorted(self.members)
+        output = io.BytesIO()
+        central_directory = []
+
+        with ThreadPoolExecutor(self.workers) as executor:
+            # The members are compressed in batches, and only a few batches per
+            # worker are waiting to be written at any time
+            batches = utils.windowed_map(
+                lambda batch: executor.submit(lambda: [self._compress(name) for name in batch]),
+                utils.chunked(names, 32),
+                4 * self.workers
+            )
+            members = itertools.chain.from_iterable(batches)
+            for name, (method, crc, size, data) in zip(names, members):
+                encoded = name.encode('utf-8')
+                # Bit 11 flags utf-8 names
+                flags = 0x800 if max(encoded, default=0) >= 0x80 else 0
+                offset = output.tell()
+                output.write(struct.pack(
+                    '<4s2B4HL2L2H', b'PK\x03\x04', 20, 0, flags, method, ZIP_DOS_TIME, ZIP_DOS_DATE,
+                    crc, len(data), size, len(encoded), 0
+                ))
+                output.write(encoded)
+                output.write(data)
+
+                external_attr = (0o100000 | self.members[name][2]) << 16
+                central_directory.append(struct.pack(
+                    '<4s4B4HL2L5H2L', b'PK\x01\x02', 20, 3, 20, 0, flags, method, ZIP_DOS_TIME, ZIP_DOS_DATE,
+                    crc, len(data), size, len(encoded), 0, 0, 0, 0, external_attr, offset
+                ) + encoded)
+
+        start = output.tell()
+        for entry in central_directory:
+            output.write(entry)
+        _write_end_of_archive(output, len(central_directory), output.tell() - start, start)
+        return output.getvalue()
+
+def _write_end_of_archive(output, count, size, offset):
+    if count > 0xFFFF:
+        # Zip64 is only needed for the number of members, as the
+        # archives of lambda functions are far smaller than 4 GB
+        position = output.tell()
+        output.write(struct.pack('<4sQ2H2L4Q', b'PK\x06\x06', 44, 45, 45, 0, 0, count, count, size, offset))
+        output.write(struct.pack('<4sLQL', b'PK\x06\x07', 0, position, 1))
+        count = 0xFFFF
+    output.write(struct.pack('<4s4H2LH', b'PK\x05\x06', 0, 0, count, count, size, offset, 0))
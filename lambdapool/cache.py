@@ -0,0 +1,172 @@
+'''
+lambdapool.cache
+
+Caches for the results of remote calls. A cached call is served without
+invoking the lambda function, so only use a cache with functions whose
+result depends on their arguments alone.
+'''
+import os
+import time
+import hashlib
+import tempfile
+import threading
+import collections
+
+import cloudpickle
+
+def cache_key(function_id: bytes, args: tuple, kwargs: dict) -> str:
+    '''Returns the key of a call, from the pickle of the function (or its
+    reference) and the pickle of the arguments.
+    '''
+    digest = hashlib.sha256(function_id)
+    digest.update(cloudpickle.dumps((args, kwargs)))
+    return digest.hexdigest()
+
+class BaseCache:
+    '''Keeps the hit and miss counters. Subclasses implement `_get`, `_set`
+    and `__len__`. Values are bytes.
+    '''
+    def __init__(self, max_size: int=None, ttl: float=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        '''Returns the value for `key`, or None if it is missing or expired
+        '''
+        value = self._get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key: str, value: bytes):
+        if self.max_size is not None and len(value) > self.max_size:
+            return
+        self._set(key, value)
+
+    def _expired(self, created_at: float) -> bool:
+        return self.ttl is not None and time.time() - created_at > self.ttl
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} entries={len(self)} hits={self.hits} misses={self.misses}>'
+
+class MemoryCache(BaseCache):
+    '''Least recently used cache in memory, holding at most `max_size` bytes
+    of values. Entries older than `ttl` seconds are ignored.
+    '''
+    def __init__(self, max_size: int=256 * 1024 * 1024, ttl: float=None):
+        super().__init__(max_size, ttl)
+        self.size = 0
+        self._entries = collections.OrderedDict()
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            created_at, value = entry
+            if self._expired(created_at):
+                self._remove(key)
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def _set(self, key, value):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.time(), value)
+            self.size += len(value)
+            while self.max_size is not None and self.size > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        _, value = self._entries.pop(key)
+        self.size -= len(value)
+
+    def __len__(self):
+        return len(self._entries)
+
+class DiskCache(BaseCache):
+    '''Least recently used cache in a directory, one file per entry, holding
+    at most `max_size` bytes of values. Entries older than `ttl` seconds are
+    ignored. The directory can be shared between runs.
+    '''
+    def __init__(self, path: str, max_size: int=1024 * 1024 * 1024, ttl: float=None):
+        super().__init__(max_size, ttl)
+        self.path = os.path.abspath(path)
+        os.makedirs(self.path, exist_ok=True)
+        self.size = 0
+        self._entries = collections.OrderedDict()
+        self._load()
+
+    def _load(self):
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.is_file() and not entry.name.startswith('.'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+
+        for _, key, size in sorted(entries):
+            self._entries[key] = size
+            self.size += size
+
+    def _filename(self, key):
+        return os.path.join(self.path, key)
+
+    def _get(self, key):
+        filename = self._filename(key)
+        try:
+            created_at = os.stat(filename).st_mtime
+            if self._expired(created_at):
+                with self._lock:
+                    self._remove(key)
+                return None
+
+            with open(filename, 'rb') as f:
+                value = f.read()
+        except FileNotFoundError:
+            return None
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+        return value
+
+    def _set(self, key, value):
+        fd, temp = tempfile.mkstemp(dir=self.path, prefix='.')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(value)
+        os.replace(temp, self._filename(key))
+
+        with self._lock:
+            self.size -= self._entries.pop(key, 0)
+            self._entries[key] = len(value)
+            self.size += len(value)
+            while self.max_size is not None and self.size > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        self.size -= self._entries.pop(key, 0)
+        try:
+            os.remove(self._filename(key))
+        except FileNotFoundError:
+            pass
+
+    def __len__(self):
+        return len(self._entries)
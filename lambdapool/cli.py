@@ -2,6 +2,7 @@ import sys
 import click
 
 from .function import LambdaPoolFunction
+from .pool import LambdaPool
 from . import utils
 from tabulate import tabulate
 
@@ -16,9 +17,13 @@ def cli():
 @click.option('--memory', type=click.INT, help="Sets the memory size of the function environment")
 @click.option('--timeout', type=click.INT, help="Sets the timeout for the function in seconds")
 @click.option('--layers', help="Sets the layers to be used when the function is ran. The Layers ARN's (a maximum of 5) should be specified.")
+@click.option('--slim', is_flag=True, help="Builds a slim archive, with bytecode for the runtime and without tests and package metadata")
+@click.option('--strip-debug', is_flag=True, help="Strips the debug symbols from the shared libraries")
+@click.option('--exclude', multiple=True, help="Leaves out the files matching this pattern from the archive. Can be given multiple times.")
+@click.option('--dependency-layer/--no-dependency-layer', default=True, help="Deploys the requirements as a layer shared by the functions with the same requirements")
 @click.argument('function_name', nargs=1)
 @click.argument('paths', nargs=-1, type=click.Path(exists=True))
-def create(function_name, paths, requirements, memory, timeout, layers):
+def create(function_name, paths, requirements, memory, timeout, layers, slim, strip_debug, exclude, dependency_layer):
     """Create a new function"""
     click.echo('=== Creating lambdapool function ===')
 
@@ -29,7 +34,11 @@ def create(function_name, paths, requirements, memory, timeout, layers):
             requirements=requirements,
             memory=memory,
             timeout=timeout,
-            layers=layers.split(',') if layers else []
+            layers=layers.split(',') if layers else [],
+            slim=slim,
+            strip_debug=strip_debug,
+            excludes=exclude,
+            dependency_layer=dependency_layer
         )
 
         if func.exists():
@@ -66,9 +75,14 @@ def list():
 @click.option('--memory', type=click.INT, help="Sets the memory size of the function environment")
 @click.option('--timeout', type=click.INT, help="Sets the timeout for the function in seconds")
 @click.option('--layers', help="Sets the layers to be used when the function is ran. The Layers ARN's (a maximum of 5) should be specified.")
+@click.option('--slim', is_flag=True, help="Builds a slim archive, with bytecode for the runtime and without tests and package metadata")
+@click.option('--strip-debug', is_flag=True, help="Strips the debug symbols from the shared libraries")
+@click.option('--exclude', multiple=True, help="Leaves out the files matching this pattern from the archive. Can be given multiple times.")
+@click.option('--dependency-layer/--no-dependency-layer', default=True, help="Deploys the requirements as a layer shared by the functions with the same requirements")
+@click.option('--force', is_flag=True, help="Rebuilds and uploads the function even if it is unchanged")
 @click.argument('function_name', nargs=1)
 @click.argument('paths', nargs=-1)
-def update(function_name, paths, requirements, memory, timeout, layers):
+def update(function_name, paths, requirements, memory, timeout, layers, slim, strip_debug, exclude, dependency_layer, force):
     """Update an existing function"""
     click.echo('=== Updating lambdapool function ===')
 
@@ -79,9 +93,13 @@ def update(function_name, paths, requirements, memory, timeout, layers):
             requirements=requirements,
             memory=memory,
             timeout=timeout,
-            layers=layers.split(',') if layers else []
+            layers=layers.split(',') if layers else [],
+            slim=slim,
+            strip_debug=strip_debug,
+            excludes=exclude,
+            dependency_layer=dependency_layer
         )
-        func.update()
+        func.update(force=force)
     except exceptions.LambdaFunctionError as e:
         click.echo(f'ERROR: {e}')
         sys.exit(1)
@@ -98,3 +116,24 @@ def delete(function_name):
     func.delete()
 
     click.echo(f'=== Deleted lambdapool function {function_name}===')
+
+@cli.command()
+@click.option('--concurrency', '-c', type=click.INT, default=10, help="Sets the number of containers to start")
+@click.option('--hold', type=click.FLOAT, default=1.0, help="Sets the seconds every invocation keeps its container busy")
+@click.argument('function_name', nargs=1)
+def warm(function_name, concurrency, hold):
+    """Start containers of a function before a burst"""
+    click.echo('=== Warming lambdapool function ===')
+
+    pool = LambdaPool(concurrency, function_name)
+    try:
+        result = pool.warm(concurrency, hold=hold)
+    finally:
+        pool.terminate()
+
+    click.echo(f'{result["containers"]} containers reached: {result["cold"]} cold, {result["warm"]} already warm')
+    if result['throttled'] or result['errors']:
+        click.echo(f'{result["throttled"]} invocations throttled, {result["errors"]} failed')
+        sys.exit(1)
+
+    click.echo(f'=== Warmed lambdapool function {function_name} ===')
@@ -0,0 +1,127 @@
+'''
+lambdapool.concurrency
+
+Adaptive control of the number of concurrent invocations.
+'''
+import math
+import time
+import random
+import logging
+import threading
+import contextlib
+
+from botocore.exceptions import ClientError, ConnectionError, ConnectionClosedError
+
+logger = logging.getLogger(__name__)
+
+THROTTLING_ERROR_CODES = ('TooManyRequestsException', 'ThrottlingException', 'Throttling')
+
+def is_throttle(error: Exception) -> bool:
+    return isinstance(error, ClientError) and error.response.get('Error', {}).get('Code') in THROTTLING_ERROR_CODES
+
+def is_connection_error(error: Exception) -> bool:
+    return isinstance(error, (ConnectionError, ConnectionClosedError))
+
+class ConcurrencyController:
+    '''Limits the number of concurrent invocations with an AIMD policy.
+
+    Every successful invocation increases the limit by `increase / limit`, i.e.
+    by about `increase` per round of invocations, up to `max_limit`, as long as
+    the invocations use the limit. A throttled invocation multiplies the limit
+    by `decrease` and is retried after a jittered exponential backoff. The limit
+    is decreased at most once per window of invocations: throttles of the
+    invocations which were already in flight at the last decrease are part of
+    the same congestion and do not decrease it again.
+
+    Invocations which failed to connect are retried the same way, without
+    changing the limit, as botocore does not retry them itself anymore.
+    '''
+    def __init__(
+        self,
+        max_limit: float=None,
+        min_limit: float=1,
+        increase: float=1,
+        decrease: float=0.5,
+        max_retries: int=8,
+        base_delay: float=0.1,
+        max_delay: float=20.0
+    ):
+        self.max_limit = max_limit or math.inf
+        self.min_limit = min_limit
+        self.increase = increase
+        self.decrease = decrease
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self.limit = self.max_limit
+        self.active = 0
+        self.peak = 0
+        self.throttles = 0
+        self.retries = 0
+        # Number of invocations started, and that number at the last decrease
+        self.started = 0
+        self._window = 0
+        self._cond = threading.Condition()
+
+    @contextlib.contextmanager
+    def slot(self):
+        '''Waits for the limit to allow one more invocation, and yields its number
+        '''
+        with self._cond:
+            while self.active + 1 > max(self.min_limit, self.limit):
+                self._cond.wait()
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+            self.started += 1
+            number = self.started
+        try:
+            yield number
+        finally:
+            with self._cond:
+                self.active -= 1
+                self._cond.notify_all()
+
+    def on_success(self):
+        with self._cond:
+            if self.active >= self.limit - 1 and self.limit < self.max_limit:
+                self.limit = min(self.max_limit, self.limit + self.increase / self.limit)
+                self._cond.notify_all()
+
+    def on_throttle(self, number: int=None):
+        '''Records a throttle of the invocation `number`, by default one started after the last decrease
+        '''
+        with self._cond:
+            self.throttles += 1
+            if number is not None and number <= self._window:
+                return
+            self._window = self.started
+            self.limit = max(self.min_limit, min(self.limit, self.active) * self.decrease)
+            logger.info('Invocations are throttled, reducing the concurrency to %d', self.limit)
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def run(self, function):
+        '''Calls `function` in a slot, retrying it while it is throttled
+        '''
+        attempt = 0
+        while True:
+            with self.slot() as number:
+                try:
+                    result = function()
+                except Exception as e:
+                    if is_throttle(e):
+                        self.on_throttle(number)
+                    elif not is_connection_error(e):
+                        raise
+                    if attempt >= self.max_retries:
+                        raise
+                else:
+                    self.on_success()
+                    return result
+
+            with self._cond:
+                self.retries += 1
+            time.sleep(self.backoff(attempt))
+            attempt += 1
@@ -2,6 +2,12 @@
 class LambdaPoolError(Exception):
     pass
 
+class FunctionNotCachedError(LambdaPoolError):
+    '''Raised when the payload only had the digest of the function and the
+    agent did not have that function in its cache.
+    '''
+    pass
+
 class LambdaFunctionError(Exception):
     pass
 
@@ -1,7 +1,12 @@
+import threading
+import itertools
 from typing import Iterable, Union, Any
 from concurrent.futures import ThreadPoolExecutor
 
 from .pool import Context, LambdaFunction
+from .local import invocation_count
+from .hedging import HedgePolicy, hedged_map
+from . import utils
 
 class LambdaExecutor:
     def __init__(self,
@@ -9,25 +14,155 @@ class LambdaExecutor:
         aws_access_key_id: str=None,
         aws_secret_access_key: str=None,
         aws_region_name: str=None,
-        max_workers: int=None
+        max_workers: int=None,
+        **kwargs
     ):
-        self.max_workers = max_workers
-        self.context = Context(lambda_function, aws_access_key_id, aws_secret_access_key, aws_region_name)
         self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.max_workers = self.executor._max_workers
+        self._pending = _PendingFutures(self.executor)
+        kwargs.setdefault('max_concurrency', self.max_workers)
+        self.context = Context(lambda_function, aws_access_key_id, aws_secret_access_key, aws_region_name, **kwargs)
+
+    @property
+    def codec_stats(self):
+        return self.context.codec_stats
+
+    @property
+    def stats(self):
+        return self.context.stats
+
+    @property
+    def cache(self):
+        return self.context.cache
+
+    @property
+    def hedge_stats(self):
+        return self.context.hedge_stats
+
+    @property
+    def concurrency(self):
+        '''The current limit on concurrent invocations
+        '''
+        return self.context.concurrency.limit
+
+    @property
+    def peak_concurrency(self):
+        return self.context.concurrency.peak
 
     def submit(self, function: str, *args: Any, **kwargs: Any):
         f = LambdaFunction(self.context, function)
-        return self.executor.submit(f, *args, **kwargs)
+        return self._pending.submit(f, *args, **kwargs)
 
-    def map(self, function: str, iterable: Iterable, timeout: Union[int, float]=None):
-        f = LambdaFunction(self.context, function)
-        return self.executor.map(f, iterable)
+    def map(self, function: str, *iterables: Iterable, timeout: Union[int, float]=None, chunksize: int=1, window: int=None, hedge: HedgePolicy=None, fail_fast: bool=False):
+        '''Returns an iterator over the results of `function` applied to the
+        items of `iterables`, like `Executor.map`.
+
+        With `chunksize` greater than 1, that many calls are sent to lambda
+        in a single invocation. Unlike `Executor.map`, the iterables are consumed
+        lazily and at most `window` invocations (defaults to `max_workers`) are
+        pending at any time. If a result is not available `timeout` seconds after
+        the call, `concurrent.futures.TimeoutError` is raised.
+
+        When a `hedge` policy is given, the iterables are read upfront and the
+        slowest invocations are re-issued near the end of the map.
+
+        With `fail_fast`, no new invocation is started once a call has raised
+        and the iterator raises that error as soon as it reaches an item which
+        was skipped.
+        '''
+        f = LambdaFunction(self.context, function, self.context.choose_backend(invocation_count(iterables, chunksize)))
+        window = window or self.max_workers
+
+        if chunksize == 1:
+            call = lambda args: f(*args)
+            items = zip(*iterables)
+        else:
+            call = f.call_batch
+            items = (
+                [(args, {}) for args in chunk]
+                for chunk in utils.chunked(zip(*iterables), chunksize)
+            )
+
+        if fail_fast:
+            call = _FailFast(call)
+
+        if hedge is not None:
+            results = hedged_map(self._pending, call, items, hedge, self.context.hedge_stats, timeout=timeout)
+        else:
+            results = utils.windowed_map(lambda item: self._pending.submit(call, item), items, window, timeout=timeout)
 
-    def shutdown(self, wait: bool=True):
+        if fail_fast:
+            results = call.results(results)
+        if chunksize == 1:
+            return results
+        return itertools.chain.from_iterable(results)
+
+    def shutdown(self, wait: bool=True, cancel_futures: bool=False):
+        '''Frees the worker threads, like `Executor.shutdown`.
+
+        With `cancel_futures`, the calls which have not started are cancelled
+        instead of being invoked.
+        '''
+        if cancel_futures:
+            self._pending.cancel()
         self.executor.shutdown(wait=wait)
+        self.context.close(wait=wait)
 
     def __enter__(self):
         return self
 
     def __exit__(self, type, value, traceback):
         self.shutdown()
+
+
+class _PendingFutures:
+    '''Submits calls to an executor and keeps track of the futures which are not done,
+    so that they can be cancelled on shutdown on every python version.
+    '''
+    def __init__(self, executor: ThreadPoolExecutor):
+        self.executor = executor
+        self.futures = set()
+        self.lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        future = self.executor.submit(fn, *args, **kwargs)
+        with self.lock:
+            self.futures.add(future)
+        future.add_done_callback(self._discard)
+        return future
+
+    def _discard(self, future):
+        with self.lock:
+            self.futures.discard(future)
+
+    def cancel(self):
+        with self.lock:
+            futures = list(self.futures)
+        for future in futures:
+            future.cancel()
+
+
+_SKIPPED = object()
+
+class _FailFast:
+    '''Wraps the call of a map to skip the remaining items once one of them has failed.
+    '''
+    def __init__(self, call):
+        self.call = call
+        self.error = None
+
+    def __call__(self, item):
+        if self.error is not None:
+            return _SKIPPED
+        try:
+            return self.call(item)
+        except Exception as e:
+            if self.error is None:
+                self.error = e
+            raise
+
+    def results(self, results):
+        for result in results:
+            if result is _SKIPPED:
+                raise self.error
+            yield result
@@ -2,23 +2,38 @@ import os
 import sys
 import pathlib
 import tempfile
-import shutil
 
-from lambdapool import utils, aws, exceptions, agent
+from tabulate import tabulate
+
+from lambdapool import utils, aws, exceptions, agent, build
 
 class LambdaPoolFunction:
-    def __init__(self, function_name, memory=None, timeout=None, layers=None, paths=None, requirements=None):
+    def __init__(self, function_name, memory=None, timeout=None, layers=None, paths=None, requirements=None, slim=False, strip_debug=False, excludes=None, dependency_layer=False):
         self.function_name = function_name
 
         self.memory = memory
         self.timeout = timeout
-        self.layers = layers
+        self.layers = list(layers or [])
+        # The requirements and the dependencies of the agent are deployed as a layer shared by the functions
+        self.dependency_layer = dependency_layer
         self.validate_function_configuration()
 
         self.paths = paths
         self.requirements = requirements
         self.resolve_paths()
 
+        # Slim archives have bytecode for the runtime and leave out the files matching `excludes`
+        self.slim = slim
+        self.strip_debug = strip_debug
+        self.excludes = list(build.SLIM_EXCLUDES if slim else []) + list(excludes or [])
+
+        # Wheels of the dependencies are shared by the builds of every function
+        self.wheel_cache = build.WheelCache()
+        self.refresh = False
+
+        self.content_hash = None
+        self.archive = None
+
     def resolve_paths(self):
         root = os.getcwd()
         self.paths = [
@@ -27,6 +42,22 @@ class LambdaPoolFunction:
         ] if self.paths else None
         self.requirements = pathlib.Path(root+'/'+self.requirements).resolve() if self.requirements else None
 
+    def get_build_options(self):
+        options = {}
+        if self.slim:
+            options['slim'] = build.RUNTIME
+        if self.strip_debug:
+            options['strip_debug'] = True
+        if self.excludes:
+            options['excludes'] = self.excludes
+        return options
+
+    def get_content_hash(self):
+        options = self.get_build_options()
+        if self.dependency_layer:
+            options['dependency_layer'] = True
+        return build.content_hash(self.paths, self.requirements, options)
+
     def validate_function_configuration(self):
         if (self.memory is not None) and not self.validate_memory():
             raise exceptions.LambdaFunctionError('Invalid memory size provided. It should be in between 128MB to 3008MB, in 64MB increments')
@@ -34,6 +65,9 @@ class LambdaPoolFunction:
         if (self.timeout is not None) and not self.validate_timeout():
             raise exceptions.LambdaFunctionError('Invalid timeout provided. It should be less than 900 seconds.')
 
+        if len(self.layers) + self.dependency_layer > aws.MAX_LAYERS:
+            raise exceptions.LambdaFunctionError(f'Too many layers provided. A function can have at most {aws.MAX_LAYERS} layers, including the dependency layer.')
+
     def validate_memory(self):
         return (self.memory >= 128) and (self.memory%64 == 0) and (self.memory <= 3008)
 
@@ -45,28 +79,54 @@ class LambdaPoolFunction:
             print(f'=== LambdaPool function {self.function_name} already exists ===')
             sys.exit(1)
 
-        with tempfile.TemporaryDirectory() as self.tempdir:
-            self.copy_paths()
-            self.install_requirements()
-            self.install_agent()
-
-            with tempfile.NamedTemporaryFile() as self.temparchive:
-                self.archive_function()
-                self.create_function()
+        self.content_hash = self.get_content_hash()
+        if self.dependency_layer:
+            self.layers.insert(0, self.deploy_layer())
 
-    def update(self):
+        with tempfile.TemporaryDirectory() as self.tempdir:
+            self.build_function()
+            self.create_function()
+
+    def update(self, force=False):
+        '''Rebuilds and uploads the function.
+
+        Unless `force` is set, the build is skipped when the content hash of the
+        sources, requirements and agent matches the deployed one, and the upload
+        is skipped when the archive matches the deployed code. A forced update
+        also resolves the requirements against the package index again, rather
+        than the wheel cache.
+        '''
         if not self.exists():
             print(f'=== LambdaPool function {self.function_name} does not exist ===')
             sys.exit(1)
 
+        self.refresh = force
+        self.content_hash = self.get_content_hash()
+        configuration = aws.LambdaFunction(self.function_name).get_configuration()
+        if self.dependency_layer:
+            if not self.layers:
+                # Keeps the layers given to a previous deployment, except the dependency layer
+                self.layers = [
+                    layer['Arn'] for layer in configuration.get('Layers', [])
+                    if not build.is_dependency_layer(layer['Arn'])
+                ]
+            self.layers.insert(0, self.deploy_layer())
+
+        deployed_hash = configuration.get('Environment', {}).get('Variables', {}).get('LAMBDAPOOL_CONTENT_HASH')
+
+        if not force and deployed_hash == self.content_hash:
+            print(f'=== Function {self.function_name} is unchanged, skipping the build ===')
+            self.update_function()
+            return
+
         with tempfile.TemporaryDirectory() as self.tempdir:
-            self.copy_paths()
-            self.install_requirements()
-            self.install_agent()
+            self.build_function()
+
+            if not force and build.code_sha256(self.archive) == configuration.get('CodeSha256'):
+                print(f'=== Archive of function {self.function_name} is unchanged, skipping the upload ===')
+                self.archive = None
 
-            with tempfile.NamedTemporaryFile() as self.temparchive:
-                self.archive_function()
-                self.update_function()
+            self.update_function()
 
     def delete(self):
         if not self.exists():
@@ -80,66 +140,123 @@ class LambdaPoolFunction:
         aws_lambda_function = aws.LambdaFunction(self.function_name)
         return aws_lambda_function.exists()
 
-    def copy_paths(self):
-        print('=== Copying all specified files and directories ===')
-
-        for path in self.paths:
-            dest = pathlib.Path(self.tempdir+'/'+path.name)
-            print(f'Copying {path.name}...')
-            utils.copy(path, dest)
-
-        print('=== Copied all specified files and directories ===')
-
-    def install_requirements(self):
-        if self.requirements:
-            packages = self.read_requirements()
-            print(f'=== Installing requirements from {self.requirements} ===')
-            for package in packages:
-                self.install_package(package)
-            print(f'=== Installed requirements from {self.requirements} ===')
-
-    def read_requirements(self):
-        print(f'=== Reading requirements from {self.requirements} ===')
-        with self.requirements.open() as r:
-            return [l.strip('\n') for l in r.readlines()]
-
-    def install_agent(self):
-        print(f'=== Installing lambdapool agent ===')
-        src = pathlib.Path(agent.__file__)
-        dest = pathlib.Path(self.tempdir+'/lambdapool_agent.py')
-        utils.copy(src, dest)
-        print(f'=== Installed lambdapool agent ===')
-        print(f'=== Installing lambdapool agent dependencies ===')
-        self.install_package('cloudpickle')
-        print(f'=== Installed lambdapool agent dependencies ===')
-
-    def install_package(self, package):
-        command = f'pip install {package} --target {self.tempdir}'
-        utils.run_command(command)
-
-    def archive_function(self):
+    def build_function(self):
+        builder = build.ArchiveBuilder(self.excludes)
+        self.add_paths(builder)
+        if not self.dependency_layer:
+            self.install_dependencies(self.tempdir)
+            self.strip_libraries(self.tempdir)
+            builder.add_directory(self.tempdir)
+        self.add_agent(builder)
+        self.archive = self.build_archive(builder, build.TASK_ROOT)
+
+    def deploy_layer(self):
+        '''Returns the ARN of the layer with the requirements and the dependencies of the agent.
+
+        The layer is named after the hash of the requirements and the build options,
+        so it is only built and published when no function has published it yet.
+        '''
+        layer_name = build.layer_name(self.requirements, self.get_build_options())
+        layer = aws.Layer(layer_name)
+        layer_arn = layer.get_latest_version()
+        if layer_arn:
+            print(f'=== Using the dependency layer {layer_name} ===')
+            return layer_arn
+
+        print(f'=== Building the dependency layer {layer_name} ===')
+        with tempfile.TemporaryDirectory() as target:
+            self.install_dependencies(target)
+            self.strip_libraries(target)
+
+            builder = build.ArchiveBuilder(self.excludes)
+            builder.add_directory(target, prefix='python/')
+            archive = self.build_archive(builder, build.LAYER_ROOT)
+
+        print(f'=== Publishing the dependency layer {layer_name} ===')
+        layer_arn = layer.publish(archive)
+        print(f'=== Published the dependency layer {layer_name} ===')
+        return layer_arn
+
+    def add_paths(self, builder):
+        print('=== Adding all specified files and directories ===')
+
+        for path in self.paths or []:
+            print(f'Adding {path.name}...')
+            builder.add_path(path)
+
+        print('=== Added all specified files and directories ===')
+
+    def install_dependencies(self, target):
+        '''Installs the requirements and the dependencies of the agent into `target`.
+
+        They are resolved together, from wheels for the lambda platform kept in
+        the local wheel cache.
+        '''
+        packages = (['-r', str(self.requirements)] if self.requirements else []) + build.AGENT_REQUIREMENTS
+        print(f'=== Installing requirements and lambdapool agent dependencies ===')
+        if not self.wheel_cache.install(target, packages, refresh=self.refresh):
+            print(f'WARNING: Some requirements have no wheels for {build.PLATFORMS[0]}, they were installed for the local platform')
+        print(f'=== Installed requirements and lambdapool agent dependencies ===')
+
+    def add_agent(self, builder):
+        print('=== Adding lambdapool agent ===')
+        builder.add_file(agent.__file__, 'lambdapool_agent.py')
+
+    def strip_libraries(self, directory):
+        if self.strip_debug:
+            print('=== Stripping debug symbols from shared libraries ===')
+            stripped = build.strip_debug_symbols(directory)
+            if stripped is None:
+                print('WARNING: strip is not available, the debug symbols are kept')
+
+    def build_archive(self, builder, ddir):
+        '''Returns the archive of `builder`, which is extracted to `ddir` on lambda.
+
+        Slim archives get the bytecode of their python files.
+        '''
+        if self.slim:
+            python = build.runtime_python()
+            if python is None:
+                print(f'WARNING: No {build.RUNTIME} interpreter found, the archive is built without bytecode')
+            else:
+                print(f'=== Compiling bytecode for {build.RUNTIME} ===')
+                builder.add_bytecode(python, ddir)
+
         print(f'=== Archiving selected files and directories ===')
-        self.archive = shutil.make_archive(self.temparchive.name, 'zip', self.tempdir)
+        archive = builder.build()
+
+        if self.slim:
+            self.print_breakdown(archive)
+        return archive
+
+    def print_breakdown(self, archive):
+        rows = [
+            [name, files, utils.convert_size(size), utils.convert_size(compressed)]
+            for name, files, size, compressed in build.archive_breakdown(archive)
+        ]
+        print(tabulate(rows, headers=['PACKAGE', 'FILES', 'SIZE', 'COMPRESSED']))
+        print(f'=== Archive size: {utils.convert_size(len(archive))} ===')
+
+    def get_aws_function(self):
+        return aws.LambdaFunction(self.function_name, self.memory, self.timeout, self.layers, self.content_hash)
 
     def create_function(self):
         print(f'=== Uploading function and dependencies ===')
 
-        with open(self.archive, 'rb') as f:
-            archive_data = f.read()
-
-        aws_lambda_function = aws.LambdaFunction(self.function_name, self.memory, self.timeout, self.layers)
-        aws_lambda_function.create(archive_data)
+        aws_lambda_function = self.get_aws_function()
+        aws_lambda_function.create(self.archive)
 
         print(f'=== Function {self.function_name} uploaded along with all dependencies ===')
 
     def update_function(self):
-        print(f'=== Uploading function and dependencies ===')
+        if self.archive is None:
+            self.get_aws_function().update()
+            return
 
-        with open(self.archive, 'rb') as f:
-            archive_data = f.read()
+        print(f'=== Uploading function and dependencies ===')
 
-        aws_lambda_function = aws.LambdaFunction(self.function_name, self.memory, self.timeout, self.layers)
-        aws_lambda_function.update(archive_data)
+        aws_lambda_function = self.get_aws_function()
+        aws_lambda_function.update(self.archive)
 
         print(f'=== Function {self.function_name} uploaded along with all dependencies ===')
 
@@ -0,0 +1,113 @@
+'''
+lambdapool.hedging
+
+Hedged requests: re-issuing the slowest invocations of a map once most of
+it has completed, and keeping whichever copy finishes first.
+'''
+import time
+import logging
+import statistics
+from concurrent.futures import wait, FIRST_COMPLETED, TimeoutError
+
+logger = logging.getLogger(__name__)
+
+class HedgePolicy:
+    '''Describes when the invocations of a map are hedged.
+
+    Once `percentile` percent of the items have completed, every item which
+    has been running for longer than the threshold is invoked a second time.
+    The threshold is `threshold` seconds if given, otherwise `multiplier` times
+    the median latency of the completed items, but no less than `min_delay`.
+    At most `max_hedges` items are hedged per map.
+    '''
+    def __init__(self, percentile: float=90, threshold: float=None, multiplier: float=2.0, min_delay: float=0.5, max_hedges: int=None, interval: float=0.05):
+        if not 0 < percentile <= 100:
+            raise ValueError('percentile must be in (0, 100]')
+
+        self.percentile = percentile
+        self.threshold = threshold
+        self.multiplier = multiplier
+        self.min_delay = min_delay
+        self.max_hedges = max_hedges
+        self.interval = interval
+
+    def get_threshold(self, latencies):
+        if self.threshold is not None:
+            return self.threshold
+        return max(self.multiplier * statistics.median(latencies), self.min_delay)
+
+def hedged_map(executor, function, items, policy: HedgePolicy, stats=None, timeout: float=None):
+    '''Returns an iterator over `function` applied to every item, in order.
+
+    The calls are submitted to `executor`. The items are read upfront, as
+    the percentile of completed items needs their count. If `timeout` is given,
+    `concurrent.futures.TimeoutError` is raised when the results are not all
+    available `timeout` seconds after the call.
+    '''
+    end_time = None if timeout is None else time.monotonic() + timeout
+    items = list(items)
+    started = {}
+
+    def run(index, copy):
+        started[index, copy] = time.monotonic()
+        return function(items[index])
+
+    pending = {executor.submit(run, index, 0): (index, 0) for index in range(len(items))}
+    return _hedged_results(executor, run, items, pending, started, policy, stats, end_time)
+
+def _hedged_results(executor, run, items, pending, started, policy, stats, end_time):
+    outcomes = {}
+    latencies = []
+    hedged = set()
+    position = 0
+    try:
+        while position < len(items):
+            if position in outcomes:
+                yield outcomes.pop(position).result()
+                position += 1
+                continue
+
+            finished, _ = wait(pending, timeout=policy.interval, return_when=FIRST_COMPLETED)
+            now = time.monotonic()
+            for future in finished:
+                index, copy = pending.pop(future)
+                if index in outcomes or index < position:
+                    continue
+
+                outcomes[index] = future
+                latencies.append(now - started[index, copy])
+                if index in hedged:
+                    other = _other_copy(pending, index)
+                    if other is not None:
+                        del pending[other]
+                        if copy == 1 and stats is not None:
+                            stats.record_win(other, now)
+                        other.cancel()
+
+            if end_time is not None and now >= end_time and position not in outcomes:
+                raise TimeoutError()
+
+            completed = position + len(outcomes)
+            if latencies and completed * 100 >= policy.percentile * len(items):
+                _hedge_stragglers(executor, run, pending, started, hedged, policy, policy.get_threshold(latencies), now, stats)
+    finally:
+        for future in pending:
+            future.cancel()
+
+def _other_copy(pending, index):
+    for future, (other_index, _) in pending.items():
+        if other_index == index:
+            return future
+
+def _hedge_stragglers(executor, run, pending, started, hedged, policy, threshold, now, stats):
+    for index, copy in list(pending.values()):
+        if policy.max_hedges is not None and len(hedged) >= policy.max_hedges:
+            return
+        if index in hedged or (index, copy) not in started:
+            continue
+        if now - started[index, copy] > threshold:
+            logger.debug('Hedging item %d, running for %.3fs', index, now - started[index, copy])
+            hedged.add(index)
+            pending[executor.submit(run, index, 1)] = (index, 1)
+            if stats is not None:
+                stats.record_hedge()
@@ -0,0 +1,128 @@
+'''
+lambdapool.local
+
+Runs invocations on the local machine instead of lambda.
+
+The events are exactly those sent to lambda, built by `LambdaFunction`, and
+they are handled by `agent.lambda_handler` in a pool of processes, so the
+results and errors are the same as on lambda.
+'''
+import os
+import json
+import math
+import time
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Optional, Tuple
+
+from lambdapool import agent
+
+BACKENDS = ('lambda', 'local', 'hybrid')
+
+# Milliseconds a lambda invocation is assumed to add to the duration of the
+# function, for the network and the lambda service, until it is measured
+DEFAULT_LAMBDA_OVERHEAD = 50.0
+
+def handle_event(body: str) -> Tuple[bytes, float]:
+    '''Runs the agent on an event in a worker process.
+
+    Returns the response, encoded like the payload of the Invoke API, and the
+    duration of the handler in milliseconds.
+    '''
+    start = time.perf_counter()
+    response = agent.lambda_handler(json.loads(body), None)
+    return json.dumps(response).encode('ascii'), (time.perf_counter() - start) * 1000
+
+class LocalBackend:
+    '''Invokes the agent in a pool of `workers` processes, one per core by default.
+
+    The processes are started on the first invocation. Like lambda containers,
+    each keeps its own cache of functions.
+    '''
+    def __init__(self, workers: Optional[int]=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.pending = 0
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(self.workers)
+            return self._executor
+
+    def invoke(self, body: str) -> Tuple[bytes, dict]:
+        '''Runs the event `body` and returns the response and a report of its duration
+        '''
+        with self._lock:
+            self.pending += 1
+        try:
+            data, duration = self.executor.submit(handle_event, body).result()
+        finally:
+            with self._lock:
+                self.pending -= 1
+        return data, {'duration': duration}
+
+    def shutdown(self, wait: bool=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+class HybridPolicy:
+    '''Chooses whether the invocations of a map run locally or on lambda.
+
+    The choice goes to the backend expected to finish first. Locally, the
+    invocations queue behind the pending ones on `local_workers` processes.
+    On lambda, they run on up to `lambda_workers` containers, and each one
+    also pays the overhead of the lambda service. The duration of the function
+    and that overhead are moving averages of the past invocations.
+
+    Until an invocation has been measured, a map runs locally only if the
+    local processes can take all of its invocations at once.
+    '''
+    def __init__(self, local_workers: int, lambda_workers: int, overhead: float=DEFAULT_LAMBDA_OVERHEAD, alpha: float=0.2):
+        self.local_workers = local_workers
+        self.lambda_workers = lambda_workers
+        self.duration = None
+        self.overhead = overhead
+        self.alpha = alpha
+        self._lock = threading.Lock()
+
+    def _average(self, current: Optional[float], value: float) -> float:
+        return value if current is None else current + self.alpha * (value - current)
+
+    def record(self, duration: float, client_time: Optional[float]=None):
+        '''Records the duration of an invocation and, for lambda, the time the client waited for it, in milliseconds
+        '''
+        with self._lock:
+            self.duration = self._average(self.duration, duration)
+            if client_time is not None:
+                self.overhead = self._average(self.overhead, max(0.0, client_time - duration))
+
+    def choose(self, invocations: Optional[int], pending: int=0) -> str:
+        '''Returns "local" or "lambda" for a map of `invocations`, with `pending` invocations already running locally.
+
+        Maps of unknown length run on lambda.
+        '''
+        if invocations is None:
+            return 'lambda'
+
+        with self._lock:
+            duration, overhead = self.duration, self.overhead
+
+        if duration is None:
+            return 'local' if pending + invocations <= self.local_workers else 'lambda'
+
+        local = math.ceil((pending + invocations) / self.local_workers) * duration
+        remote = math.ceil(invocations / self.lambda_workers) * (duration + overhead)
+        return 'local' if local <= remote else 'lambda'
+
+def invocation_count(iterables: Iterable, chunksize: Optional[int]=None) -> Optional[int]:
+    '''Returns the number of invocations of a map over `iterables`, or None if one has no length
+    '''
+    if not all(hasattr(iterable, '__len__') for iterable in iterables):
+        return None
+    items = min(len(iterable) for iterable in iterables)
+    return math.ceil(items / (chunksize or 1))
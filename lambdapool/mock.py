@@ -0,0 +1,254 @@
+'''
+lambdapool.mock
+
+A local stand-in of the Lambda Invoke API, which runs the agent in-process.
+
+It serves `POST /2015-03-31/functions/<name>/invocations` the way lambda does,
+so that `LambdaPool`, `LambdaExecutor` and `AsyncLambdaPool` can be pointed at
+it with `endpoint_url`, e.g. to test or benchmark them without an AWS account.
+
+    $ python -m lambdapool.mock --port 9001 --concurrency 100 --cold-start 0.25
+
+Every container loads its own copy of the agent, so warm containers keep their
+function cache and cold starts are reported like on lambda.
+'''
+import json
+import math
+import time
+import uuid
+import base64
+import random
+import argparse
+import threading
+import collections
+import importlib.util
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Optional
+
+from lambdapool import agent
+
+# Largest request payload of a synchronous invocation
+MAX_PAYLOAD_SIZE = 6 * 2**20
+
+class Throttled(Exception):
+    pass
+
+class MockContainer:
+    '''An execution environment of a function, with its own copy of the agent
+    '''
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        spec = importlib.util.spec_from_file_location(f'lambdapool_agent_{self.id}', agent.__file__)
+        self.agent = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(self.agent)
+        self.last_used = time.monotonic()
+
+class MockLambdaService:
+    '''Runs the invocations of the Invoke API on containers in this process.
+
+    An invocation runs on an idle container of the function if there is one,
+    otherwise on a new container, which takes `cold_start` seconds to start.
+    Containers idle for more than `idle_timeout` seconds are discarded.
+    Every invocation is delayed by `latency` seconds, the overhead of the
+    network and of the lambda service.
+
+    At most `concurrency` invocations run at the same time, over all the
+    functions. Invocations over that limit are throttled, as are a fraction
+    `throttle_rate` of the others.
+    '''
+    def __init__(
+        self,
+        cold_start: float=0.0,
+        latency: float=0.0,
+        concurrency: int=1000,
+        throttle_rate: float=0.0,
+        idle_timeout: Optional[float]=None,
+        memory: int=128,
+        seed: Optional[int]=None,
+    ):
+        self.cold_start = cold_start
+        self.latency = latency
+        self.concurrency = concurrency
+        self.throttle_rate = throttle_rate
+        self.idle_timeout = idle_timeout
+        self.memory = memory
+        self.random = random.Random(seed)
+
+        self._lock = threading.Lock()
+        # Function name -> idle containers, the most recently used last
+        self._idle = collections.defaultdict(list)
+        self.running = 0
+        self.peak_concurrency = 0
+        self.invocations = 0
+        self.cold_starts = 0
+        self.throttles = 0
+
+    def _acquire(self, function_name: str) -> Optional[MockContainer]:
+        '''Returns an idle container, None if a new one is needed, or raises `Throttled`
+        '''
+        with self._lock:
+            if self.running >= self.concurrency or self.random.random() < self.throttle_rate:
+                self.throttles += 1
+                raise Throttled()
+
+            self.running += 1
+            self.peak_concurrency = max(self.peak_concurrency, self.running)
+            self.invocations += 1
+
+            idle = self._idle[function_name]
+            if self.idle_timeout is not None:
+                now = time.monotonic()
+                idle[:] = [container for container in idle if now - container.last_used <= self.idle_timeout]
+            if idle:
+                return idle.pop()
+            self.cold_starts += 1
+            return None
+
+    def _release(self, function_name: str, container: Optional[MockContainer]):
+        with self._lock:
+            self.running -= 1
+            if container is not None:
+                container.last_used = time.monotonic()
+                self._idle[function_name].append(container)
+
+    def invoke(self, function_name: str, body: bytes, log_type: str='None'):
+        '''Invokes a function and returns the HTTP status, headers and body of the response
+        '''
+        if len(body) > MAX_PAYLOAD_SIZE:
+            return error_response(413, 'RequestEntityTooLargeException', f'Request must be smaller than {MAX_PAYLOAD_SIZE} bytes for the InvokeFunction operation')
+
+        try:
+            container = self._acquire(function_name)
+        except Throttled:
+            return error_response(429, 'TooManyRequestsException', 'Rate Exceeded.')
+
+        request_id = str(uuid.uuid4())
+        try:
+            init_duration = None
+            if container is None:
+                start = time.perf_counter()
+                time.sleep(self.cold_start)
+                container = MockContainer()
+                init_duration = (time.perf_counter() - start) * 1000
+
+            time.sleep(self.latency)
+
+            headers = {'Content-Type': 'application/json', 'X-Amz-Executed-Version': '$LATEST'}
+            start = time.perf_counter()
+            try:
+                response = container.agent.lambda_handler(json.loads(body), None)
+            except Exception as e:
+                response = {'errorMessage': str(e), 'errorType': type(e).__name__}
+                headers['X-Amz-Function-Error'] = 'Unhandled'
+            duration = (time.perf_counter() - start) * 1000
+        finally:
+            self._release(function_name, container)
+
+        if log_type == 'Tail':
+            report = (
+                f'REPORT RequestId: {request_id}\tDuration: {duration:.2f} ms\t'
+                f'Billed Duration: {math.ceil(duration)} ms\tMemory Size: {self.memory} MB\t'
+                f'Max Memory Used: {self.memory} MB\t'
+            )
+            if init_duration is not None:
+                report += f'Init Duration: {init_duration:.2f} ms\t'
+            log = f'START RequestId: {request_id} Version: $LATEST\nEND RequestId: {request_id}\n{report}\n'
+            headers['X-Amz-Log-Result'] = base64.b64encode(log.encode('utf-8')).decode('ascii')
+
+        headers['x-amzn-RequestId'] = request_id
+        return 200, headers, json.dumps(response).encode('utf-8')
+
+def error_response(status: int, error_type: str, message: str):
+    headers = {'Content-Type': 'application/json', 'x-amzn-ErrorType': error_type}
+    return status, headers, json.dumps({'Type': 'User', 'message': message}).encode('utf-8')
+
+class InvokeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    PREFIX = '/2015-03-31/functions/'
+    SUFFIX = '/invocations'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        path = self.path.split('?')[0]
+        if path.startswith(self.PREFIX) and path.endswith(self.SUFFIX):
+            function_name = path[len(self.PREFIX):-len(self.SUFFIX)]
+            status, headers, data = self.server.service.invoke(function_name, body, self.headers.get('X-Amz-Log-Type', 'None'))
+        else:
+            status, headers, data = error_response(404, 'ResourceNotFoundException', f'Unknown path {path}')
+
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+class MockLambdaServer(ThreadingHTTPServer):
+    '''Serves a `MockLambdaService` over HTTP from a background thread.
+
+    The keyword arguments are the options of `MockLambdaService`, e.g.
+
+        with MockLambdaServer(cold_start=0.1, concurrency=10) as server:
+            pool = LambdaPool(10, 'square', endpoint_url=server.endpoint_url)
+    '''
+    request_queue_size = 1024
+    daemon_threads = True
+
+    def __init__(self, host: str='127.0.0.1', port: int=0, service: Optional[MockLambdaService]=None, **kwargs):
+        super().__init__((host, port), InvokeHandler)
+        self.service = service or MockLambdaService(**kwargs)
+        self._thread = None
+
+    @property
+    def endpoint_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description='Serves a local stand-in of the Lambda Invoke API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9001)
+    parser.add_argument('--cold-start', type=float, default=0.0, help='Seconds to start a new container')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every invocation')
+    parser.add_argument('--concurrency', type=int, default=1000, help='Invocations running at the same time, over which they are throttled')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Fraction of the invocations throttled at random')
+    parser.add_argument('--idle-timeout', type=float, default=None, help='Seconds after which idle containers are discarded')
+    args = parser.parse_args()
+
+    server = MockLambdaServer(
+        args.host, args.port,
+        cold_start=args.cold_start, latency=args.latency, concurrency=args.concurrency,
+        throttle_rate=args.throttle_rate, idle_timeout=args.idle_timeout,
+    )
+    print(f'Serving the Lambda Invoke API on {server.endpoint_url}', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,158 @@
+import io
 import json
+import time
 import base64
+import hashlib
 import logging
 import threading
+import itertools
+import collections
 from multiprocessing.pool import ThreadPool
-from typing import List, Optional
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterable, List, Optional
 
 import boto3
-from botocore.client import Config
 import cloudpickle
+from botocore.client import Config
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
-from lambdapool.exceptions import LambdaPoolError
+from lambdapool.exceptions import LambdaPoolError, FunctionNotCachedError
+from lambdapool.stats import CodecStats, HedgeStats, InvocationStats, parse_report
+from lambdapool.hedging import HedgePolicy, hedged_map
+from lambdapool.concurrency import ConcurrencyController, is_throttle
+from lambdapool.cache import cache_key
+from lambdapool.local import BACKENDS, LocalBackend, HybridPolicy, invocation_count
+from lambdapool import utils, agent
 
 logger = logging.getLogger(__name__)
 
+# The synchronous Invoke API limits the payloads to 6 MB
+DEFAULT_OFFLOAD_THRESHOLD = 5 * 1024 * 1024
+
+def encode_payload(payload: dict, context: 'Context', oob: Optional[tuple]=None) -> dict:
+    '''Encodes the payload into the event sent to the agent.
+
+    The payload is put in the blob store of the context if it is too large
+    to be sent directly. Such payloads are deleted by `release_payload`.
+
+    The arguments in `oob` are sent with out-of-band buffers, which are not
+    copied into the pickle, and are prepended to the arguments of the payload.
+    '''
+    start = time.perf_counter()
+    data, codec, raw_size = agent.pack(payload, context.codec, context.compress_threshold)
+    event = {
+        'codec': codec,
+        'response_codec': context.codec,
+        'threshold': context.compress_threshold
+    }
+
+    store = context.blob_store
+    if store is not None:
+        event['store'] = store.spec()
+        event['offload_threshold'] = context.offload_threshold
+
+    if store is not None and agent.b64size(len(data)) > context.offload_threshold:
+        event['payload_ref'] = store.put(data)
+    else:
+        event['payload'] = base64.b64encode(data).decode('ascii')
+
+    if oob is not None:
+        event['oob'] = agent.encode_buffers(oob, store, context.offload_threshold)
+
+    context.codec_stats.record_request(codec, raw_size, len(data), time.perf_counter() - start)
+    return event
+
+def release_payload(event: dict, context: 'Context'):
+    '''Deletes the payload of `event` from the blob store, if it was put there
+    '''
+    if 'payload_ref' in event:
+        context.blob_store.delete(event['payload_ref'])
+    for key in agent.stored_keys(event.get('oob', {})):
+        context.blob_store.delete(key)
+
+# A result left in the blob store by the agent, for a later invocation to read
+KeptResult = collections.namedtuple('KeptResult', ['key', 'codec'])
+
+def decode_response(body: bytes, context: 'Context'):
+    '''Decodes the response of the agent and returns the result.
+
+    A result the agent was asked to keep in the blob store is not fetched, and
+    a `KeptResult` is returned instead.
+
+    Raises LambdaPoolError if the function or the AWS infrastructure reported an error.
+    '''
+    response = json.loads(body.decode('ascii'))
+
+    if response.get('need_function'):
+        raise FunctionNotCachedError('The function is not cached by the agent')
+    elif response.get('error'):
+        raise LambdaPoolError(response['error'])
+    # AWS errors like timeout errors are passed like this
+    elif response.get('errorMessage'):
+        raise LambdaPoolError(response['errorMessage'])
+
+    if response.get('kept'):
+        return KeptResult(response['result_ref'], response.get('codec', 'none'))
+
+    if 'result_oob' in response:
+        result = agent.decode_buffers(response['result_oob'], context.blob_store)
+        for key in agent.stored_keys(response['result_oob']):
+            context.blob_store.delete(key)
+        return result
+
+    start = time.perf_counter()
+    if 'result_ref' in response:
+        if context.blob_store is None:
+            raise LambdaPoolError('The result was put in a blob store but the context has none')
+        data = context.blob_store.get(response['result_ref'])
+        context.blob_store.delete(response['result_ref'])
+    else:
+        data = base64.b64decode(response['result'])
+
+    codec = response.get('codec', 'none')
+    result = agent.unpack(data, codec)
+    context.codec_stats.record_response(codec, response.get('size', len(data)), len(data), time.perf_counter() - start, response.get('timings'))
+
+    return result
+
+def warm_containers(context: 'Context', n: int, hold: float=1.0) -> dict:
+    '''Sends `n` concurrent no-op invocations to start containers before a burst.
+
+    Every invocation keeps its container busy for `hold` seconds, so that the
+    invocations land on distinct containers. The invocations are not limited
+    by the concurrency of the context and throttled invocations are not retried.
+    '''
+    body = json.dumps({'warm': True, 'hold': hold})
+
+    def invoke(_):
+        start = time.perf_counter()
+        try:
+            response = context.lambda_client.invoke(FunctionName=context.lambda_function, LogType='Tail', Payload=body)
+        except Exception as e:
+            if is_throttle(e):
+                return {'throttled': True}
+            return {'error': str(e)}
+        report = parse_report(response['LogResult']) if response.get('LogResult') else None
+        context.stats.record(report, time.perf_counter() - start)
+        return json.loads(response['Payload'].read())
+
+    with ThreadPoolExecutor(n) as executor:
+        responses = list(executor.map(invoke, range(n)))
+
+    warmed = [r for r in responses if r.get('warm')]
+    return {
+        'invocations': n,
+        'cold': sum(1 for r in warmed if r['cold']),
+        'warm': sum(1 for r in warmed if not r['cold']),
+        'containers': len({r['container'] for r in warmed}),
+        'throttled': sum(1 for r in responses if r.get('throttled')),
+        'errors': sum(1 for r in responses if not r.get('warm') and not r.get('throttled'))
+    }
+
 class Context:
     def __init__(self, lambda_function: str, aws_access_key_id: Optional[str]=None, aws_secret_access_key: Optional[str]=None, aws_region_name: Optional[str]=None, **kwargs):
         self.lambda_function = lambda_function
@@ -20,60 +160,213 @@ class Context:
         self.aws_secret_access_key = aws_secret_access_key
         self.region_name = aws_region_name
         self.read_timeout = kwargs.pop('read_timeout', 300)
+        self.codec = kwargs.pop('codec', 'none')
+        self.compress_threshold = kwargs.pop('compress_threshold', 1024)
+        if self.codec not in agent.CODECS:
+            raise LambdaPoolError(f'Unsupported codec {self.codec}. Available codecs are {", ".join(agent.CODECS)}')
+
+        self.blob_store = kwargs.pop('blob_store', None)
+        self.cache = kwargs.pop('cache', None)
+        self.offload_threshold = kwargs.pop('offload_threshold', DEFAULT_OFFLOAD_THRESHOLD)
+
+        max_concurrency = kwargs.pop('max_concurrency', None)
+        self.concurrency = ConcurrencyController(
+            max_limit=max_concurrency,
+            max_retries=kwargs.pop('throttle_retries', 8)
+        )
+
+        # Every worker needs its own connection, otherwise the connections
+        # beyond the size of the pool are opened and closed for every call
+        self.endpoint_url = kwargs.pop('endpoint_url', None)
+        self.max_pool_connections = kwargs.pop('max_pool_connections', max(10, max_concurrency or 10))
+        self._lambda_client = None
+        self._lock = threading.Lock()
+
+        # Digests of the functions which have been sent to the agent at least once
+        self.sent_functions = set()
+
+        # Where the invocations run: on lambda, in local processes, or either one for every map
+        self.backend = kwargs.pop('backend', 'lambda')
+        if self.backend not in BACKENDS:
+            raise LambdaPoolError(f'Unsupported backend {self.backend}. Available backends are {", ".join(BACKENDS)}')
+        local_workers = kwargs.pop('local_workers', None)
+        self.local = LocalBackend(local_workers) if self.backend != 'lambda' else None
+        self.hybrid = HybridPolicy(self.local.workers, max_concurrency or 1000) if self.backend == 'hybrid' else None
+
+        self.codec_stats = CodecStats()
+        self.hedge_stats = HedgeStats()
+        self.stats = InvocationStats()
+
+    @property
+    def lambda_client(self):
+        '''The boto3 client shared by all the calls made with this context
+        '''
+        with self._lock:
+            if self._lambda_client is None:
+                self._lambda_client = boto3.client(
+                    'lambda',
+                    aws_access_key_id=self.aws_access_key_id,
+                    aws_secret_access_key=self.aws_secret_access_key,
+                    region_name=self.region_name,
+                    endpoint_url=self.endpoint_url,
+                    config=Config(
+                        read_timeout=self.read_timeout,
+                        max_pool_connections=self.max_pool_connections,
+                        tcp_keepalive=True,
+                        # Throttled invocations are retried by the concurrency controller
+                        retries={'max_attempts': 0}
+                    )
+                )
+            return self._lambda_client
+
+    def choose_backend(self, invocations: Optional[int]=1) -> str:
+        '''Returns the backend, "lambda" or "local", of a map of `invocations`
+        '''
+        if self.hybrid is not None:
+            return self.hybrid.choose(invocations, self.local.pending)
+        return self.backend
+
+    def record(self, backend: str, report: Optional[dict], client_seconds: float):
+        '''Records an invocation in the stats and in the estimates of the hybrid backend
+        '''
+        self.stats.record(report, client_seconds)
+        if self.hybrid is not None and report and 'duration' in report:
+            client_time = client_seconds * 1000 if backend == 'lambda' else None
+            self.hybrid.record(report['duration'], client_time)
+
+    def close(self, wait: bool=True):
+        '''Stops the local processes, if any
+        '''
+        if self.local is not None:
+            self.local.shutdown(wait)
 
 class LambdaFunction:
-    def __init__(self, context, function):
+    def __init__(self, context, function, backend: Optional[str]=None):
         self.context = context
         self.function = function
-        self._d = threading.local()
+        # "lambda" or "local", chosen by the context for every map unless given
+        self.backend = backend or context.choose_backend()
+        if isinstance(function, str):
+            # A reference like "module:function" to a function deployed with the package
+            self.function_pickle = None
+            self.function_digest = None
+        else:
+            # The function and its closure are pickled only once and the pickle
+            # is embedded as is in the payload of every invocation
+            self.function_pickle = cloudpickle.dumps(function)
+            self.function_digest = hashlib.sha256(self.function_pickle).hexdigest()
 
     def __call__(self, *args, **kwargs):
-        payload = {
-            'function': self.function,
-            'args': args,
-            'kwargs': kwargs
-        }
+        cache = self.context.cache
+        if cache is None:
+            return self.call(self.payload(args, kwargs))
 
-        return self._invoke_function(payload)
+        key = self.cache_key(args, kwargs)
+        value = cache.get(key)
+        if value is not None:
+            return cloudpickle.loads(value)
 
-    @property
-    def lambda_client(self):
-        d = self._d
-        if not hasattr(d, "lambda_client"):
-            d.lambda_client = boto3.client(
-                'lambda',
-                aws_access_key_id=self.context.aws_access_key_id,
-                aws_secret_access_key=self.context.aws_secret_access_key,
-                region_name=self.context.region_name,
-                config=Config(read_timeout=self.context.read_timeout)
-                )
-        return d.lambda_client
+        result = self.call(self.payload(args, kwargs))
+        cache.set(key, cloudpickle.dumps(result))
+        return result
 
-    def _invoke_function(self, payload):
-        payload = base64.b64encode(cloudpickle.dumps(payload)).decode('ascii')
+    def call_batch(self, batch: Iterable):
+        '''Runs the function for every (args, kwargs) pair in `batch` using
+        a single invocation and returns the list of results in order.
 
-        payload = json.dumps(payload)
+        With a cache, only the calls which are not cached are sent.
+        '''
+        cache = self.context.cache
+        if cache is None:
+            return self.call(self.batch_payload(batch))
 
-        response = self.lambda_client.invoke(
-            FunctionName=self.context.lambda_function,
-            LogType='Tail',
-            Payload=payload
-        )
+        batch = [(tuple(args), dict(kwargs)) for args, kwargs in batch]
+        keys = [self.cache_key(args, kwargs) for args, kwargs in batch]
+        values = [cache.get(key) for key in keys]
+        results = [None if value is None else cloudpickle.loads(value) for value in values]
 
-        response = json.loads(response['Payload'].read().decode('ascii'))
+        misses = [index for index, value in enumerate(values) if value is None]
+        if misses:
+            computed = self.call(self.batch_payload([batch[index] for index in misses]))
+            for index, result in zip(misses, computed):
+                results[index] = result
+                cache.set(keys[index], cloudpickle.dumps(result))
 
-        if response.get('error'):
-            raise LambdaPoolError(response['error'])
-        # AWS errors like timeout errors are passed like this
-        elif response.get('errorMessage'):
-            raise LambdaPoolError(response['errorMessage'])
+        return results
 
-        result = response['result']
+    def cache_key(self, args, kwargs) -> str:
+        function_id = self.function.encode('utf-8') if self.function_pickle is None else self.function_pickle
+        return cache_key(function_id, args, kwargs)
 
-        result = cloudpickle.loads(base64.b64decode(result.encode('ascii')))
+    def call(self, payload: dict, oob: Optional[tuple]=None):
+        '''Invokes the lambda function with `payload`, and the arguments `oob`
+        sent with out-of-band buffers.
 
+        Once the function has been sent, the payloads only carry its digest.
+        If the container which got the invocation does not have it cached,
+        the invocation is retried with the function.
+        '''
+        try:
+            result = self._invoke_function(payload, oob)
+        except FunctionNotCachedError:
+            result = self._invoke_function(self.with_function(payload), oob)
+
+        self.function_sent()
         return result
 
+    def payload(self, args, kwargs):
+        return self._function_payload({
+            'args': args,
+            'kwargs': kwargs
+        })
+
+    def batch_payload(self, batch: Iterable):
+        return self._function_payload({
+            'batch': [(tuple(args), dict(kwargs)) for args, kwargs in batch]
+        })
+
+    def _function_payload(self, payload):
+        if self.function_digest is None:
+            payload['function_ref'] = self.function
+            return payload
+
+        payload['function_digest'] = self.function_digest
+        if self.function_digest not in self.context.sent_functions:
+            payload['function_pickle'] = self.function_pickle
+        return payload
+
+    def with_function(self, payload: dict) -> dict:
+        return dict(payload, function_pickle=self.function_pickle)
+
+    def function_sent(self):
+        if self.function_digest is not None:
+            self.context.sent_functions.add(self.function_digest)
+
+    def _invoke(self, body):
+        start = time.perf_counter()
+        if self.backend == 'local':
+            data, report = self.context.local.invoke(body)
+            self.context.record(self.backend, report, time.perf_counter() - start)
+            return {'StatusCode': 200, 'Payload': io.BytesIO(data)}
+
+        response = self.context.lambda_client.invoke(
+            FunctionName=self.context.lambda_function,
+            LogType='Tail',
+            Payload=body
+        )
+        report = parse_report(response['LogResult']) if response.get('LogResult') else None
+        self.context.record(self.backend, report, time.perf_counter() - start)
+        return response
+
+    def _invoke_function(self, payload, oob=None):
+        event = encode_payload(payload, self.context, oob)
+        try:
+            body = json.dumps(event)
+            response = self.context.concurrency.run(lambda: self._invoke(body))
+            return decode_response(response['Payload'].read(), self.context)
+        finally:
+            release_payload(event, self.context)
+
 class LambdaPool:
     def __init__(
         self,
@@ -81,21 +374,370 @@ class LambdaPool:
         lambda_function: str,
         aws_access_key_id: str=None,
         aws_secret_access_key: str=None,
-        aws_region_name: str=None
+        aws_region_name: str=None,
+        **kwargs
     ):
         self.workers = workers
-        self.context = Context(lambda_function, aws_access_key_id, aws_secret_access_key, aws_region_name)
+        kwargs.setdefault('max_concurrency', workers)
+        self.context = Context(lambda_function, aws_access_key_id, aws_secret_access_key, aws_region_name, **kwargs)
+        self._pool = ThreadPool(workers)
+        self._executor = _PoolExecutor(self._pool)
+        self._closed = False
 
-    def map(self, function, iterable: List):
-        f = LambdaFunction(self.context, function)
-        with ThreadPool(self.workers) as pool:
-            return pool.map(f, iterable)
+    @property
+    def codec_stats(self):
+        return self.context.codec_stats
+
+    @property
+    def stats(self):
+        return self.context.stats
+
+    @property
+    def cache(self):
+        return self.context.cache
+
+    @property
+    def hedge_stats(self):
+        return self.context.hedge_stats
+
+    @property
+    def concurrency(self):
+        '''The current limit on concurrent invocations
+        '''
+        return self.context.concurrency.limit
+
+    @property
+    def peak_concurrency(self):
+        return self.context.concurrency.peak
+
+    def _calls(self, function, iterable, chunksize, star):
+        '''Returns the callable to run for every item, the items and whether they are batches.
+        '''
+        f = LambdaFunction(self.context, function, self.context.choose_backend(invocation_count([iterable], chunksize)))
+
+        if chunksize is None or chunksize == 1:
+            if star:
+                return (lambda args: f(*args)), iterable, False
+            return f, iterable, False
+
+        batches = (
+            [(tuple(item) if star else (item,), {}) for item in chunk]
+            for chunk in utils.chunked(iterable, chunksize)
+        )
+        return f.call_batch, batches, True
+
+    def map(self, function, iterable: List, chunksize: Optional[int]=None, hedge: Optional[HedgePolicy]=None):
+        '''Applies `function` to every item of `iterable` and returns the results in order.
+
+        When `chunksize` is given, the items are grouped into batches of that size
+        and every batch is run by a single lambda invocation. When a `hedge` policy
+        is given, the slowest invocations are re-issued near the end of the map.
+        '''
+        return self._map(function, iterable, chunksize, hedge, star=False)
+
+    def starmap(self, function, iterable: List, chunksize: Optional[int]=None, hedge: Optional[HedgePolicy]=None):
+        '''Like `map`, but every item of `iterable` is unpacked as the arguments of `function`.
+        '''
+        return self._map(function, iterable, chunksize, hedge, star=True)
+
+    def _map(self, function, iterable, chunksize, hedge, star):
+        # The items are read upfront anyway, and their number picks the hybrid backend
+        if not hasattr(iterable, '__len__'):
+            iterable = list(iterable)
+        call, items, batched = self._calls(function, iterable, chunksize, star)
+
+        if hedge is not None:
+            # The losing invocations are left to finish in the background
+            results = list(hedged_map(self._executor, call, list(items), hedge, self.context.hedge_stats))
+        else:
+            results = self._pool.map(call, items)
+
+        if batched:
+            return list(itertools.chain.from_iterable(results))
+        return results
+
+    def map_async(self, function, iterable: List, chunksize: Optional[int]=None, callback=None, error_callback=None):
+        '''Asynchronous version of `map`, returning an `AsyncResult`.
+        '''
+        return self._map_async(function, iterable, chunksize, callback, error_callback, star=False)
+
+    def starmap_async(self, function, iterable: List, chunksize: Optional[int]=None, callback=None, error_callback=None):
+        '''Asynchronous version of `starmap`, returning an `AsyncResult`.
+        '''
+        return self._map_async(function, iterable, chunksize, callback, error_callback, star=True)
+
+    def _map_async(self, function, iterable, chunksize, callback, error_callback, star):
+        if not hasattr(iterable, '__len__'):
+            iterable = list(iterable)
+        call, items, batched = self._calls(function, iterable, chunksize, star)
+        if not batched:
+            return self._pool.map_async(call, items, callback=callback, error_callback=error_callback)
+
+        if callback is not None:
+            on_success = lambda results: callback(list(itertools.chain.from_iterable(results)))
+        else:
+            on_success = None
+        return _ChainedResult(self._pool.map_async(call, items, callback=on_success, error_callback=error_callback))
+
+    def imap(self, function, iterable: Iterable, chunksize: Optional[int]=None, window: Optional[int]=None):
+        '''Lazily applies `function` to the items of `iterable`, yielding the results in order.
+
+        At most `window` invocations (defaults to the number of workers) are in flight
+        at any time, so the iterable can be an unbounded generator.
+        '''
+        return self._imap(function, iterable, chunksize, window, ordered=True)
+
+    def imap_unordered(self, function, iterable: Iterable, chunksize: Optional[int]=None, window: Optional[int]=None):
+        '''Same as `imap`, but yields the results as soon as the invocations complete.
+        '''
+        return self._imap(function, iterable, chunksize, window, ordered=False)
+
+    def _imap(self, function, iterable, chunksize, window, ordered):
+        self._check_running()
+        call, items, batched = self._calls(function, iterable, chunksize, star=False)
+        window = window or self.workers
+
+        results = utils.windowed_map(lambda item: self._executor.submit(call, item), items, window, ordered)
+        if not batched:
+            yield from results
+            return
+
+        for result in results:
+            yield from result
+
+    def map_reduce(self, map_function, reduce_function, iterable: List, fan_in: int=8, chunksize: Optional[int]=None):
+        '''Returns `functools.reduce(reduce_function, map(map_function, iterable))`,
+        with the reduction done on lambda as a tree.
+
+        Every invocation of the map applies `map_function` to `chunksize` items
+        (defaults to `fan_in`) and folds their results. The partial results are
+        then folded `fan_in` at a time by further invocations, level by level,
+        until one is left. `reduce_function` must be associative.
+
+        With a blob store, the partial results stay in the store and only the
+        final result is sent to the client. Otherwise, the partial results are
+        sent back and forth between the levels.
+        '''
+        self._check_running()
+        if fan_in < 2:
+            raise ValueError('fan_in must be at least 2')
+
+        chunks = list(utils.chunked(iterable, chunksize or fan_in))
+        if not chunks:
+            raise TypeError('map_reduce() of empty iterable')
+
+        keep = self.context.blob_store is not None
+        mapper = LambdaFunction(self.context, map_function, self.context.choose_backend(len(chunks)))
+        reduce_pickle = cloudpickle.dumps(reduce_function)
+
+        def run_chunk(chunk):
+            payload = mapper.batch_payload([((item,), {}) for item in chunk])
+            return mapper.call(dict(payload, reduce_function=reduce_pickle, keep=keep and len(chunks) > 1))
+
+        def run_level(call, items, previous):
+            outcomes = self._pool.map(lambda item: _outcome(call, item), items)
+            results = [value for ok, value in outcomes if ok]
+            errors = [value for ok, value in outcomes if not ok]
+            if errors:
+                # The agent deletes the partial results it has folded, the others are left to the client
+                for partial in previous + results:
+                    if isinstance(partial, KeptResult):
+                        self.context.blob_store.delete(partial.key)
+                raise errors[0]
+            return results
+
+        partials = run_level(run_chunk, chunks, [])
+        while len(partials) > 1:
+            groups = list(utils.chunked(partials, fan_in))
+            reducer = LambdaFunction(self.context, reduce_function, self.context.choose_backend(len(groups)))
+            last = len(groups) == 1
+
+            def run_group(group):
+                if keep:
+                    payload = {'reduce_refs': [list(partial) for partial in group], 'keep': not last}
+                else:
+                    payload = {'reduce_values': group}
+                return reducer.call(reducer._function_payload(payload))
+
+            partials = run_level(run_group, groups, partials)
+
+        return partials[0]
+
+    def map_array(self, function, array, axis: int=0, shards: Optional[int]=None, out=None):
+        '''Applies `function` to shards of `array`, a numpy array or a pandas DataFrame,
+        split along `axis`, and returns the results joined along `axis`.
+
+        The shards are sent with out-of-band buffers, so their data is not
+        copied into pickles. A shard which is not contiguous, e.g. along axis 1
+        of a C-order array, is copied into a contiguous array first. Without a
+        blob store, every shard must fit in the 6 MB payload of an invocation.
+        The results come back
+        the same way and are copied into `out`, or into an array allocated from
+        the first result. They must have the same length along `axis` as their
+        shard. Results which are DataFrames are concatenated instead.
+
+        By default, there are enough shards to keep every one under the
+        offload threshold, and at least one per worker.
+        '''
+        self._check_running()
+        if numpy is None:
+            raise LambdaPoolError('map_array requires numpy. Install it with `pip install numpy`')
+
+        length = array.shape[axis]
+        if shards is None:
+            shards = max(self.workers, -(-_nbytes(array) // (self.context.offload_threshold * 3 // 4)))
+        shards = max(1, min(shards, length))
+        bounds = [(length * i // shards, length * (i + 1) // shards) for i in range(shards)]
+
+        f = LambdaFunction(self.context, function, self.context.choose_backend(shards))
+
+        def run(bound):
+            return f.call(dict(f.payload((), {}), oob_result=True), oob=(_contiguous(_shard(array, axis, *bound)),))
+
+        frames = []
+        for (start, stop), result in zip(bounds, self._pool.imap(run, bounds)):
+            if hasattr(result, 'iloc'):
+                frames.append(result)
+                continue
+
+            result = numpy.asarray(result)
+            if result.ndim <= axis or result.shape[axis] != stop - start:
+                raise LambdaPoolError(f'The result of the shard [{start}:{stop}] does not have {stop - start} items along axis {axis}')
+            if out is None:
+                shape = result.shape[:axis] + (length,) + result.shape[axis + 1:]
+                out = numpy.empty(shape, dtype=result.dtype)
+            numpy.copyto(_shard(out, axis, start, stop), result)
+
+        if frames:
+            import pandas
+            return pandas.concat(frames, axis=axis)
+        return out
 
     def apply(self, function, args: List = [], kwds: dict = {}):
         f = LambdaFunction(self.context, function)
         return f(*args, **kwds)
 
-    def apply_async(self, function, args: List = [], kwds: dict = {}):
+    def warm(self, n: Optional[int]=None, hold: float=1.0) -> dict:
+        '''Starts `n` containers (defaults to the number of workers) before a burst of invocations.
+
+        Returns the number of invocations which came back from a cold or an already
+        warm container, the number of distinct containers, and the number of
+        throttled and failed invocations.
+        '''
+        self._check_running()
+        if self.context.backend == 'local':
+            raise LambdaPoolError('There are no containers to warm with the local backend')
+        return warm_containers(self.context, n or self.workers, hold)
+
+    def apply_async(self, function, args: List = [], kwds: dict = {}, callback=None, error_callback=None):
         f = LambdaFunction(self.context, function)
-        with ThreadPool(self.workers) as pool:
-            return pool.apply_async(f, args=args, kwds=kwds)
+        return self._pool.apply_async(f, args=args, kwds=kwds, callback=callback, error_callback=error_callback)
+
+    def _check_running(self):
+        if self._closed:
+            raise ValueError("Pool not running")
+
+    def close(self):
+        '''Prevents any more tasks from being submitted to the pool.
+
+        The worker threads exit once the pending tasks are done.
+        '''
+        self._closed = True
+        self._pool.close()
+
+    def terminate(self):
+        '''Stops the worker threads without completing the pending tasks.
+        '''
+        self._closed = True
+        self._pool.terminate()
+        self.context.close(wait=False)
+
+    def join(self):
+        '''Waits for the worker threads to exit. `close` or `terminate` must be called first.
+        '''
+        self._pool.join()
+        self.context.close()
+
+    def __enter__(self):
+        self._check_running()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.terminate()
+
+
+def _shard(array, axis, start, stop):
+    '''Returns the view of the items `start` to `stop` of `array` along `axis`
+    '''
+    if hasattr(array, 'iloc'):
+        return array.iloc[start:stop] if axis == 0 else array.iloc[:, start:stop]
+    return array[(slice(None),) * axis + (slice(start, stop),)]
+
+def _contiguous(array):
+    '''Returns `array`, or a C-order copy if it is a numpy array which is not contiguous.
+
+    Only contiguous arrays are pickled with out-of-band buffers.
+    '''
+    if isinstance(array, numpy.ndarray) and not (array.flags.c_contiguous or array.flags.f_contiguous):
+        return numpy.ascontiguousarray(array)
+    return array
+
+def _nbytes(array) -> int:
+    '''Returns the size of the data of a numpy array or a pandas DataFrame
+    '''
+    if hasattr(array, 'memory_usage'):
+        return int(array.memory_usage(deep=True).sum())
+    return array.nbytes
+
+def _outcome(call, item):
+    '''Returns (True, result) or (False, exception) of `call(item)`
+    '''
+    try:
+        return True, call(item)
+    except Exception as e:
+        return False, e
+
+
+class _ChainedResult:
+    '''The `AsyncResult` of a chunked `map_async`, which flattens the results of the batches.
+    '''
+    def __init__(self, async_result):
+        self.async_result = async_result
+
+    def ready(self):
+        return self.async_result.ready()
+
+    def successful(self):
+        return self.async_result.successful()
+
+    def wait(self, timeout=None):
+        self.async_result.wait(timeout)
+
+    def get(self, timeout=None):
+        return list(itertools.chain.from_iterable(self.async_result.get(timeout)))
+
+
+class _PoolExecutor:
+    '''Submits calls to a `ThreadPool` and returns `concurrent.futures.Future` objects.
+
+    This lets the future based helpers, such as `utils.windowed_map` and `hedged_map`,
+    run on the worker threads of the pool.
+    '''
+    def __init__(self, pool: ThreadPool):
+        self.pool = pool
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+
+        def run():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+        self.pool.apply_async(run)
+        return future
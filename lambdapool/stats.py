@@ -0,0 +1,246 @@
+'''
+lambdapool.stats
+
+Counters collected by the pools while invoking functions.
+'''
+import re
+import time
+import bisect
+import base64
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+class CodecStats:
+    '''Aggregates the payload sizes and the time spent encoding and decoding them.
+
+    The sizes are in bytes and the times in seconds. `raw` sizes are those of
+    the pickles and `encoded` sizes those of the compressed data.
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.request_raw_bytes = 0
+        self.request_encoded_bytes = 0
+        self.response_raw_bytes = 0
+        self.response_encoded_bytes = 0
+        self.encode_time = 0.0
+        self.decode_time = 0.0
+        self.agent_decode_time = 0.0
+        self.agent_encode_time = 0.0
+
+    def record_request(self, codec, raw_bytes, encoded_bytes, seconds):
+        logger.debug('request codec=%s raw=%d encoded=%d ratio=%.2f encode_time=%.6fs',
+            codec, raw_bytes, encoded_bytes, _ratio(raw_bytes, encoded_bytes), seconds)
+        with self._lock:
+            self.calls += 1
+            self.request_raw_bytes += raw_bytes
+            self.request_encoded_bytes += encoded_bytes
+            self.encode_time += seconds
+
+    def record_response(self, codec, raw_bytes, encoded_bytes, seconds, timings=None):
+        timings = timings or {}
+        logger.debug('response codec=%s raw=%d encoded=%d ratio=%.2f decode_time=%.6fs',
+            codec, raw_bytes, encoded_bytes, _ratio(raw_bytes, encoded_bytes), seconds)
+        with self._lock:
+            self.response_raw_bytes += raw_bytes
+            self.response_encoded_bytes += encoded_bytes
+            self.decode_time += seconds
+            self.agent_decode_time += timings.get('decode', 0.0)
+            self.agent_encode_time += timings.get('encode', 0.0)
+
+    @property
+    def request_ratio(self):
+        return _ratio(self.request_raw_bytes, self.request_encoded_bytes)
+
+    @property
+    def response_ratio(self):
+        return _ratio(self.response_raw_bytes, self.response_encoded_bytes)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'request_raw_bytes': self.request_raw_bytes,
+                'request_encoded_bytes': self.request_encoded_bytes,
+                'request_ratio': self.request_ratio,
+                'response_raw_bytes': self.response_raw_bytes,
+                'response_encoded_bytes': self.response_encoded_bytes,
+                'response_ratio': self.response_ratio,
+                'encode_time': self.encode_time,
+                'decode_time': self.decode_time,
+                'agent_decode_time': self.agent_decode_time,
+                'agent_encode_time': self.agent_encode_time,
+            }
+
+    def __repr__(self):
+        return f'<CodecStats calls={self.calls} request_ratio={self.request_ratio:.2f} response_ratio={self.response_ratio:.2f}>'
+
+class HedgeStats:
+    '''Counts the hedged invocations.
+
+    `time_saved` is the total time by which the winning hedges finished before
+    the original invocations, for the originals which have completed since.
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hedges = 0
+        self.wins = 0
+        self.time_saved = 0.0
+
+    def record_hedge(self):
+        with self._lock:
+            self.hedges += 1
+
+    def record_win(self, original, won_at):
+        '''Records that a hedge finished before the `original` future
+        '''
+        with self._lock:
+            self.wins += 1
+        original.add_done_callback(lambda future: self._record_saving(future, time.monotonic() - won_at))
+
+    def _record_saving(self, future, seconds):
+        if future.cancelled():
+            return
+        with self._lock:
+            self.time_saved += seconds
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'hedges': self.hedges,
+                'wins': self.wins,
+                'time_saved': self.time_saved
+            }
+
+    def __repr__(self):
+        return f'<HedgeStats hedges={self.hedges} wins={self.wins} time_saved={self.time_saved:.3f}s>'
+
+REPORT_FIELDS = {
+    'duration': r'(?:^|\t)Duration: ([\d.]+) ms',
+    'billed_duration': r'Billed Duration: ([\d.]+) ms',
+    'memory_size': r'Memory Size: (\d+) MB',
+    'max_memory_used': r'Max Memory Used: (\d+) MB',
+    'init_duration': r'Init Duration: ([\d.]+) ms',
+}
+
+def parse_report(log_result: str) -> dict:
+    '''Parses the REPORT line of the base64 log tail returned by the Invoke API.
+
+    Returns a dictionary with the fields of REPORT_FIELDS found in the line, in
+    milliseconds and megabytes, or None when there is no REPORT line.
+    '''
+    log = base64.b64decode(log_result).decode('utf-8', 'replace')
+    for line in reversed(log.splitlines()):
+        if line.startswith('REPORT'):
+            report = {}
+            for field, pattern in REPORT_FIELDS.items():
+                match = re.search(pattern, line)
+                if match:
+                    report[field] = float(match.group(1))
+            return report
+
+# Upper bounds of the buckets of the duration histogram, in milliseconds
+DURATION_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 60000, 300000, 900000)
+
+class InvocationStats:
+    '''Aggregates the execution metrics of the invocations.
+
+    The metrics are read from the REPORT line that lambda appends to the log
+    tail of every invocation. Durations are in milliseconds and memory in MB.
+    `client_time` is the time the client waited for the invocations, so
+    `overhead` is the part of it not spent running the function: network,
+    queueing and cold starts.
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.invocations = 0
+        self.reports = 0
+        self.cold_starts = 0
+        self.durations = []
+        self.init_duration = 0.0
+        self.billed_duration = 0.0
+        self.billed_gb_seconds = 0.0
+        self.max_memory_used = 0
+        self.memory_size = None
+        self.client_time = 0.0
+        self.function_time = 0.0
+        self.histogram = [0] * (len(DURATION_BUCKETS) + 1)
+
+    def record(self, report: dict, client_seconds: float):
+        with self._lock:
+            self.invocations += 1
+            self.client_time += client_seconds * 1000
+            if not report:
+                return
+
+            self.reports += 1
+            duration = report.get('duration', 0.0)
+            self.durations.append(duration)
+            self.histogram[bisect.bisect_left(DURATION_BUCKETS, duration)] += 1
+            self.function_time += duration + report.get('init_duration', 0.0)
+
+            if 'init_duration' in report:
+                self.cold_starts += 1
+                self.init_duration += report['init_duration']
+
+            billed = report.get('billed_duration', 0.0)
+            self.billed_duration += billed
+            if 'memory_size' in report:
+                self.memory_size = report['memory_size']
+                self.billed_gb_seconds += billed / 1000 * report['memory_size'] / 1024
+
+            self.max_memory_used = max(self.max_memory_used, report.get('max_memory_used', 0))
+
+    @property
+    def cold_start_rate(self):
+        return self.cold_starts / self.reports if self.reports else 0.0
+
+    @property
+    def overhead(self):
+        '''Milliseconds the client waited beyond the function duration, in total
+        '''
+        return self.client_time - self.function_time
+
+    def percentile(self, percent: float) -> float:
+        '''Returns the `percent` percentile of the durations
+        '''
+        with self._lock:
+            durations = sorted(self.durations)
+        if not durations:
+            return 0.0
+        return durations[min(len(durations) - 1, int(len(durations) * percent / 100))]
+
+    def duration_histogram(self):
+        '''Returns a list of (upper bound in ms, count) for the durations.
+        The last bucket, with an upper bound of None, counts the longer ones.
+        '''
+        with self._lock:
+            return list(zip(DURATION_BUCKETS + (None,), self.histogram))
+
+    def as_dict(self):
+        return {
+            'invocations': self.invocations,
+            'cold_starts': self.cold_starts,
+            'cold_start_rate': self.cold_start_rate,
+            'duration_p50': self.percentile(50),
+            'duration_p90': self.percentile(90),
+            'duration_p99': self.percentile(99),
+            'init_duration': self.init_duration,
+            'billed_duration': self.billed_duration,
+            'billed_gb_seconds': self.billed_gb_seconds,
+            'max_memory_used': self.max_memory_used,
+            'memory_size': self.memory_size,
+            'client_time': self.client_time,
+            'function_time': self.function_time,
+            'overhead': self.overhead,
+        }
+
+    def __repr__(self):
+        return (f'<InvocationStats invocations={self.invocations} cold_start_rate={self.cold_start_rate:.2f} '
+            f'p50={self.percentile(50):.1f}ms p99={self.percentile(99):.1f}ms '
+            f'max_memory_used={self.max_memory_used}MB billed_gb_seconds={self.billed_gb_seconds:.3f}>')
+
+def _ratio(raw_bytes, encoded_bytes):
+    return raw_bytes / encoded_bytes if encoded_bytes else 1.0
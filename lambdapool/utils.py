@@ -1,7 +1,11 @@
 import shutil
 import subprocess
 import math
+import time
 import datetime
+import itertools
+import collections
+from concurrent.futures import wait, FIRST_COMPLETED, TimeoutError
 
 def copy(src, dest):
     if src.is_file():
@@ -12,6 +16,65 @@ def copy(src, dest):
 def run_command(command):
     return subprocess.run(command.split(), check=True)
 
+def chunked(iterable, size):
+    """Lazily splits an iterable into lists of at most `size` items.
+
+        >>> list(chunked(range(5), 2))
+        [[0, 1], [2, 3], [4]]
+    """
+    if size < 1:
+        raise ValueError('chunksize must be >= 1')
+
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+def windowed_map(submit, iterable, window, ordered=True, timeout=None):
+    """Submits every item of `iterable` using `submit`, which should return a
+    `concurrent.futures.Future`, and returns an iterator over the results.
+
+    The iterable is consumed lazily and at most `window` futures are pending
+    at any time. The first window is submitted before returning. If `ordered`
+    is False, results are yielded as soon as they complete. If `timeout` is
+    given, `concurrent.futures.TimeoutError` is raised when a result is not
+    available `timeout` seconds after the call.
+    """
+    if window < 1:
+        raise ValueError('window must be >= 1')
+
+    end_time = None if timeout is None else time.monotonic() + timeout
+    iterator = iter(iterable)
+    pending = collections.deque(submit(item) for item in itertools.islice(iterator, window))
+    return _drain_window(submit, iterator, pending, ordered, end_time)
+
+def _drain_window(submit, iterator, pending, ordered, end_time):
+    try:
+        while pending:
+            waiting = [pending[0]] if ordered else pending
+            done, _ = wait(waiting, timeout=remaining(end_time), return_when=FIRST_COMPLETED)
+            if not done:
+                raise TimeoutError()
+
+            for future in done:
+                pending.remove(future)
+                result = future.result()
+                for item in itertools.islice(iterator, 1):
+                    pending.append(submit(item))
+                yield result
+    finally:
+        for future in pending:
+            future.cancel()
+
+def remaining(end_time):
+    """Returns the seconds left until `end_time`, or None if there is no deadline.
+    """
+    if end_time is None:
+        return None
+    return max(0, end_time - time.monotonic())
+
 def convert_size(size_bytes):
    if size_bytes == 0:
        return "0 B"
@@ -20,6 +20,10 @@ setup(
         'tabulate',
         'cloudpickle'
     ],
+    extras_require={
+        'async': ['aiohttp'],
+        'array': ['numpy']
+    },
     entry_points='''
         [console_scripts]
         lambdapool=lambdapool.cli:cli
@@ -1,6 +1,15 @@
+import io
+import json
+import math
+import time
+import base64
+
 import pytest
+from botocore.exceptions import ClientError
 from click.testing import CliRunner
 
+from lambdapool import pool
+from lambdapool.agent import lambda_handler
 from lambdapool.cli import cli
 from lambdapool.aws import LambdaFunction, Role
 
@@ -62,3 +71,38 @@ class TestFunctionBase:
     def function_fib(self, function_code):
         result = self.runner.invoke(cli, ['create', 'test-function', 'algorithms.py'])
         assert result.exit_code == 0
+
+class FakeLambdaClient:
+    '''Stands in for the boto3 lambda client by running the agent in-process
+    '''
+    def __init__(self):
+        self.payloads = []
+        self.throttles = 0
+
+    @property
+    def invocations(self):
+        return len(self.payloads)
+
+    def invoke(self, FunctionName, Payload, **kwargs):
+        if self.throttles:
+            self.throttles -= 1
+            raise ClientError({'Error': {'Code': 'TooManyRequestsException', 'Message': 'Rate exceeded'}}, 'Invoke')
+
+        self.payloads.append(Payload)
+        start = time.perf_counter()
+        response = lambda_handler(json.loads(Payload), None)
+        duration = (time.perf_counter() - start) * 1000
+        report = f'REPORT RequestId: {len(self.payloads)}\tDuration: {duration:.2f} ms\tBilled Duration: {math.ceil(duration)} ms\tMemory Size: 128 MB\tMax Memory Used: 50 MB\t'
+        if len(self.payloads) == 1:
+            report += 'Init Duration: 100.00 ms\t'
+        return {
+            'StatusCode': 200,
+            'LogResult': base64.b64encode(f'START\n{report}\n'.encode('utf-8')).decode('ascii'),
+            'Payload': io.BytesIO(json.dumps(response).encode('ascii'))
+        }
+
+class FakeLambdaBase:
+    @pytest.fixture(autouse=True)
+    def fake_lambda_client(self, monkeypatch):
+        self.lambda_client = client = FakeLambdaClient()
+        monkeypatch.setattr(pool.Context, 'lambda_client', property(lambda self: client))
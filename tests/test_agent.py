@@ -0,0 +1,164 @@
+import os
+import base64
+import collections
+
+import cloudpickle
+import pytest
+
+from lambdapool import agent
+from lambdapool.agent import lambda_handler, resolve_function, load_reference, dumps, loads, pack, unpack, CODECS, MemoryBlobStore, LocalBlobStore
+
+def increment(n, step=1):
+    return n + step
+
+def encode(payload):
+    return base64.b64encode(cloudpickle.dumps(payload)).decode('ascii')
+
+def decode(result):
+    return cloudpickle.loads(base64.b64decode(result))
+
+def test_lambda_handler():
+    response = lambda_handler(encode({'function': increment, 'args': (1,), 'kwargs': {'step': 5}}), None)
+    assert decode(response['result']) == 6
+
+def test_lambda_handler_batch():
+    batch = [((1,), {}), ((2,), {'step': 5})]
+    response = lambda_handler(encode({'function': increment, 'batch': batch}), None)
+    assert decode(response['result']) == [2, 7]
+
+def test_lambda_handler_error():
+    response = lambda_handler(encode({'function': increment, 'args': ('a',), 'kwargs': {}}), None)
+    assert 'result' not in response
+    assert 'str' in response['error']
+
+@pytest.mark.parametrize('codec', sorted(CODECS))
+def test_dumps_loads(codec):
+    data, used_codec, size = dumps(list(range(1000)), codec)
+    assert used_codec == codec
+    assert size == len(cloudpickle.dumps(list(range(1000))))
+    assert loads(data, used_codec) == list(range(1000))
+
+def test_dumps_below_threshold():
+    _, used_codec, _ = dumps([1, 2, 3], 'zlib', threshold=1024)
+    assert used_codec == 'none'
+
+def test_loads_unsupported_codec():
+    with pytest.raises(ValueError):
+        loads('', 'rot13')
+
+def test_lambda_handler_compressed():
+    payload, codec, _ = dumps({'function': list, 'args': (range(1000),), 'kwargs': {}}, 'lzma')
+    response = lambda_handler({'payload': payload, 'codec': codec, 'response_codec': 'zlib', 'threshold': 0}, None)
+    assert response['codec'] == 'zlib'
+    assert loads(response['result'], 'zlib') == list(range(1000))
+    assert set(response['timings']) == {'decode', 'encode'}
+
+def test_lambda_handler_offloads_result():
+    store = MemoryBlobStore()
+    event = {
+        'payload': encode({'function': list, 'args': (range(1000),), 'kwargs': {}}),
+        'store': store.spec(),
+        'offload_threshold': 100
+    }
+    response = lambda_handler(event, None)
+    assert 'result' not in response
+    assert unpack(store.get(response['result_ref'])) == list(range(1000))
+
+def test_lambda_handler_payload_ref(tmp_path):
+    store = LocalBlobStore(str(tmp_path))
+    data, codec, _ = pack({'function': sum, 'args': (range(10),), 'kwargs': {}}, 'zlib')
+    event = {'payload_ref': store.put(data), 'codec': codec, 'store': store.spec(), 'offload_threshold': 100}
+    response = lambda_handler(event, None)
+    assert decode(response['result']) == 45
+
+def test_lambda_handler_reduce_function():
+    batch = [((1,), {}), ((2,), {}), ((3,), {})]
+    payload = {'function': increment, 'batch': batch, 'reduce_function': cloudpickle.dumps(max)}
+    assert decode(lambda_handler(encode(payload), None)['result']) == 4
+
+def test_lambda_handler_reduce_refs():
+    store = MemoryBlobStore()
+    refs = [[store.put(pack(n)[0]), 'none'] for n in (1, 2, 3)]
+    event = {
+        'payload': encode({'function': lambda a, b: a * 10 + b, 'reduce_refs': refs, 'keep': True}),
+        'store': store.spec(),
+        'offload_threshold': 100
+    }
+    response = lambda_handler(event, None)
+    assert response['kept']
+    assert unpack(store.get(response['result_ref'])) == 123
+    assert list(store.blobs) == [response['result_ref']]
+
+def test_lambda_handler_reduce_values():
+    response = lambda_handler(encode({'function': min, 'reduce_values': [3, 1, 2]}), None)
+    assert decode(response['result']) == 1
+
+def test_encode_buffers(tmp_path):
+    numpy = pytest.importorskip('numpy')
+    array = numpy.arange(100, dtype='float64')
+    encoded = agent.encode_buffers((array, 'label'))
+    assert len(encoded['buffers']) == 1
+    result, label = agent.decode_buffers(encoded)
+    assert numpy.array_equal(result, array) and label == 'label'
+    assert not result.flags.writeable
+    assert agent.decode_buffers(encoded, writable=True)[0].flags.writeable
+
+    store = LocalBlobStore(str(tmp_path))
+    encoded = agent.encode_buffers(array, store, offload_threshold=100)
+    assert len(encoded['buffer_refs']) == 1
+    assert numpy.array_equal(agent.decode_buffers(encoded, store), array)
+
+    # Objects which are not contiguous buffers stay in the pickle, which is offloaded too
+    labels = ['label'] * 100
+    encoded = agent.encode_buffers(labels, store, offload_threshold=100)
+    assert agent.stored_keys(encoded) == [encoded['pickle_ref']]
+    assert agent.decode_buffers(encoded, store) == labels
+
+def test_lambda_handler_oob():
+    numpy = pytest.importorskip('numpy')
+    event = {
+        'payload': encode({'function': increment, 'args': (), 'kwargs': {'step': 2}, 'oob_result': True}),
+        'oob': agent.encode_buffers((numpy.arange(5),)),
+    }
+    response = lambda_handler(event, None)
+    assert numpy.array_equal(agent.decode_buffers(response['result_oob']), numpy.arange(2, 7))
+
+def test_lambda_handler_warm(monkeypatch):
+    monkeypatch.setattr(agent, '_COLD', True)
+    response = lambda_handler({'warm': True, 'hold': 0}, None)
+    assert response == {'warm': True, 'cold': True, 'container': agent.CONTAINER_ID}
+    assert lambda_handler({'warm': True}, None)['cold'] is False
+
+def test_lambda_handler_function_cache(monkeypatch):
+    monkeypatch.setattr(agent, '_FUNCTION_CACHE', collections.OrderedDict())
+    function_pickle = cloudpickle.dumps(increment)
+    payload = {'function_digest': 'digest', 'args': (1,), 'kwargs': {}}
+
+    response = lambda_handler(encode(payload), None)
+    assert response == {'need_function': True}
+
+    response = lambda_handler(encode(dict(payload, function_pickle=function_pickle)), None)
+    assert decode(response['result']) == 2
+
+    response = lambda_handler(encode(payload), None)
+    assert decode(response['result']) == 2
+
+def test_function_cache_eviction(monkeypatch):
+    monkeypatch.setattr(agent, '_FUNCTION_CACHE', collections.OrderedDict())
+    monkeypatch.setattr(agent, 'FUNCTION_CACHE_SIZE', 2)
+    function_pickle = cloudpickle.dumps(increment)
+    for digest in ['a', 'b', 'a', 'c']:
+        assert resolve_function({'function_digest': digest, 'function_pickle': function_pickle}) is increment
+    assert list(agent._FUNCTION_CACHE) == ['a', 'c']
+
+@pytest.mark.parametrize('reference', ['os.path:join', 'os.path.join', 'os:path.join'])
+def test_load_reference(reference):
+    assert load_reference(reference) is os.path.join
+
+def test_lambda_handler_function_ref():
+    response = lambda_handler(encode({'function_ref': 'tests.test_agent:increment', 'args': (1,), 'kwargs': {}}), None)
+    assert decode(response['result']) == 2
+
+def test_lambda_handler_missing_function_ref():
+    response = lambda_handler(encode({'function_ref': 'tests.test_agent:missing', 'args': (1,), 'kwargs': {}}), None)
+    assert 'Unable to load the function' in response['error']
@@ -0,0 +1,98 @@
+import json
+import asyncio
+
+import pytest
+
+aiohttp = pytest.importorskip('aiohttp')
+from aiohttp import web
+
+from lambdapool import AsyncLambdaPool
+from lambdapool.agent import lambda_handler
+from lambdapool.exceptions import LambdaPoolError
+
+def square(n):
+    return n*n
+
+def fail_on_three(n):
+    if n == 3:
+        raise ValueError('three')
+    return n
+
+class FakeLambdaService:
+    '''Serves the lambda Invoke API by running the agent in-process
+    '''
+    def __init__(self):
+        self.requests = []
+
+    async def invoke(self, request):
+        self.requests.append(request)
+        if not request.headers.get('Authorization', '').startswith('AWS4-HMAC-SHA256'):
+            return web.json_response({'message': 'Missing signature'}, status=403, headers={'x-amzn-ErrorType': 'AccessDeniedException'})
+        if request.match_info['name'] != 'test-function':
+            return web.json_response({'message': 'Function not found'}, status=404, headers={'x-amzn-ErrorType': 'ResourceNotFoundException'})
+
+        event = json.loads(await request.read())
+        return web.json_response(lambda_handler(event, None))
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_post('/2015-03-31/functions/{name}/invocations', self.invoke)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.endpoint_url = f'http://127.0.0.1:{port}'
+        return self
+
+    async def __aexit__(self, *args):
+        await self.runner.cleanup()
+
+def run_with_pool(coroutine, lambda_function='test-function'):
+    async def main():
+        async with FakeLambdaService() as service:
+            async with AsyncLambdaPool(
+                4, lambda_function,
+                aws_access_key_id='key', aws_secret_access_key='secret',
+                aws_region_name='us-west-2', endpoint_url=service.endpoint_url
+            ) as pool:
+                return await coroutine(pool), service
+    return asyncio.run(main())
+
+def test_apply():
+    async def apply(pool):
+        return await pool.apply(square, args=[3])
+    result, _ = run_with_pool(apply)
+    assert result == 9
+
+def test_submit():
+    async def submit(pool):
+        tasks = [pool.submit(square, n) for n in range(5)]
+        return await asyncio.gather(*tasks)
+    result, _ = run_with_pool(submit)
+    assert result == [0, 1, 4, 9, 16]
+
+def test_map_chunksize():
+    async def map(pool):
+        return await pool.map(square, range(10), chunksize=3)
+    result, service = run_with_pool(map)
+    assert result == [n*n for n in range(10)]
+    assert len(service.requests) == 4
+
+def test_imap_unordered():
+    async def imap_unordered(pool):
+        return [result async for result in pool.imap_unordered(square, range(10), window=3)]
+    result, _ = run_with_pool(imap_unordered)
+    assert sorted(result) == [n*n for n in range(10)]
+
+def test_function_error():
+    async def map(pool):
+        return await pool.map(fail_on_three, range(5))
+    with pytest.raises(LambdaPoolError, match='three'):
+        run_with_pool(map)
+
+def test_service_error():
+    async def apply(pool):
+        return await pool.apply(square, args=[3])
+    with pytest.raises(LambdaPoolError, match='ResourceNotFoundException'):
+        run_with_pool(apply, lambda_function='missing-function')
@@ -0,0 +1,201 @@
+import os
+import io
+import sys
+import base64
+import hashlib
+import zipfile
+
+import pytest
+
+from lambdapool.build import (
+    content_hash, archive_directory, code_sha256, archive_breakdown, bytecode_tag,
+    strip_debug_symbols, layer_name, is_dependency_layer, ArchiveBuilder, WheelCache, SLIM_EXCLUDES
+)
+
+@pytest.fixture
+def sources(tmp_path):
+    package = tmp_path / 'src' / 'algorithms'
+    package.mkdir(parents=True)
+    (package / '__init__.py').write_text('')
+    (package / 'algorithms.py').write_text('def square(n):\n    return n*n\n')
+    (tmp_path / 'requirements.txt').write_text('requests\n')
+    return package, tmp_path / 'requirements.txt'
+
+def test_content_hash_stable(sources):
+    package, requirements = sources
+    assert content_hash([package], requirements) == content_hash([package], requirements)
+
+def test_content_hash_changes_with_sources(sources):
+    package, requirements = sources
+    before = content_hash([package], requirements)
+    (package / 'algorithms.py').write_text('def square(n):\n    return n**2\n')
+    assert content_hash([package], requirements) != before
+
+def test_content_hash_changes_with_requirements(sources):
+    package, requirements = sources
+    before = content_hash([package], requirements)
+    requirements.write_text('requests==2.0\n')
+    assert content_hash([package], requirements) != before
+    assert content_hash([package], None) != before
+
+def test_content_hash_changes_with_options(sources):
+    package, requirements = sources
+    assert content_hash([package], requirements, {'slim': 'python3.6'}) != content_hash([package], requirements)
+
+def test_content_hash_ignores_bytecode(sources):
+    package, requirements = sources
+    before = content_hash([package], requirements)
+    (package / '__pycache__').mkdir()
+    (package / '__pycache__' / 'algorithms.cpython-38.pyc').write_bytes(b'\0')
+    assert content_hash([package], requirements) == before
+
+def test_archive_directory_deterministic(sources):
+    package, _ = sources
+    archive = archive_directory(package.parent)
+    os.utime(package / 'algorithms.py', (0, 0))
+    assert archive_directory(package.parent) == archive
+
+    with zipfile.ZipFile(io.BytesIO(archive)) as z:
+        assert z.namelist() == ['algorithms/__init__.py', 'algorithms/algorithms.py']
+        assert z.read('algorithms/algorithms.py').startswith(b'def square')
+
+def test_code_sha256():
+    assert code_sha256(b'zip') == base64.b64encode(hashlib.sha256(b'zip').digest()).decode('ascii')
+
+@pytest.fixture
+def installed(tmp_path):
+    (tmp_path / 'requests' / 'tests').mkdir(parents=True)
+    (tmp_path / 'requests' / '__init__.py').write_text('VERSION = 1\n')
+    (tmp_path / 'requests' / 'tests' / 'test_requests.py').write_text('')
+    (tmp_path / 'requests-2.0.dist-info').mkdir()
+    (tmp_path / 'requests-2.0.dist-info' / 'METADATA').write_text('Name: requests\n')
+    (tmp_path / 'requests-2.0.dist-info' / 'RECORD').write_text('')
+    (tmp_path / 'lambdapool_agent.py').write_text('')
+    return tmp_path
+
+def names(archive):
+    with zipfile.ZipFile(io.BytesIO(archive)) as z:
+        return z.namelist()
+
+def test_archive_directory_slim_excludes(installed):
+    (installed / 'requests' / 'docs').mkdir()
+    (installed / 'requests' / 'docs' / 'index.html').write_text('')
+    (installed / 'requests' / 'doc').mkdir()
+    (installed / 'requests' / 'doc' / 'api.txt').write_text('')
+    (installed / 'requests' / 'README.md').write_text('')
+    (installed / 'requests' / 'HISTORY.rst').write_text('')
+    (installed / 'docs').mkdir()
+    (installed / 'docs' / 'conf.py').write_text('')
+    assert names(archive_directory(installed, SLIM_EXCLUDES)) == [
+        'lambdapool_agent.py',
+        'requests-2.0.dist-info/METADATA',
+        'requests/__init__.py',
+    ]
+
+def test_archive_builder_valid_zip(installed):
+    (installed / 'requests' / 'data.bin').write_bytes(os.urandom(1000))
+    (installed / 'requests' / 'big.txt').write_text('lambdapool ' * 10000)
+    archive = archive_directory(installed)
+
+    with zipfile.ZipFile(io.BytesIO(archive)) as z:
+        assert z.testzip() is None
+        assert z.read('requests/big.txt') == b'lambdapool ' * 10000
+        assert z.getinfo('requests/big.txt').compress_type == zipfile.ZIP_DEFLATED
+        assert z.getinfo('requests/data.bin').compress_type == zipfile.ZIP_STORED
+
+def test_archive_builder_parallel_deterministic(installed):
+    builders = [ArchiveBuilder(workers=workers) for workers in (1, 4)]
+    for builder in builders:
+        builder.add_directory(installed)
+    assert builders[0].build() == builders[1].build()
+
+def test_archive_builder_add_path(sources):
+    package, _ = sources
+    builder = ArchiveBuilder(['*/algorithms.py'])
+    builder.add_path(package)
+    builder.add_path(package / 'algorithms.py', prefix='lib/')
+    builder.add_bytes('VERSION', b'1')
+    assert names(builder.build()) == ['VERSION', 'algorithms/__init__.py', 'lib/algorithms.py']
+
+def test_archive_builder_many_members():
+    builder = ArchiveBuilder()
+    for i in range(0x10001):
+        builder.add_bytes(f'{i}.txt', b'')
+    with zipfile.ZipFile(io.BytesIO(builder.build())) as z:
+        assert len(z.namelist()) == 0x10001
+
+def test_archive_builder_bytecode(installed):
+    (installed / 'requests' / 'legacy.py').write_text('print "python 2"\n')
+    runtime = f'python{sys.version_info[0]}.{sys.version_info[1]}'
+    tag = bytecode_tag(runtime)
+
+    builder = ArchiveBuilder(SLIM_EXCLUDES)
+    builder.add_directory(installed, prefix='python/')
+    builder.add_bytecode(sys.executable, '/opt', runtime)
+
+    with zipfile.ZipFile(io.BytesIO(builder.build())) as z:
+        members = z.namelist()
+        bytecode = z.read(f'python/requests/__pycache__/__init__.{tag}.pyc')
+    assert f'python/__pycache__/lambdapool_agent.{tag}.pyc' in members
+    assert not any('legacy' in name and name.endswith('.pyc') for name in members)
+    assert b'/opt/python/requests/__init__.py' in bytecode
+    assert not (installed / 'requests' / '__pycache__').exists()
+
+def test_bytecode_tag():
+    assert bytecode_tag('python3.6') == 'cpython-36'
+    assert bytecode_tag('python3.10') == 'cpython-310'
+
+def test_archive_breakdown(installed):
+    rows = archive_breakdown(archive_directory(installed))
+    assert sorted(row[0] for row in rows) == ['lambdapool_agent.py', 'requests', 'requests-2.0.dist-info']
+    assert dict((row[0], row[1]) for row in rows)['requests'] == 2
+
+def test_strip_debug_symbols_without_libraries(installed):
+    assert strip_debug_symbols(installed) in (0, None)
+
+def test_layer_name(sources):
+    _, requirements = sources
+    name = layer_name(requirements)
+    assert name.startswith('lambdapool-deps-')
+    assert layer_name(requirements) == name
+    assert layer_name(requirements, {'slim': 'python3.6'}) != name
+    assert layer_name(None) != name
+    requirements.write_text('requests==2.0\n')
+    assert layer_name(requirements) != name
+
+def test_is_dependency_layer(sources):
+    _, requirements = sources
+    arn = f'arn:aws:lambda:us-west-2:123456789012:layer:{layer_name(requirements)}:1'
+    assert is_dependency_layer(arn)
+    assert not is_dependency_layer('arn:aws:lambda:us-west-2:123456789012:layer:numpy:1')
+
+def test_archive_directory_prefix(installed):
+    assert names(archive_directory(installed / 'requests', prefix='python/requests/')) == [
+        'python/requests/__init__.py',
+        'python/requests/tests/test_requests.py',
+    ]
+
+def test_wheel_cache_platform_options(tmp_path):
+    options = WheelCache(tmp_path).platform_options()
+    assert options[options.index('--abi') + 1] == 'cp36m'
+    assert options[options.index('--platform') + 1] == 'manylinux2014_x86_64'
+    assert '--only-binary=:all:' in options
+    options = WheelCache(tmp_path, runtime='python3.8').platform_options()
+    assert options[options.index('--abi') + 1] == 'cp38'
+
+def test_wheel_cache_install_from_cache(tmp_path):
+    cache = WheelCache(tmp_path / 'cache')
+    assert cache.directory == tmp_path / 'cache' / 'wheels' / 'python3.6-manylinux2014_x86_64'
+
+    cache.directory.mkdir(parents=True)
+    with zipfile.ZipFile(cache.directory / 'tinypkg-1.0-py3-none-any.whl', 'w') as wheel:
+        wheel.writestr('tinypkg/__init__.py', 'VERSION = 1\n')
+        wheel.writestr('tinypkg-1.0.dist-info/METADATA', 'Metadata-Version: 2.1\nName: tinypkg\nVersion: 1.0\n')
+        wheel.writestr('tinypkg-1.0.dist-info/WHEEL', 'Wheel-Version: 1.0\nGenerator: test\nRoot-Is-Purelib: true\nTag: py3-none-any\n')
+        wheel.writestr('tinypkg-1.0.dist-info/RECORD', '')
+    (tmp_path / 'requirements.txt').write_text('tinypkg==1.0\n')
+
+    target = tmp_path / 'target'
+    assert cache.install(target, ['-r', str(tmp_path / 'requirements.txt')])
+    assert (target / 'tinypkg' / '__init__.py').read_text() == 'VERSION = 1\n'
+    assert not list(target.rglob('*.pyc'))
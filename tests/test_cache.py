@@ -0,0 +1,58 @@
+import time
+
+import pytest
+
+from lambdapool.cache import MemoryCache, DiskCache, cache_key
+
+@pytest.fixture(params=['memory', 'disk'])
+def make_cache(request, tmp_path):
+    def make_cache(**kwargs):
+        if request.param == 'memory':
+            return MemoryCache(**kwargs)
+        return DiskCache(str(tmp_path), **kwargs)
+    return make_cache
+
+def test_cache_key():
+    assert cache_key(b'f', (1,), {}) == cache_key(b'f', (1,), {})
+    assert cache_key(b'f', (1,), {}) != cache_key(b'f', (2,), {})
+    assert cache_key(b'f', (1,), {}) != cache_key(b'g', (1,), {})
+
+def test_get_set(make_cache):
+    cache = make_cache()
+    assert cache.get('a') is None
+    cache.set('a', b'value')
+    assert cache.get('a') == b'value'
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cache.hit_rate == 0.5
+
+def test_size_eviction(make_cache):
+    cache = make_cache(max_size=10)
+    cache.set('a', b'12345')
+    cache.set('b', b'12345')
+    assert cache.get('a') == b'12345'
+    cache.set('c', b'12345')
+
+    assert cache.get('b') is None
+    assert cache.get('a') == b'12345'
+    assert cache.get('c') == b'12345'
+    assert cache.evictions == 1
+    assert len(cache) == 2
+
+def test_value_larger_than_cache(make_cache):
+    cache = make_cache(max_size=4)
+    cache.set('a', b'12345')
+    assert cache.get('a') is None
+
+def test_ttl(make_cache):
+    cache = make_cache(ttl=0.05)
+    cache.set('a', b'value')
+    assert cache.get('a') == b'value'
+    time.sleep(0.1)
+    assert cache.get('a') is None
+
+def test_disk_cache_persists(tmp_path):
+    DiskCache(str(tmp_path)).set('a', b'value')
+    cache = DiskCache(str(tmp_path))
+    assert len(cache) == 1
+    assert cache.size == 5
+    assert cache.get('a') == b'value'
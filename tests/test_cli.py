@@ -3,7 +3,7 @@ from click.testing import CliRunner
 
 from lambdapool.cli import cli
 
-from .fixtures import TestFunctionBase
+from .fixtures import TestFunctionBase, FakeLambdaBase
 
 @pytest.mark.aws
 class TestCli(TestFunctionBase):
@@ -102,3 +102,16 @@ class TestCli(TestFunctionBase):
         result = self.runner.invoke(cli, ['delete', 'test-function'])
         assert result.exit_code != 0
         assert 'test-function does not exist' in result.output
+
+class TestCliWarm(FakeLambdaBase):
+    def test_warm(self):
+        result = CliRunner().invoke(cli, ['warm', 'test-function', '--concurrency', '3', '--hold', '0'])
+        assert result.exit_code == 0
+        assert '1 containers reached' in result.output
+        assert self.lambda_client.invocations == 3
+
+    def test_warm_throttled(self):
+        self.lambda_client.throttles = 1
+        result = CliRunner().invoke(cli, ['warm', 'test-function', '--concurrency', '3', '--hold', '0'])
+        assert result.exit_code != 0
+        assert '1 invocations throttled' in result.output
@@ -0,0 +1,141 @@
+import threading
+
+import pytest
+from botocore.exceptions import ClientError, EndpointConnectionError
+
+from lambdapool import LambdaPool
+from lambdapool.concurrency import ConcurrencyController, is_throttle
+from lambdapool.mock import MockLambdaServer
+
+def throttle_error():
+    return ClientError({'Error': {'Code': 'TooManyRequestsException', 'Message': 'Rate exceeded'}}, 'Invoke')
+
+class Throttled:
+    def __init__(self, throttles):
+        self.throttles = throttles
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.calls <= self.throttles:
+            raise throttle_error()
+        return 'ok'
+
+@pytest.fixture
+def controller(monkeypatch):
+    controller = ConcurrencyController(max_limit=8, max_retries=3)
+    monkeypatch.setattr(controller, 'backoff', lambda attempt: 0)
+    return controller
+
+def test_is_throttle():
+    assert is_throttle(throttle_error())
+    assert not is_throttle(ClientError({'Error': {'Code': 'ResourceNotFoundException'}}, 'Invoke'))
+    assert not is_throttle(ValueError())
+
+def test_run_retries_throttles(controller):
+    function = Throttled(2)
+    assert controller.run(function) == 'ok'
+    assert function.calls == 3
+    assert controller.throttles == 2
+    assert controller.retries == 2
+
+def test_run_gives_up(controller):
+    with pytest.raises(ClientError):
+        controller.run(Throttled(10))
+    assert controller.throttles == 4
+
+def test_run_other_errors(controller):
+    def fail():
+        raise ClientError({'Error': {'Code': 'ResourceNotFoundException'}}, 'Invoke')
+    with pytest.raises(ClientError):
+        controller.run(fail)
+    assert controller.throttles == 0
+
+def test_aimd(controller):
+    controller.active = 8
+    controller.on_throttle()
+    assert controller.limit == 4
+    controller.active = 4
+
+    for _ in range(4):
+        controller.on_success()
+    assert 4.5 < controller.limit < 5
+
+    for _ in range(100):
+        controller.active = int(controller.limit)
+        controller.on_success()
+    assert controller.limit == 8
+
+def test_aimd_unused_limit(controller):
+    controller.active = 8
+    controller.on_throttle()
+    controller.active = 1
+    for _ in range(100):
+        controller.on_success()
+    assert controller.limit == 4
+
+def test_throttle_window():
+    controller = ConcurrencyController(max_limit=8)
+    for number in range(1, 9):
+        with controller.slot():
+            pass
+    controller.active = 8
+    # The invocations in flight at a decrease do not decrease the limit again
+    controller.on_throttle(7)
+    controller.on_throttle(8)
+    assert controller.limit == 4
+    assert controller.throttles == 2
+
+    with controller.slot() as number:
+        assert number == 9
+    controller.on_throttle(number)
+    assert controller.limit == 2
+
+def test_limit_settles_on_mock_service():
+    concurrency = 5
+    with MockLambdaServer(concurrency=concurrency, latency=0.01) as server:
+        options = dict(
+            aws_access_key_id='mock', aws_secret_access_key='mock',
+            aws_region_name='us-east-1', endpoint_url=server.endpoint_url
+        )
+        with LambdaPool(40, 'echo', **options) as pool:
+            assert pool.map(abs, range(400)) == list(range(400))
+            limit = pool.concurrency
+
+    assert server.service.peak_concurrency <= concurrency
+    assert concurrency / 2 <= limit <= concurrency * 2
+    # The first burst over the limit is throttled, then about one invocation per window
+    assert server.service.throttles < 150
+
+def test_slot_limits_concurrency():
+    controller = ConcurrencyController(max_limit=2)
+    barrier = threading.Barrier(2)
+
+    def work():
+        with controller.slot():
+            barrier.wait(timeout=5)
+
+    threads = [threading.Thread(target=work) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert controller.peak == 2
+
+def test_unlimited_slot():
+    controller = ConcurrencyController()
+    with controller.slot():
+        assert controller.active == 1
+
+def test_run_retries_connection_errors(controller):
+    calls = []
+    def flaky():
+        calls.append(1)
+        if len(calls) == 1:
+            raise EndpointConnectionError(endpoint_url='http://localhost')
+        return 'ok'
+
+    assert controller.run(flaky) == 'ok'
+    assert controller.throttles == 0
+    assert controller.retries == 1
+    assert controller.limit == 8
@@ -0,0 +1,79 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+import pytest
+
+from lambdapool.hedging import HedgePolicy, hedged_map
+from lambdapool.stats import HedgeStats
+
+class Straggler:
+    '''Sleeps `delay` seconds on the first call for `item`, returns immediately otherwise
+    '''
+    def __init__(self, item, delay):
+        self.item = item
+        self.delay = delay
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, n):
+        with self.lock:
+            first = n == self.item and n not in self.calls
+            self.calls.append(n)
+        if first:
+            time.sleep(self.delay)
+        return n*n
+
+def test_hedged_map_hedges_stragglers():
+    function = Straggler(3, delay=1)
+    stats = HedgeStats()
+    policy = HedgePolicy(percentile=50, min_delay=0.05, interval=0.01)
+
+    with ThreadPoolExecutor(4) as executor:
+        start = time.monotonic()
+        results = list(hedged_map(executor, function, range(10), policy, stats))
+        elapsed = time.monotonic() - start
+
+    assert results == [n*n for n in range(10)]
+    assert elapsed < 0.9
+    assert function.calls.count(3) == 2
+    assert stats.hedges == 1
+    assert stats.wins == 1
+    assert stats.time_saved > 0.5
+
+def test_hedged_map_without_stragglers():
+    stats = HedgeStats()
+    with ThreadPoolExecutor(4) as executor:
+        results = list(hedged_map(executor, abs, range(-5, 5), HedgePolicy(min_delay=1), stats))
+    assert results == [abs(n) for n in range(-5, 5)]
+    assert stats.hedges == 0
+
+def test_hedged_map_max_hedges():
+    function = Straggler(3, delay=0.3)
+    stats = HedgeStats()
+    policy = HedgePolicy(percentile=50, min_delay=0.05, interval=0.01, max_hedges=0)
+    with ThreadPoolExecutor(4) as executor:
+        assert list(hedged_map(executor, function, range(10), policy, stats)) == [n*n for n in range(10)]
+    assert stats.hedges == 0
+
+def test_hedged_map_error():
+    with ThreadPoolExecutor(2) as executor:
+        with pytest.raises(ZeroDivisionError):
+            list(hedged_map(executor, lambda n: 1 / n, range(3), HedgePolicy()))
+
+def test_hedged_map_timeout():
+    function = Straggler(3, delay=0.5)
+    policy = HedgePolicy(max_hedges=0, interval=0.01)
+    with ThreadPoolExecutor(4) as executor:
+        with pytest.raises(TimeoutError):
+            list(hedged_map(executor, function, range(5), policy, timeout=0.1))
+
+def test_hedge_policy_threshold():
+    assert HedgePolicy(multiplier=2, min_delay=0).get_threshold([1, 2, 3]) == 4
+    assert HedgePolicy(threshold=10).get_threshold([1, 2, 3]) == 10
+    assert HedgePolicy(threshold=0.1).get_threshold([1, 2, 3]) == 0.1
+    assert HedgePolicy(min_delay=5).get_threshold([1]) == 5
+
+def test_hedge_policy_invalid_percentile():
+    with pytest.raises(ValueError):
+        HedgePolicy(percentile=0)
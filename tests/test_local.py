@@ -0,0 +1,50 @@
+import json
+
+import pytest
+
+from lambdapool.local import LocalBackend, HybridPolicy, invocation_count, handle_event
+
+def square(n):
+    return n*n
+
+def test_handle_event():
+    data, duration = handle_event(json.dumps({'warm': True, 'hold': 0}))
+    assert json.loads(data)['warm']
+    assert duration >= 0
+
+def test_local_backend_invoke():
+    backend = LocalBackend(1)
+    try:
+        data, report = backend.invoke(json.dumps({'warm': True, 'hold': 0}))
+    finally:
+        backend.shutdown()
+    response = json.loads(data)
+    assert response['warm']
+    assert 'duration' in report
+    assert backend.pending == 0
+
+def test_hybrid_policy_without_estimates():
+    policy = HybridPolicy(local_workers=4, lambda_workers=100)
+    assert policy.choose(4) == 'local'
+    assert policy.choose(5) == 'lambda'
+    assert policy.choose(2, pending=3) == 'lambda'
+    assert policy.choose(None) == 'lambda'
+
+def test_hybrid_policy_estimates():
+    policy = HybridPolicy(local_workers=4, lambda_workers=100, overhead=50)
+    # Short calls are cheaper locally, however many there are
+    policy.record(1.0)
+    assert policy.choose(10000) == 'local'
+
+    for _ in range(50):
+        policy.record(1000.0, client_time=1020.0)
+    assert policy.duration == pytest.approx(1000.0, rel=0.01)
+    assert policy.overhead == pytest.approx(20.0, rel=0.01)
+    assert policy.choose(4) == 'local'
+    assert policy.choose(8) == 'lambda'
+
+def test_invocation_count():
+    assert invocation_count([range(10)]) == 10
+    assert invocation_count([range(10)], chunksize=3) == 4
+    assert invocation_count([range(10), [1, 2]]) == 2
+    assert invocation_count([iter(range(10))]) is None
@@ -0,0 +1,92 @@
+import json
+import time
+import base64
+
+from lambdapool import LambdaPool, LambdaExecutor, agent
+from lambdapool.mock import MockLambdaServer, MockLambdaService, MAX_PAYLOAD_SIZE
+
+def square(n):
+    return n*n
+
+def nap(n):
+    time.sleep(0.05)
+    return n
+
+def warm_event():
+    return json.dumps({'warm': True, 'hold': 0}).encode('ascii')
+
+def pool_options(server):
+    return dict(
+        aws_access_key_id='key', aws_secret_access_key='secret',
+        aws_region_name='us-west-2', endpoint_url=server.endpoint_url
+    )
+
+def test_pool_map():
+    with MockLambdaServer() as server:
+        with LambdaPool(4, 'test-function', **pool_options(server)) as pool:
+            assert pool.map(square, range(10)) == [n*n for n in range(10)]
+            assert pool.stats.invocations == 10
+            assert pool.stats.cold_starts == server.service.cold_starts
+    assert server.service.invocations == 10
+    assert 1 <= server.service.cold_starts <= 4
+
+def test_executor_map():
+    with MockLambdaServer() as server:
+        with LambdaExecutor('test-function', max_workers=4, **pool_options(server)) as executor:
+            assert list(executor.map(square, range(10), chunksize=3)) == [n*n for n in range(10)]
+    assert server.service.invocations == 4
+
+def test_containers_are_reused():
+    service = MockLambdaService()
+    responses = [json.loads(service.invoke('test-function', warm_event())[2]) for _ in range(3)]
+    assert [response['cold'] for response in responses] == [True, False, False]
+    assert len({response['container'] for response in responses}) == 1
+    assert service.cold_starts == 1
+
+    response = json.loads(service.invoke('other-function', warm_event())[2])
+    assert response['cold'] and response['container'] != responses[0]['container']
+
+def test_idle_containers_expire():
+    service = MockLambdaService(idle_timeout=0)
+    service.invoke('test-function', warm_event())
+    time.sleep(0.01)
+    service.invoke('test-function', warm_event())
+    assert service.cold_starts == 2
+
+def test_cold_start_report():
+    service = MockLambdaService(cold_start=0.02)
+    status, headers, _ = service.invoke('test-function', warm_event(), 'Tail')
+    assert status == 200
+    log = base64.b64decode(headers['X-Amz-Log-Result']).decode('utf-8')
+    assert 'Init Duration: ' in log
+
+    _, headers, _ = service.invoke('test-function', warm_event(), 'Tail')
+    assert 'Init Duration' not in base64.b64decode(headers['X-Amz-Log-Result']).decode('utf-8')
+    _, headers, _ = service.invoke('test-function', warm_event())
+    assert 'X-Amz-Log-Result' not in headers
+
+def test_throttle_rate():
+    service = MockLambdaService(throttle_rate=1.0)
+    status, headers, body = service.invoke('test-function', warm_event())
+    assert status == 429
+    assert headers['x-amzn-ErrorType'] == 'TooManyRequestsException'
+    assert service.throttles == 1 and service.invocations == 0
+
+def test_payload_too_large():
+    status, headers, _ = MockLambdaService().invoke('test-function', b'"' + b'x' * MAX_PAYLOAD_SIZE + b'"')
+    assert status == 413
+    assert headers['x-amzn-ErrorType'] == 'RequestEntityTooLargeException'
+
+def test_concurrency_limit_throttles_pool():
+    with MockLambdaServer(concurrency=2) as server:
+        with LambdaPool(8, 'test-function', throttle_retries=50, **pool_options(server)) as pool:
+            assert pool.map(nap, range(16)) == list(range(16))
+    assert server.service.peak_concurrency <= 2
+    assert server.service.throttles > 0
+
+def test_agent_is_loaded_per_container():
+    service = MockLambdaService()
+    service.invoke('test-function', warm_event())
+    container = service._idle['test-function'][0]
+    assert container.agent is not agent
+    assert container.agent.VERSION == agent.VERSION
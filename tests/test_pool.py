@@ -1,9 +1,17 @@
+import os
+import json
+import time
+import itertools
+import collections
+from concurrent.futures import TimeoutError
+
 import pytest
 
-from lambdapool import LambdaPool
+from lambdapool import LambdaPool, LambdaExecutor, LocalBlobStore, MemoryBlobStore, HedgePolicy, MemoryCache, DiskCache, agent
+from lambdapool.agent import loads
 from lambdapool.exceptions import LambdaPoolError
 
-from .fixtures import TestFunctionBase
+from .fixtures import TestFunctionBase, FakeLambdaBase
 
 @pytest.mark.skip(reason='The tests are errroing out due to some AWS quirks. Needs to be revisited')
 @pytest.mark.aws
@@ -61,3 +69,452 @@ class TestPool(TestFunctionBase):
             while not result.ready():
                 result.get()
 
+
+def square(n):
+    return n*n
+
+def fail_on_three(n):
+    if n == 3:
+        raise ValueError('three')
+    return n
+
+class TestPoolChunksize(FakeLambdaBase):
+    def test_map_chunksize(self):
+        pool = LambdaPool(2, "test-function")
+        assert pool.map(square, range(10), chunksize=4) == [n*n for n in range(10)]
+        assert self.lambda_client.invocations == 3
+
+    def test_map_chunksize_error(self):
+        pool = LambdaPool(2, "test-function")
+        with pytest.raises(LambdaPoolError):
+            pool.map(fail_on_three, range(10), chunksize=4)
+
+    def test_map_invalid_chunksize(self):
+        pool = LambdaPool(2, "test-function")
+        with pytest.raises(ValueError):
+            pool.map(square, range(10), chunksize=0)
+
+    def test_executor_map_chunksize(self):
+        with LambdaExecutor("test-function", max_workers=2) as executor:
+            result = executor.map(square, range(10), chunksize=3)
+            assert list(result) == [n*n for n in range(10)]
+        assert self.lambda_client.invocations == 4
+
+def nap(seconds):
+    time.sleep(seconds)
+    return seconds
+
+class TestExecutorSemantics(FakeLambdaBase):
+    def test_map_timeout(self):
+        with LambdaExecutor("test-function", max_workers=2) as executor:
+            results = executor.map(nap, [0.5, 0.5], timeout=0.1)
+            with pytest.raises(TimeoutError):
+                list(results)
+
+    def test_shutdown_cancel_futures(self):
+        executor = LambdaExecutor("test-function", max_workers=1)
+        futures = [executor.submit(nap, 0.2) for _ in range(5)]
+        executor.shutdown(wait=True, cancel_futures=True)
+        assert futures[0].result() == 0.2
+        assert all(future.cancelled() for future in futures[1:])
+        assert self.lambda_client.invocations == 1
+
+    def test_map_fail_fast(self):
+        with LambdaExecutor("test-function", max_workers=1) as executor:
+            results = executor.map(fail_on_three, range(10), window=10, fail_fast=True)
+            assert list(itertools.islice(results, 3)) == [0, 1, 2]
+            with pytest.raises(LambdaPoolError):
+                next(results)
+        assert self.lambda_client.invocations == 4
+
+    def test_map_fail_fast_chunksize(self):
+        with LambdaExecutor("test-function", max_workers=1) as executor:
+            results = executor.map(fail_on_three, range(10), chunksize=2, window=5, fail_fast=True)
+            with pytest.raises(LambdaPoolError):
+                list(results)
+        assert self.lambda_client.invocations == 2
+
+class TestPoolStreaming(FakeLambdaBase):
+    def test_imap(self):
+        pool = LambdaPool(2, "test-function")
+        assert list(pool.imap(square, range(10))) == [n*n for n in range(10)]
+
+    def test_imap_chunksize(self):
+        pool = LambdaPool(2, "test-function")
+        assert list(pool.imap(square, range(10), chunksize=3)) == [n*n for n in range(10)]
+        assert self.lambda_client.invocations == 4
+
+    def test_imap_unordered(self):
+        pool = LambdaPool(2, "test-function")
+        assert sorted(pool.imap_unordered(square, range(10), chunksize=3)) == [n*n for n in range(10)]
+
+    def test_imap_consumes_lazily(self):
+        pool = LambdaPool(2, "test-function")
+        results = pool.imap(square, itertools.count(), window=3)
+        assert next(results) == 0
+        assert next(results) == 1
+        results.close()
+        assert self.lambda_client.invocations <= 5
+
+    def test_imap_error(self):
+        pool = LambdaPool(2, "test-function")
+        with pytest.raises(LambdaPoolError):
+            list(pool.imap(fail_on_three, range(10)))
+
+    def test_executor_map_generator(self):
+        with LambdaExecutor("test-function", max_workers=2) as executor:
+            results = executor.map(square, itertools.count(), window=4)
+            assert list(itertools.islice(results, 5)) == [0, 1, 4, 9, 16]
+        assert self.lambda_client.invocations <= 9
+
+def add(a, b):
+    return a + b
+
+class TestPoolLifecycle(FakeLambdaBase):
+    def test_apply_async_runs_in_background(self):
+        pool = LambdaPool(2, "test-function")
+        result = pool.apply_async(square, args=[4])
+        assert result.get(timeout=5) == 16
+        pool.close()
+        pool.join()
+
+    def test_apply_async_callbacks(self):
+        results, errors = [], []
+        with LambdaPool(2, "test-function") as pool:
+            pool.apply_async(square, [3], callback=results.append).wait(5)
+            pool.apply_async(fail_on_three, [3], error_callback=errors.append).wait(5)
+        assert results == [9]
+        assert isinstance(errors[0], LambdaPoolError)
+
+    def test_map_async(self):
+        with LambdaPool(2, "test-function") as pool:
+            assert pool.map_async(square, range(10)).get(5) == [n*n for n in range(10)]
+            result = pool.map_async(square, range(10), chunksize=3)
+            assert result.get(5) == [n*n for n in range(10)]
+            assert result.successful()
+
+    def test_map_async_callback(self):
+        results = []
+        with LambdaPool(2, "test-function") as pool:
+            pool.map_async(square, range(5), chunksize=2, callback=results.append).wait(5)
+        assert results == [[0, 1, 4, 9, 16]]
+
+    def test_starmap(self):
+        with LambdaPool(2, "test-function") as pool:
+            pairs = [(n, n) for n in range(5)]
+            assert pool.starmap(add, pairs) == [0, 2, 4, 6, 8]
+            assert pool.starmap(add, pairs, chunksize=2) == [0, 2, 4, 6, 8]
+            assert pool.starmap_async(add, pairs).get(5) == [0, 2, 4, 6, 8]
+
+    def test_reuses_worker_threads(self):
+        with LambdaPool(2, "test-function") as pool:
+            threads = pool._pool._pool
+            pool.map(square, range(4))
+            list(pool.imap(square, range(4)))
+            assert pool._pool._pool == threads
+
+    def test_closed_pool(self):
+        pool = LambdaPool(2, "test-function")
+        pool.close()
+        pool.join()
+        with pytest.raises(ValueError):
+            pool.map(square, range(4))
+        with pytest.raises(ValueError):
+            pool.apply_async(square, [1])
+        with pytest.raises(ValueError):
+            list(pool.imap(square, range(4)))
+
+class TestPoolCodec(FakeLambdaBase):
+    def test_map_compressed(self):
+        pool = LambdaPool(2, "test-function", codec='zlib', compress_threshold=0)
+        assert pool.map(list, [range(1000)] * 4) == [list(range(1000))] * 4
+
+        stats = pool.codec_stats
+        assert stats.calls == 4
+        assert stats.request_ratio > 1
+        assert stats.response_ratio > 1
+
+    def test_unsupported_codec(self):
+        with pytest.raises(LambdaPoolError):
+            LambdaPool(2, "test-function", codec='rot13')
+
+class TestPoolBlobStore(FakeLambdaBase):
+    def test_map_offloads_large_payloads(self, tmp_path):
+        store = LocalBlobStore(str(tmp_path))
+        pool = LambdaPool(2, "test-function", blob_store=store, offload_threshold=1024)
+        assert pool.map(sum, [list(range(1000)), list(range(10))]) == [499500, 45]
+
+        payloads = [json.loads(payload) for payload in self.lambda_client.payloads]
+        assert sorted('payload_ref' in payload for payload in payloads) == [False, True]
+        assert list(tmp_path.iterdir()) == []
+
+    def test_apply_offloads_large_results(self):
+        store = MemoryBlobStore()
+        pool = LambdaPool(2, "test-function", blob_store=store, offload_threshold=1024)
+        assert pool.apply(bytes, args=(4096,)) == bytes(4096)
+        assert store.blobs == {}
+
+class CountPickles:
+    pickles = 0
+
+    def __call__(self, n):
+        return n
+
+    def __getstate__(self):
+        CountPickles.pickles += 1
+        return {}
+
+class TestPoolFunctionPickle(FakeLambdaBase):
+    def test_function_pickled_once_per_map(self):
+        CountPickles.pickles = 0
+        pool = LambdaPool(2, "test-function")
+        assert pool.map(CountPickles(), range(5)) == list(range(5))
+        assert CountPickles.pickles == 1
+
+class TestPoolFunctionCache(FakeLambdaBase):
+    def sent_function_pickles(self):
+        events = [json.loads(payload) for payload in self.lambda_client.payloads]
+        return ['function_pickle' in loads(event['payload'], event['codec']) for event in events]
+
+    def test_function_sent_once(self):
+        pool = LambdaPool(1, "test-function")
+        assert pool.map(square, range(3)) == [0, 1, 4]
+        assert self.sent_function_pickles() == [True, False, False]
+
+    def test_function_resent_to_cold_container(self, monkeypatch):
+        pool = LambdaPool(1, "test-function")
+        assert pool.apply(square, args=(2,)) == 4
+
+        monkeypatch.setattr(agent, '_FUNCTION_CACHE', collections.OrderedDict())
+        assert pool.apply(square, args=(3,)) == 9
+        assert self.sent_function_pickles() == [True, False, True]
+
+class TestPoolFunctionReference(FakeLambdaBase):
+    def test_map_function_reference(self):
+        pool = LambdaPool(2, "test-function")
+        assert pool.map("tests.test_pool:square", range(3), chunksize=2) == [0, 1, 4]
+
+        events = [json.loads(payload) for payload in self.lambda_client.payloads]
+        payloads = [loads(event['payload'], event['codec']) for event in events]
+        assert all('function_pickle' not in payload for payload in payloads)
+
+class TestPoolThrottling(FakeLambdaBase):
+    def test_map_retries_throttled_invocations(self):
+        pool = LambdaPool(4, "test-function")
+        pool.context.concurrency.base_delay = 0
+        self.lambda_client.throttles = 3
+
+        assert pool.map(square, range(8)) == [n*n for n in range(8)]
+        assert pool.context.concurrency.throttles == 3
+        assert 1 <= pool.concurrency <= 4
+        assert 1 <= pool.peak_concurrency <= 4
+
+class TestPoolHedging(FakeLambdaBase):
+    def test_map_hedge(self):
+        pool = LambdaPool(2, "test-function")
+        assert pool.map(square, range(10), chunksize=3, hedge=HedgePolicy()) == [n*n for n in range(10)]
+        assert pool.hedge_stats.hedges == 0
+
+    def test_executor_map_hedge(self):
+        with LambdaExecutor("test-function", max_workers=2) as executor:
+            assert list(executor.map(square, range(10), hedge=HedgePolicy())) == [n*n for n in range(10)]
+
+class TestPoolStats(FakeLambdaBase):
+    def test_map_stats(self):
+        pool = LambdaPool(2, "test-function")
+        pool.map(square, range(4))
+
+        stats = pool.stats
+        assert stats.invocations == 4
+        assert stats.cold_starts == 1
+        assert stats.max_memory_used == 50
+        assert stats.billed_gb_seconds > 0
+
+class TestPoolWarm(FakeLambdaBase):
+    def test_warm(self, monkeypatch):
+        monkeypatch.setattr(agent, '_COLD', True)
+        with LambdaPool(4, "test-function") as pool:
+            result = pool.warm(hold=0.01)
+        assert result == {'invocations': 4, 'cold': 1, 'warm': 3, 'containers': 1, 'throttled': 0, 'errors': 0}
+        assert all(json.loads(payload)['warm'] for payload in self.lambda_client.payloads)
+        assert pool.stats.invocations == 4
+
+    def test_warm_throttled(self):
+        self.lambda_client.throttles = 2
+        with LambdaPool(2, "test-function") as pool:
+            result = pool.warm(5, hold=0)
+        assert result['throttled'] == 2
+        assert result['cold'] + result['warm'] == 3
+
+class TestPoolCache(FakeLambdaBase):
+    def test_map_cache(self):
+        pool = LambdaPool(2, "test-function", cache=MemoryCache())
+        assert pool.map(square, range(4)) == [0, 1, 4, 9]
+        assert pool.map(square, range(6)) == [0, 1, 4, 9, 16, 25]
+        assert self.lambda_client.invocations == 6
+        assert (pool.cache.hits, pool.cache.misses) == (4, 6)
+
+    def test_map_chunksize_cache(self, tmp_path):
+        pool = LambdaPool(2, "test-function", cache=DiskCache(str(tmp_path)))
+        assert pool.map(square, range(4), chunksize=2) == [0, 1, 4, 9]
+        assert pool.map(square, range(6), chunksize=3) == [0, 1, 4, 9, 16, 25]
+        assert self.lambda_client.invocations == 3
+
+    def test_executor_cache(self):
+        with LambdaExecutor("test-function", max_workers=2, cache=MemoryCache()) as executor:
+            assert executor.submit(square, 3).result() == 9
+            assert executor.submit(square, 3).result() == 9
+        assert self.lambda_client.invocations == 1
+
+class TestPoolLocalBackend(FakeLambdaBase):
+    def test_map_local(self):
+        with LambdaPool(2, "test-function", backend='local', local_workers=2) as pool:
+            assert pool.map(square, range(6)) == [0, 1, 4, 9, 16, 25]
+            assert pool.map(square, range(6), chunksize=4) == [0, 1, 4, 9, 16, 25]
+            assert pool.apply(square, args=(3,)) == 9
+        assert self.lambda_client.invocations == 0
+        assert pool.stats.invocations == 9
+
+    def test_map_local_error(self):
+        with LambdaPool(2, "test-function", backend='local', local_workers=1) as pool:
+            with pytest.raises(LambdaPoolError):
+                pool.map(fail_on_three, range(5))
+
+    def test_executor_map_local(self):
+        with LambdaExecutor("test-function", max_workers=2, backend='local', local_workers=2) as executor:
+            assert list(executor.map(square, range(4))) == [0, 1, 4, 9]
+        assert self.lambda_client.invocations == 0
+
+    def test_warm_local(self):
+        with LambdaPool(2, "test-function", backend='local') as pool:
+            with pytest.raises(LambdaPoolError):
+                pool.warm()
+
+    def test_map_hybrid(self):
+        with LambdaPool(8, "test-function", backend='hybrid', local_workers=2) as pool:
+            assert pool.map(square, range(5)) == [0, 1, 4, 9, 16]
+            assert self.lambda_client.invocations == 5
+            assert pool.map(square, range(2)) == [0, 1]
+            assert self.lambda_client.invocations == 5
+
+    def test_unsupported_backend(self):
+        with pytest.raises(LambdaPoolError):
+            LambdaPool(2, "test-function", backend='gpu')
+
+def concat(a, b):
+    return a + b
+
+class TestPoolMapReduce(FakeLambdaBase):
+    def test_map_reduce_blob_store(self):
+        store = MemoryBlobStore()
+        pool = LambdaPool(4, "test-function", blob_store=store)
+        assert pool.map_reduce(square, concat, range(100), fan_in=4) == sum(n*n for n in range(100))
+        # 25 chunks, then 7, 2 and 1 reductions
+        assert self.lambda_client.invocations == 35
+        assert store.blobs == {}
+
+    def test_map_reduce_without_blob_store(self):
+        pool = LambdaPool(4, "test-function")
+        assert pool.map_reduce(str, concat, range(20), fan_in=3) == ''.join(str(n) for n in range(20))
+        assert self.lambda_client.invocations == 7 + 3 + 1
+
+    def test_map_reduce_single_chunk(self):
+        pool = LambdaPool(4, "test-function", blob_store=MemoryBlobStore())
+        assert pool.map_reduce(square, concat, [1, 2, 3]) == 14
+        assert self.lambda_client.invocations == 1
+
+    def test_map_reduce_chunksize(self):
+        pool = LambdaPool(4, "test-function")
+        assert pool.map_reduce(square, concat, range(10), fan_in=2, chunksize=5) == 285
+        assert self.lambda_client.invocations == 3
+
+    def test_map_reduce_empty(self):
+        pool = LambdaPool(4, "test-function")
+        with pytest.raises(TypeError):
+            pool.map_reduce(square, concat, [])
+
+    def test_map_reduce_error_cleans_up(self):
+        store = MemoryBlobStore()
+        pool = LambdaPool(4, "test-function", blob_store=store)
+        with pytest.raises(LambdaPoolError):
+            pool.map_reduce(square, lambda a, b: a / (b - 25), range(20), fan_in=2)
+        assert store.blobs == {}
+
+    def test_map_reduce_local(self, tmp_path):
+        store = LocalBlobStore(str(tmp_path))
+        with LambdaPool(2, "test-function", backend='local', local_workers=2, blob_store=store) as pool:
+            assert pool.map_reduce(square, concat, range(30), fan_in=3) == sum(n*n for n in range(30))
+        assert self.lambda_client.invocations == 0
+        assert os.listdir(tmp_path) == []
+
+def double(array):
+    return array * 2
+
+def row_sums(array):
+    return array.sum(axis=1)
+
+def total(array):
+    return array.sum()
+
+class TestPoolMapArray(FakeLambdaBase):
+    @pytest.fixture
+    def numpy(self):
+        return pytest.importorskip('numpy')
+
+    def test_map_array(self, numpy):
+        array = numpy.arange(1000, dtype='float64').reshape(100, 10)
+        pool = LambdaPool(4, "test-function")
+        result = pool.map_array(double, array, shards=8)
+        assert numpy.array_equal(result, array * 2)
+        assert self.lambda_client.invocations == 8
+        event = json.loads(self.lambda_client.payloads[0])
+        assert len(event['oob']['buffers']) == 1
+
+    def test_map_array_axis_and_out(self, numpy):
+        array = numpy.arange(60).reshape(3, 20)
+        out = numpy.zeros((3, 20), dtype='int64')
+        pool = LambdaPool(4, "test-function")
+        assert pool.map_array(double, array, axis=1, shards=3, out=out) is out
+        assert numpy.array_equal(out, array * 2)
+        # The columns of a C-order array are copied, to be sent out of band
+        event = json.loads(self.lambda_client.payloads[0])
+        assert len(event['oob']['buffers']) == 1
+
+    def test_map_array_reduced_shape(self, numpy):
+        array = numpy.ones((40, 5))
+        pool = LambdaPool(4, "test-function")
+        assert numpy.array_equal(pool.map_array(row_sums, array), numpy.full(40, 5.0))
+
+    def test_map_array_wrong_length(self, numpy):
+        pool = LambdaPool(4, "test-function")
+        with pytest.raises(LambdaPoolError):
+            pool.map_array(total, numpy.ones((40, 5)))
+
+    def test_map_array_blob_store(self, numpy):
+        store = MemoryBlobStore()
+        array = numpy.arange(10000, dtype='float64')
+        pool = LambdaPool(2, "test-function", blob_store=store, offload_threshold=1000)
+        assert numpy.array_equal(pool.map_array(double, array, shards=4), array * 2)
+        assert 'buffer_refs' in json.loads(self.lambda_client.payloads[0])['oob']
+        assert store.blobs == {}
+
+    def test_map_array_dataframe(self, numpy):
+        pandas = pytest.importorskip('pandas')
+        frame = pandas.DataFrame({'a': range(10), 'b': range(10, 20)})
+        pool = LambdaPool(2, "test-function")
+        assert pool.map_array(double, frame, shards=3).equals(frame * 2)
+
+    def test_map_array_dataframe_default_shards(self, numpy):
+        pandas = pytest.importorskip('pandas')
+        frame = pandas.DataFrame({'a': range(100), 'b': [str(n) for n in range(100)]})
+        pool = LambdaPool(2, "test-function", offload_threshold=2000)
+        assert pool.map_array(double, frame).equals(frame * 2)
+        assert self.lambda_client.invocations > 2
+
+    def test_map_array_offloads_pickle(self, numpy):
+        store = MemoryBlobStore()
+        array = numpy.array([str(n) for n in range(1000)], dtype=object)
+        pool = LambdaPool(2, "test-function", blob_store=store, offload_threshold=1000)
+        assert numpy.array_equal(pool.map_array(double, array, shards=2), array * 2)
+        assert 'pickle_ref' in json.loads(self.lambda_client.payloads[0])['oob']
+        assert store.blobs == {}
@@ -0,0 +1,43 @@
+import base64
+
+from lambdapool.stats import parse_report, InvocationStats, CodecStats
+
+def log_result(log):
+    return base64.b64encode(log.encode('utf-8')).decode('ascii')
+
+REPORT = 'REPORT RequestId: 3604209a\tDuration: 12.34 ms\tBilled Duration: 100 ms\tMemory Size: 1024 MB\tMax Memory Used: 18 MB\t'
+
+def test_parse_report():
+    report = parse_report(log_result(f'START RequestId: 3604209a\nEND RequestId: 3604209a\n{REPORT}\n'))
+    assert report == {'duration': 12.34, 'billed_duration': 100, 'memory_size': 1024, 'max_memory_used': 18}
+
+def test_parse_report_cold_start():
+    report = parse_report(log_result(REPORT + 'Init Duration: 120.50 ms\t'))
+    assert report['init_duration'] == 120.5
+    assert report['duration'] == 12.34
+
+def test_parse_report_missing():
+    assert parse_report(log_result('START RequestId: 3604209a\n')) is None
+
+def test_invocation_stats():
+    stats = InvocationStats()
+    stats.record(parse_report(log_result(REPORT + 'Init Duration: 100 ms\t')), 0.5)
+    stats.record(parse_report(log_result(REPORT)), 0.1)
+    stats.record(None, 0.1)
+
+    assert stats.invocations == 3
+    assert stats.cold_starts == 1
+    assert stats.cold_start_rate == 0.5
+    assert stats.max_memory_used == 18
+    assert stats.billed_gb_seconds == 0.2
+    assert round(stats.overhead, 2) == 700 - 2 * 12.34 - 100
+    assert stats.percentile(50) == 12.34
+    assert dict(stats.duration_histogram())[20] == 2
+
+def test_codec_stats():
+    stats = CodecStats()
+    stats.record_request('zlib', 1000, 100, 0.01)
+    stats.record_response('zlib', 500, 250, 0.01, {'decode': 0.5, 'encode': 0.25})
+    assert stats.request_ratio == 10
+    assert stats.response_ratio == 2
+    assert stats.as_dict()['agent_decode_time'] == 0.5
@@ -2,8 +2,11 @@ from datetime import datetime as dt
 import tempfile
 import pathlib
 import filecmp
+import time
+import itertools
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
 import pytest
-from lambdapool.utils import convert_size, datestr, run_command, copy
+from lambdapool.utils import convert_size, datestr, run_command, copy, chunked, windowed_map
 
 testdata_convert_size = [
     [0, '0 B'],
@@ -56,3 +59,40 @@ def test_copy_directory():
             copy(src, dst)
 
             assert (filecmp.dircmp(src, dst).diff_files) == []
+
+def test_chunked():
+    assert list(chunked(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(chunked([], 2)) == []
+
+def test_chunked_invalid_size():
+    with pytest.raises(ValueError):
+        list(chunked(range(5), 0))
+
+def test_windowed_map():
+    with ThreadPoolExecutor(2) as executor:
+        results = windowed_map(lambda n: executor.submit(abs, n), range(-5, 0), window=2)
+        assert list(results) == [5, 4, 3, 2, 1]
+
+def test_windowed_map_unordered():
+    with ThreadPoolExecutor(2) as executor:
+        results = windowed_map(lambda n: executor.submit(abs, n), range(-5, 0), window=2, ordered=False)
+        assert sorted(results) == [1, 2, 3, 4, 5]
+
+def test_windowed_map_timeout():
+    with ThreadPoolExecutor(2) as executor:
+        results = windowed_map(lambda n: executor.submit(time.sleep, n), [0.5, 0.5], window=2, timeout=0.1)
+        with pytest.raises(TimeoutError):
+            list(results)
+
+def test_windowed_map_bounds_pending():
+    submitted = []
+    def submit(n):
+        submitted.append(n)
+        future = Future()
+        future.set_result(n)
+        return future
+
+    results = windowed_map(submit, itertools.count(), window=3)
+    assert submitted == [0, 1, 2]
+    assert next(results) == 0
+    assert submitted == [0, 1, 2, 3]